@@ -0,0 +1,80 @@
+"""
+Synthetic CoBaLD corpus: 12-column CONLL-U with values from the real inventories
+in inside/*.bin, Zipf-distributed words, a dependency tree in every sentence
+and #NULL nodes at a given density. Run from the repository root:
+
+    python benchmarks/corpus.py out.conllu [-n sentences] [-l mean length] [--nulls density] [--seed seed]
+"""
+import os
+import sys
+import random
+import argparse
+from itertools import accumulate
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from inside.validation import SEMSLOTS, SEMCLASS, DEPRELS, FEATS, POSLIST, XPOSLIST
+
+VOCABULARY = 20000 # distinct words
+FEATVALUES = ('Nom', 'Acc', 'Gen', 'Sing', 'Plur', 'Yes', '1', '3', 'Past', 'Pres') # inventory has names only
+
+class Generator:
+    """Random sentences with the same seed give the same corpus"""
+    def __init__(self, length=15, nulls=0.05, seed=0):
+        self.random = random.Random(seed)
+        self.length = length
+        self.nulls = nulls
+        letters = 'abcdefghijklmnopqrstuvwxyz'
+        self.words = [''.join(self.random.choice(letters) for i in range(self.random.randint(2, 10))) for n in range(VOCABULARY)]
+        self.weights = list(accumulate(1 / rank for rank in range(1, VOCABULARY + 1))) # Zipf's law
+        self.upos, self.xpos = sorted(POSLIST), sorted(XPOSLIST)
+        self.deprels, self.featnames = sorted(DEPRELS), sorted(FEATS)
+        self.semslots, self.semclasses = sorted(SEMSLOTS), sorted(SEMCLASS)
+
+    def feats(self):
+        if self.random.random() < 0.2:
+            return '_'
+        names = sorted(self.random.sample(self.featnames, self.random.randint(1, 3)))
+        return '|'.join(f'{name}={self.random.choice(FEATVALUES)}' for name in names)
+
+    def sentence(self, key):
+        """Lines of sentence block with its empty line"""
+        rand = self.random
+        size = max(1, min(int(rand.expovariate(1 / self.length)) + 1, 10 * self.length))
+        forms = rand.choices(self.words, cum_weights=self.weights, k=size)
+        # a random tree: every word but the root hangs from a word attached before it
+        order = rand.sample(range(1, size + 1), size)
+        heads = {order[0]: 0}
+        for i, word in enumerate(order[1:], 1):
+            heads[word] = order[rand.randrange(i)]
+        lines = [f'# sent_id = {key}', f'# text = {" ".join(forms)}']
+        for word, form in enumerate(forms, 1):
+            deprel = 'root' if heads[word] == 0 else rand.choice(self.deprels)
+            misc = 'SpaceAfter=No' if rand.random() < 0.1 else '_'
+            lines.append('\t'.join((str(word), form, form.lower(), rand.choice(self.upos), rand.choice(self.xpos), self.feats(),
+                                    str(heads[word]), deprel, f'{heads[word]}:{deprel}', misc,
+                                    rand.choice(self.semslots), rand.choice(self.semclasses))))
+            if rand.random() < self.nulls: # ellipsis restored after this word
+                deprel = rand.choice(self.deprels)
+                lines.append('\t'.join((f'{word}.1', '#NULL', '#NULL', rand.choice(self.upos), rand.choice(self.xpos), '_',
+                                        '_', '_', f'{word}:{deprel}', 'Ellipsis', rand.choice(self.semslots), rand.choice(self.semclasses))))
+        return '\n'.join(lines) + '\n\n'
+
+def generate(path, sentences, length=15, nulls=0.05, seed=0):
+    generator = Generator(length, nulls, seed)
+    with open(path, 'w', encoding='utf8') as file:
+        for key in range(1, sentences + 1):
+            file.write(generator.sentence(key))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write a synthetic CoBaLD corpus')
+    parser.add_argument('path')
+    parser.add_argument('-n', '--sentences', type=int, default=10000)
+    parser.add_argument('-l', '--length', type=float, default=15, help='mean tokens per sentence')
+    parser.add_argument('--nulls', type=float, default=0.05, help='#NULL nodes per word')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    generate(args.path, args.sentences, args.length, args.nulls, args.seed)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+"""
+Benchmarks of reading, export, project files, search, renumbering and the editor
+on a synthetic corpus, with the offscreen Qt platform. Results go to JSON,
+so runs on different commits can be compared. Run from the repository root:
+
+    python benchmarks/suite.py [-n sentences] [-l mean length] [--nulls density] [-r repeats] [-o results.json] [--compare old.json]
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from corpus import generate
+from inside.reader import Conllu
+from inside.renumbering import renumber
+
+SAMPLE = 200 # sentences for benchmarks timed call by call
+
+def timed(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+class Suite:
+    """Every bench_ method returns seconds of its runs: one for a whole operation or one per call"""
+    def __init__(self, app, tmp, corpus, repeats):
+        self.app = app
+        self.tmp = tmp
+        self.corpus = corpus
+        self.repeats = repeats
+        self.data = Conllu()
+        self.data.read(corpus)
+        self.sample = sorted(random.Random(0).sample(range(1, len(self.data) + 1), min(SAMPLE, len(self.data))))
+        self.window = None
+
+    def path(self, name):
+        return os.path.join(self.tmp, name)
+
+    def bench_read(self):
+        return [timed(Conllu().read, self.corpus) for i in range(self.repeats)]
+
+    def bench_read_lazy(self):
+        times = []
+        for i in range(self.repeats):
+            data = Conllu()
+            times.append(timed(data.read, self.corpus, True))
+            data.data.close()
+        return times
+
+    def bench_write_conllu(self):
+        return [timed(self.data.write_conllu, self.path('export.conllu')) for i in range(self.repeats)]
+
+    def bench_save(self):
+        times = []
+        for i in range(self.repeats):
+            self.data.log = None # the whole project gets written
+            times.append(timed(self.data.save, self.path('project.cobald')))
+        return times
+
+    def bench_load(self):
+        self.data.log = None
+        self.data.save(self.path('project.cobald'))
+        return [timed(Conllu().load, self.path('project.cobald')) for i in range(self.repeats)]
+
+    def bench_save_database(self):
+        times = []
+        for i in range(self.repeats):
+            self.data.log = None
+            times.append(timed(self.data.save, self.path('project.cobaldb')))
+        return times
+
+    def bench_load_database(self):
+        self.data.log = None
+        self.data.save(self.path('project.cobaldb'))
+        times = []
+        for i in range(self.repeats):
+            data = Conllu()
+            times.append(timed(lambda: (data.load(self.path('project.cobaldb')), data.data[data.current])))
+            data.data.close()
+        return times
+
+    def bench_renumber(self):
+        """A #NULL inserted before the first word and deleted again, per sentence"""
+        times = []
+        for key in self.sample:
+            sent = self.data.data[key]
+            start = time.perf_counter()
+            renumber(sent, inserted=['1'])
+            renumber(sent, deleted=['1'])
+            times.append(time.perf_counter() - start)
+        return times
+
+    def editor(self):
+        if self.window is None:
+            from inside.window import Window
+            self.window = Window()
+            self.window.show()
+            data = Conllu()
+            data.read(self.corpus)
+            self.window.data = data
+            self.window.gotonumber.setMinimum(1)
+            self.window.gotonumber.setMaximum(len(data))
+            self.window.loadsenttogui(1)
+        return self.window
+
+    def bench_loadsenttogui(self):
+        window = self.editor()
+        times = []
+        for key in self.sample:
+            window.data.current = key
+            times.append(timed(window.loadsenttogui, key))
+            self.app.processEvents()
+        return times
+
+    def bench_savesent(self):
+        """Checks and saving of a sentence nobody changed, what every move to another sentence does"""
+        window = self.editor()
+        times = []
+        for key in self.sample:
+            window.data.current = key
+            window.loadsenttogui(key)
+            self.app.processEvents() # the annotator reads the sentence, the editor prepares it
+            times.append(timed(window.savesent, key))
+        return times
+
+    def bench_searching(self):
+        """A frequent word: the first search builds the index"""
+        window = self.editor()
+        window.searchtextinitiate()
+        word = window.data.data[1].tokens[0].form
+        times = []
+        for i in range(self.repeats):
+            window.data.current = 1
+            window.loadsenttogui(1)
+            times.append(timed(window.searching, word, 'word'))
+        window.searchwin.close()
+        return times
+
+def summary(times):
+    return {'runs': len(times), 'median_ms': statistics.median(times) * 1000, 'min_ms': min(times) * 1000, 'max_ms': max(times) * 1000}
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, old):
+    """Lines with median times of both runs, slower ones marked"""
+    lines = []
+    for name, result in results['benchmarks'].items():
+        before = old['benchmarks'].get(name)
+        if before is None:
+            lines.append(f'{name:20} {result["median_ms"]:10.2f} ms')
+            continue
+        ratio = result['median_ms'] / before['median_ms'] if before['median_ms'] else 1.0
+        mark = '  slower' if ratio > 1.1 else '  faster' if ratio < 0.9 else ''
+        lines.append(f'{name:20} {before["median_ms"]:10.2f} -> {result["median_ms"]:10.2f} ms  x{ratio:.2f}{mark}')
+    return lines
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of CoBaLD Editor on a synthetic corpus')
+    parser.add_argument('-n', '--sentences', type=int, default=20000)
+    parser.add_argument('-l', '--length', type=float, default=15, help='mean tokens per sentence')
+    parser.add_argument('--nulls', type=float, default=0.05, help='#NULL nodes per word')
+    parser.add_argument('-r', '--repeats', type=int, default=3, help='runs of whole-corpus benchmarks')
+    parser.add_argument('-k', '--only', action='append', help='run this benchmark only, may be repeated')
+    parser.add_argument('-o', '--output', help='write JSON results here')
+    parser.add_argument('--compare', help='JSON results of an earlier run')
+    args = parser.parse_args(argv)
+    import PyQt5.QtWidgets as QtWidgets
+    app = QtWidgets.QApplication(sys.argv[:1])
+    results = {'commit': commit(), 'python': platform.python_version(), 'platform': platform.platform(),
+               'corpus': {'sentences': args.sentences, 'length': args.length, 'nulls': args.nulls}, 'benchmarks': {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus = os.path.join(tmp, 'corpus.conllu')
+        generate(corpus, args.sentences, args.length, args.nulls)
+        suite = Suite(app, tmp, corpus, args.repeats)
+        results['corpus']['tokens'] = suite.data.store.size
+        names = [name[len('bench_'):] for name in dir(Suite) if name.startswith('bench_')]
+        for name in names:
+            if args.only and name not in args.only:
+                continue
+            result = results['benchmarks'][name] = summary(getattr(suite, 'bench_' + name)())
+            print(f'{name:20} median {result["median_ms"]:10.2f} ms, min {result["min_ms"]:10.2f} ms ({result["runs"]} runs)', file=sys.stderr)
+        if suite.window is not None:
+            suite.window.data = Conllu() # nothing to save on closing
+            suite.window.hide()
+    if args.compare:
+        with open(args.compare, encoding='utf8') as file:
+            print('\n'.join(compare(results, json.load(file))), file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w', encoding='utf8') as file:
+            json.dump(results, file, indent=1)
+    else:
+        json.dump(results, sys.stdout, indent=1)
+        print()
+
+if __name__ == '__main__':
+    main()
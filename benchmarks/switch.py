@@ -0,0 +1,56 @@
+"""
+Sentence switch latency: next/prev through sentences of a given length
+with the offscreen Qt platform. Run from the repository root:
+
+    python benchmarks/switch.py [tokens per sentence] [switches]
+"""
+import os
+import sys
+import time
+import tempfile
+import statistics
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import PyQt5.QtWidgets as QtWidgets
+from inside.reader import Conllu
+
+def makecorpus(path, sentences, length):
+    with open(path, 'w', encoding='utf8') as file:
+        for s in range(1, sentences + 1):
+            print(f'# sent_id = {s}', file=file)
+            print(f'# text = {" ".join(["word"] * length)}', file=file)
+            for i in range(1, length + 1):
+                head = 0 if i == 1 else 1
+                print(f'{i}\tword\tword\tNOUN\tNoun\tCase=Nom|Number=Sing\t{head}\tnsubj\t{head}:nsubj\t_\tAgent\tBEING', file=file)
+            print(file=file)
+
+def main():
+    length = int(sys.argv[1]) if len(sys.argv) > 1 else 80
+    switches = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    app = QtWidgets.QApplication(sys.argv[:1])
+    from inside.window import Window
+    window = Window()
+    window.show()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.conllu')
+        makecorpus(path, 20, length)
+        window.data = Conllu()
+        window.data.read(path)
+        window.gotonumber.setMaximum(len(window.data))
+        window.loadsenttogui(1)
+        timings = []
+        for i in range(switches):
+            start = time.perf_counter()
+            if (i // 10) % 2:
+                window.prevsent()
+            else:
+                window.nextsent()
+            app.processEvents()
+            timings.append((time.perf_counter() - start) * 1000)
+    print(f'{length} tokens, {switches} switches: median {statistics.median(timings):.1f} ms, '
+          f'max {max(timings):.1f} ms, mean {statistics.mean(timings):.1f} ms')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+import re
+import heapq
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from itertools import accumulate
+
+LIMIT = 50 # completions shown at most
+BOUNDARY = re.compile(r'[^\W_]+') # parts of a value: words between _, - and spaces
+END = '\U0010ffff' # bigger than any character, closes a range of keys with a prefix
+
+# how good a match is, better go first; within the same kind more frequent values go first
+EXACT, PREFIX, WORDSTART, SUBSTRING, FUZZY = range(5)
+
+class Completion:
+    """
+    Ranked completion over a list of values, case is ignored.
+    Prefixes are ranges of sorted keys, substrings are looked up in keys joined with \\0,
+    typos are found by walking a trie of keys with a row of edit distances.
+    Values are ranked by kind of match, then by how often the corpus uses them
+    """
+    def __init__(self, values, limit=LIMIT):
+        self.limit = limit
+        values = list(dict.fromkeys(values))
+        pairs = sorted((value.lower(), value) for value in values)
+        self.keys = [key for key, value in pairs] # lowercased, sorted
+        self.values = [value for key, value in pairs] # same order as keys
+        self.joined = ''.join(map('{}\0'.format, self.keys))
+        self.starts = array('I', accumulate((len(key) + 1 for key in self.keys[:-1]), initial=0)) if self.keys else array('I')
+        self.wordstarts = [{part.start() for part in BOUNDARY.finditer(key)} for key in self.keys]
+        self.trie = {} # char -> child node, keys end in nodes having ''
+        for key in self.keys:
+            node = self.trie
+            for char in key:
+                node = node.setdefault(char, {})
+            node[''] = None
+        self.counts = Counter() # value -> uses in corpus
+        self.ranked = None # most used values, what an empty field gets
+
+    def setcounts(self, counts):
+        """Uses of values in a newly loaded corpus"""
+        self.counts = Counter(counts)
+        self.ranked = None
+
+    def add(self, value, count=1):
+        """count more uses of value, negative count takes them away"""
+        self.counts[value] += count
+        self.ranked = None
+
+    def update(self, old, new, count=1):
+        """count token values changed from old to new"""
+        if old != new:
+            self.counts[old] -= count
+            self.counts[new] += count
+            self.ranked = None
+
+    def prefixed(self, prefix):
+        """Range of keys starting with prefix"""
+        return range(bisect_left(self.keys, prefix), bisect_right(self.keys, prefix + END))
+
+    def containing(self, part):
+        """(key number, start of part in key) of keys containing part"""
+        found = []
+        pos = self.joined.find(part)
+        while pos >= 0:
+            i = bisect_right(self.starts, pos) - 1
+            found.append((i, pos - self.starts[i]))
+            pos = self.joined.find(part, pos + 1)
+        return found
+
+    def fuzzy(self, query, limit):
+        """
+        Key numbers with a prefix at most limit edits (with transpositions) from query, and the distance.
+        The first letter is taken as typed, it is seldom wrong and it cuts the trie most.
+        Branches are left as soon as every distance in the row is over limit
+        """
+        found = {}
+        size = len(query)
+        if query[0] not in self.trie:
+            return found
+        # row of distances after the first letter: from query[:i] to it
+        stack = [(self.trie[query[0]], query[0], [1] + list(range(size)), None, '')]
+        while stack:
+            node, prefix, row, before, last = stack.pop()
+            if row[-1] <= limit: # everything below starts with something close to query
+                for i in self.prefixed(prefix):
+                    if found.get(i, limit + 1) > row[-1]:
+                        found[i] = row[-1]
+                if row[-1] == 0:
+                    continue
+            for char, child in node.items():
+                if not char:
+                    continue
+                new = [row[0] + 1]
+                for i in range(1, size + 1):
+                    distance = min(new[i - 1] + 1, row[i] + 1, row[i - 1] + (query[i - 1] != char))
+                    if before is not None and i > 1 and query[i - 1] == last and query[i - 2] == char:
+                        distance = min(distance, before[i - 2] + 1)
+                    new.append(distance)
+                if min(new) <= limit:
+                    stack.append((child, prefix + char, new, row, char))
+        return found
+
+    def complete(self, text):
+        """
+        Values for what is typed, best first. Every kind of match is looked for
+        only if better kinds gave less than limit values, so short prefixes stay cheap
+        """
+        query = text.strip().lower()
+        counts, values = self.counts, self.values
+        rank = lambda i: (kinds[i], -counts[values[i]], values[i])
+        if not query:
+            if self.ranked is None:
+                self.ranked = heapq.nsmallest(self.limit, values, key=lambda value: (-counts[value], value))
+            return self.ranked
+        kinds = {} # key number -> kind of match
+        for i in self.prefixed(query):
+            kinds[i] = EXACT if self.keys[i] == query else PREFIX
+        if len(kinds) < self.limit:
+            for i, pos in self.containing(query):
+                kind = WORDSTART if pos in self.wordstarts[i] else SUBSTRING
+                if kinds.get(i, FUZZY) > kind:
+                    kinds[i] = kind
+        if len(kinds) < self.limit and len(query) > 2: # few good matches: maybe a typo
+            for i, distance in self.fuzzy(query, 1 if len(query) < 6 else 2).items():
+                kinds.setdefault(i, FUZZY + distance)
+        return [values[i] for i in heapq.nsmallest(self.limit, kinds, key=rank)]
@@ -0,0 +1,169 @@
+import os
+import json
+import sqlite3
+from array import array
+from collections import Counter
+from inside.files import replacefile
+
+MAGIC = b'SQLite format 3\x00'
+SUFFIX = '.cobaldb' # projects with this extension are kept in SQLite
+PREFIX = '# sent_id = '
+
+TABLES = '''
+CREATE TABLE meta (name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE sentences (key INTEGER PRIMARY KEY, sent_id TEXT, text TEXT, translation TEXT, checked INTEGER, comment TEXT);
+CREATE TABLE tokens (sentence INTEGER, position INTEGER, idx TEXT, form TEXT, lemma TEXT, upos TEXT, xpos TEXT, feats TEXT,
+                     head TEXT, deprel TEXT, deps TEXT, misc TEXT, semslot TEXT, semclass TEXT,
+                     PRIMARY KEY (sentence, position)) WITHOUT ROWID;
+'''
+# made after the tables are filled, it's quicker that way
+INDEXES = '''
+CREATE INDEX sentences_sent_id ON sentences (sent_id);
+CREATE INDEX tokens_lemma ON tokens (lemma);
+CREATE INDEX tokens_semslot ON tokens (semslot);
+CREATE INDEX tokens_semclass ON tokens (semclass);
+'''
+TOKENROW = 'INSERT INTO tokens VALUES (' + ', '.join(['?'] * 14) + ')'
+BATCH = 500 # keys given to one statement, SQLite limits its parameters
+
+class ProjectDatabase:
+    """
+    Project file as SQLite database: a row for every sentence and every token.
+    Same writing methods as ProjectLog, but a save updates rows of edited sentences
+    in one transaction instead of appending records. Nothing is unpickled when opening,
+    sentences are read by key when they are needed.
+    Writing methods get plain values only and open connections of their own, so they can run in another thread
+    """
+    def __init__(self, path):
+        self.path = path
+        self.connection = None # for reading, made when needed
+
+    @staticmethod
+    def isdatabase(path):
+        with open(path, 'rb') as file:
+            return file.read(len(MAGIC)) == MAGIC
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def needscompaction(self):
+        """Rows are updated in place: the file never needs writing anew"""
+        return False
+
+    def reopen(self):
+        return ProjectDatabase(self.path)
+
+    def reader(self):
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        return self.connection
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def meta(self):
+        return {name: json.loads(value) for name, value in self.reader().execute('SELECT name, value FROM meta')}
+
+    def count(self):
+        return self.reader().execute('SELECT count(*) FROM sentences').fetchone()[0]
+
+    def checkedkeys(self):
+        return [key for key, in self.reader().execute('SELECT key FROM sentences WHERE checked ORDER BY key')]
+
+    def counts(self, names, skip=()):
+        """Same as Snapshot.counts"""
+        columns = ', '.join(names)
+        db = self.reader()
+        counts = Counter(db.execute(f'SELECT {columns} FROM tokens')) # quicker than GROUP BY, which sorts
+        skip = sorted(skip)
+        for start in range(0, len(skip), BATCH): # tokens of skipped sentences are taken away
+            keys = skip[start:start + BATCH]
+            counts.subtract(db.execute(f'SELECT {columns} FROM tokens WHERE sentence IN ({", ".join("?" * len(keys))})', keys))
+        return +counts
+
+    def sentences(self, keys):
+        """Dumps of sentences with keys, same as Sentence.dump gives but with tokens as lists of values: key -> dump"""
+        db = self.reader()
+        dumps = {}
+        for span in runs(keys): # sparse keys, e.g. checked sentences, must not read everything between them
+            for key, sentid, text, translation, checked, comment in db.execute(
+                    'SELECT * FROM sentences WHERE key BETWEEN ? AND ?', span):
+                dumps[key] = (PREFIX + sentid, text, translation, bool(checked), comment, [])
+            for row in db.execute('SELECT * FROM tokens WHERE sentence BETWEEN ? AND ? ORDER BY sentence, position', span):
+                dumps[row[0]][5].append(list(row[2:]))
+        return dumps
+
+    def sentence(self, key):
+        try:
+            return self.sentences((key,))[key]
+        except KeyError:
+            raise KeyError(key) from None
+
+    def insert(self, db, meta, sents):
+        db.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)', ((name, json.dumps(value)) for name, value in meta.items()))
+        count = 0
+        for key, (idx, text, translation, checked, comment, tokens) in sents:
+            db.execute('INSERT OR REPLACE INTO sentences VALUES (?, ?, ?, ?, ?, ?)',
+                       (key, idx[len(PREFIX):] if idx.startswith(PREFIX) else idx, text, translation, int(checked), comment))
+            db.executemany(TOKENROW, ([key, position] + values for position, values in enumerate(tokens)))
+            count += 1
+        return count
+
+    def write(self, meta, sents, store=None, swap=None):
+        """
+        Write the whole project: sents is an iterable of (key, dump), their tokens may be rows of store dump.
+        Swap is the same as for replacefile
+        """
+        if store is not None:
+            sents = storedvalues(sents, store)
+        else:
+            sents = ((key, dump[:5] + (tokenvalues(dump[5]),)) for key, dump in sents)
+        def write(path):
+            db = sqlite3.connect(path)
+            try: # no journal for the new file: it goes to disk as a whole
+                db.executescript('PRAGMA journal_mode = OFF; PRAGMA synchronous = OFF;' + TABLES)
+                with db:
+                    self.insert(db, meta, sents)
+                db.executescript(INDEXES)
+            finally:
+                db.close()
+            self.close()
+        replacefile(self.path, write, swap)
+
+    def append(self, meta, sents):
+        """Replace rows of edited sentences, all of them or none"""
+        db = sqlite3.connect(self.path)
+        try:
+            with db: # one transaction
+                sents = [(key, dump[:5] + (tokenvalues(dump[5]),)) for key, dump in sents]
+                db.executemany('DELETE FROM tokens WHERE sentence = ?', ((key,) for key, dump in sents))
+                self.insert(db, meta, sents)
+        finally:
+            db.close()
+
+def runs(keys):
+    """(first, last) of every run of keys following one another"""
+    spans = []
+    for key in sorted(set(keys)):
+        if spans and spans[-1][1] == key - 1:
+            spans[-1][1] = key
+        else:
+            spans.append([key, key])
+    return spans
+
+def tokenvalues(tokens):
+    """Tokens of a dump as lists of values"""
+    return [token.split('\t') if isinstance(token, str) else token for token in tokens]
+
+def storedvalues(sents, store):
+    """Sentence dumps with tokens as rows of store dump, tokens given as lists of values"""
+    values, columns, size = store
+    pools = list(values.values()) # both in column order
+    columns = [array('I', column) for column in columns.values()]
+    for key, (idx, text, translation, checked, comment, tokens) in sents:
+        rows = array('I')
+        rows.frombytes(tokens)
+        yield key, (idx, text, translation, checked, comment,
+                    [[pool[column[row]] for pool, column in zip(pools, columns)] for row in rows])
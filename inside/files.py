@@ -0,0 +1,19 @@
+import os
+
+def replacefile(path, write, swap=None):
+    """
+    Write the file at path anew: write is called with the path to write to. A crash while writing
+    must not hurt the old file, so the new one is written next to it, goes to disk and only then takes its place.
+    Swap, if given, is called with the function replacing the old file, to close whatever maps it around that
+    """
+    tmp = path + '.tmp'
+    if os.path.exists(tmp): # left by a crash
+        os.remove(tmp)
+    write(tmp)
+    with open(tmp, 'rb+') as file:
+        os.fsync(file.fileno())
+    replace = lambda: os.replace(tmp, path)
+    if swap is None:
+        replace()
+    else:
+        swap(replace)
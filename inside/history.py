@@ -0,0 +1,126 @@
+import pickle
+from collections import deque
+from inside.sidecar import Sidecar
+
+SUFFIX = '.history' # file next to the project
+LIMIT = 64 # megabytes of history kept by default
+CHANGESIZE = 120 # rough bytes a change takes: its tuple and references
+TOKENSIZE = 160 # same for a token of a token list: a list of 12 references, values are shared with the store
+
+class Step:
+    """One undoable action: changes are (sentence key, token position, field name, old value, new value)"""
+    __slots__ = ('label', 'group', 'changes', 'size')
+
+    def __init__(self, label, group=None):
+        self.label = label
+        self.group = group # later records of the same group join this step
+        self.changes = []
+        self.size = 0
+
+    def add(self, changes):
+        for change in changes:
+            self.changes.append(change)
+            self.size += changesize(change)
+
+def changesize(change):
+    key, position, name, old, new = change
+    if name == 'tokens':
+        return CHANGESIZE + TOKENSIZE * (len(old) + len(new))
+    return CHANGESIZE
+
+class History(Sidecar):
+    """
+    Undo and redo of edits of Conllu data, kept as changes of values, not as widgets or copies of sentences.
+    A change of a token field has its position in sentence, a change of a sentence field (text, translation,
+    checked, comment) has position None, and adding or deleting tokens is a change of 'tokens'
+    with lists of token values before and after. Undo and redo take as long as there are changes in a step.
+    Oldest steps are dropped when the history needs more memory than limit.
+    Limit and persistence are preferences of the editor, same for every project
+    """
+    limit = LIMIT * 1024 * 1024 # bytes
+    persist = False # history is saved next to project file and restored with it
+    suffix = SUFFIX
+
+    def __init__(self):
+        super().__init__()
+        self.done = deque() # steps that can be undone, oldest first
+        self.undone = [] # steps that can be redone, latest undone last
+        self.size = 0 # of both
+
+    def __len__(self):
+        return len(self.done)
+
+    def record(self, label, changes, group=None):
+        """
+        Add a step: nothing can be redone after it. Changes of a group
+        that comes again right after its last step are added to that step
+        """
+        changes = list(changes)
+        if not changes:
+            return
+        self.size -= sum(step.size for step in self.undone)
+        self.undone = []
+        if group is not None and self.done and self.done[-1].group is group:
+            step = self.done[-1]
+            self.size -= step.size
+        else:
+            step = Step(label, group)
+            self.done.append(step)
+        step.add(changes)
+        self.size += step.size
+        self.changed = True
+        self.trim()
+
+    def trim(self):
+        """Drop oldest steps while over limit, the latest one stays whatever its size"""
+        while self.size > self.limit and len(self.done) > 1:
+            self.size -= self.done.popleft().size
+        while self.size > self.limit and self.undone:
+            self.size -= self.undone.pop(0).size
+
+    def undo(self):
+        """Step to undo, its changes go backward: None if there is nothing to undo"""
+        if not self.done:
+            return None
+        step = self.done.pop()
+        step.group = None # nothing joins a step once it was undone
+        self.undone.append(step)
+        self.changed = True
+        return step
+
+    def redo(self):
+        """Step to redo, None if there is nothing to redo"""
+        if not self.undone:
+            return None
+        step = self.undone.pop()
+        self.done.append(step)
+        self.changed = True
+        return step
+
+    def snapshot(self):
+        # a step of a group may still get changes while the job runs: it takes copies of change lists
+        steps = [(step.label, list(step.changes)) for step in self.done], [(step.label, list(step.changes)) for step in self.undone]
+        return lambda: pickle.dumps(steps, pickle.HIGHEST_PROTOCOL)
+
+    def savejob(self, path):
+        if not self.persist:
+            return lambda: None
+        return super().savejob(path)
+
+    @classmethod
+    def load(cls, path):
+        """History saved next to project file at path, empty if there is none for this state of the file"""
+        history = cls()
+        saved = cls.read(path) if cls.persist else None
+        if saved is None: # editing starts with no history
+            return history
+        stamp, (done, undone) = saved
+        for steps, target in ((done, history.done), (undone, history.undone)):
+            for label, changes in steps:
+                step = Step(label)
+                step.add(changes)
+                target.append(step)
+                history.size += step.size
+        history.stamp, history.changed = stamp, False
+        history.trim()
+        return history
@@ -0,0 +1,40 @@
+"""
+Move a project to SQLite storage: old pickled projects and record logs are read
+the way the editor reads them and written as a .cobaldb database. Run from the repository root:
+
+    python -m inside.migrate project.cobald [project.cobaldb]
+
+Without the second path the database goes next to the project, with the same name
+"""
+import os
+import sys
+import argparse
+from inside.reader import Conllu
+from inside.database import SUFFIX
+
+def migrate(path, target=None):
+    """Write project at path to a SQLite database, returns its path"""
+    target = target or os.path.splitext(path)[0] + SUFFIX
+    if not target.endswith(SUFFIX):
+        raise ValueError(f'database must have {SUFFIX} extension: {target}')
+    data = Conllu()
+    data.load(path)
+    data.save(target)
+    return target
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert CoBaLD project to SQLite storage')
+    parser.add_argument('path')
+    parser.add_argument('target', nargs='?', help=f'database to write, {SUFFIX} extension')
+    args = parser.parse_args(argv)
+    if not os.path.exists(args.path):
+        parser.error(f'no such file: {args.path}')
+    try:
+        target = migrate(args.path, args.target)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f'{args.path} -> {target}', file=sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
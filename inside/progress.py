@@ -0,0 +1,58 @@
+from array import array
+
+BLOCK = 1000 # sentences in a range of progress statistics
+
+class CheckedIndex:
+    """
+    Checked marks of all sentences as a bitmap: a byte for every key, 1 if checked,
+    and numbers of checked sentences in every block of keys. Next and previous
+    unchecked sentences are looked up in the bitmap by bytes.find, statistics are counted as marks change
+    """
+    def __init__(self, size, block=BLOCK):
+        self.size = size # keys are 1..size
+        self.block = block
+        self.bitmap = bytearray(size + 1)
+        self.bitmap[0] = 1 # no sentence 0, it never comes as unchecked
+        self.blocks = array('I', bytes(4 * ((size + block - 1) // block))) # block of key is (key - 1) // block
+        self.checked = 0
+
+    @classmethod
+    def build(cls, data):
+        """Index of Conllu.data: lazy data is not read through, marks come from its source and edited sentences"""
+        index = cls(len(data))
+        pinned = getattr(data, 'pinned', None)
+        if pinned is not None:
+            for key in data.checkedkeys():
+                index.update(key, True)
+        for key, sent in (pinned if pinned is not None else data).items():
+            index.update(key, sent.checked)
+        return index
+
+    def update(self, key, checked):
+        if self.bitmap[key] == checked:
+            return
+        self.bitmap[key] = checked
+        step = 1 if checked else -1
+        self.blocks[(key - 1) // self.block] += step
+        self.checked += step
+
+    def next(self, key):
+        """First unchecked sentence after key, from the start if there is none after it; None if all are checked"""
+        found = self.bitmap.find(0, key + 1)
+        if found < 0:
+            found = self.bitmap.find(0, 1, key + 1)
+        return found if found > 0 else None
+
+    def previous(self, key):
+        """Last unchecked sentence before key, from the end if there is none before it; None if all are checked"""
+        found = self.bitmap.rfind(0, 1, key)
+        if found < 0:
+            found = self.bitmap.rfind(0, key)
+        return found if found > 0 else None
+
+    def percent(self):
+        return 100 * self.checked / self.size if self.size else 0.0
+
+    def ranges(self):
+        """(first key, last key, checked sentences) of every block"""
+        return [(number * self.block + 1, min(self.size, (number + 1) * self.block), checked) for number, checked in enumerate(self.blocks)]
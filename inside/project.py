@@ -0,0 +1,263 @@
+import os
+import json
+import zlib
+import mmap
+import pickle
+import struct
+from array import array
+from collections import Counter
+from itertools import accumulate
+from inside.files import replacefile
+
+MAGIC = b'COBALD-LOG 1\n' # log of pickled records only, as written before snapshots
+MAPMAGIC = b'COBALD-MAP 1\n\0\0\0' # snapshot, then log records; 16 bytes keep sections aligned
+HEADER = struct.Struct('<II') # record length, crc32 of record
+SNAPSHOT = struct.Struct('<QQQQ') # end of snapshot, sentences, tokens, columns
+BATCH = 1000 # sentences per record when writing the whole project
+NOTEXT, NOTRANSLATION, CHECKED = 1, 2, 4 # sentence flags in snapshot
+STRINGS = 4 # sentence id, text, translation and comment of every sentence
+
+def sectioncount(columns):
+    """Sections of snapshot: meta and column names, then pool ends, pool text and codes of every column, row starts and flags of sentences, ends and text of every sentence string"""
+    return 1 + 3 * columns + 2 + 2 * STRINGS
+
+class ProjectLog:
+    """
+    Project file as a log of records: (meta, [(key, sentence dump), ...], store dump).
+    A full write puts a Snapshot of all sentences in, a save appends records with
+    only edited ones, later records override earlier ones when reading.
+    Files written before snapshots start with a record of the whole token store.
+    Writing methods get plain values only, so they can run in another thread
+    """
+    def __init__(self, path):
+        self.path = path
+        self.end = 0 # end of the last good record
+        self.records = 0 # sentence records in file
+        self.live = 0 # distinct sentences in file
+
+    @staticmethod
+    def isproject(path):
+        """Check if file is a project log and not an old pickled project"""
+        with open(path, 'rb') as file:
+            start = file.read(len(MAPMAGIC))
+        return start == MAPMAGIC or start[:len(MAGIC)] == MAGIC
+
+    def read(self):
+        """
+        Read records: returns last meta, last dump for every sentence key and store dump.
+        Files with a snapshot give Snapshot instead of store dump and only records written after it
+        """
+        meta, dumps, store = {}, {}, None
+        with open(self.path, 'rb') as file:
+            if file.read(len(MAPMAGIC)) == MAPMAGIC:
+                store = Snapshot(self.path)
+                meta, start = store.meta, store.end
+                self.records = store.size
+            else:
+                start = 0
+            file.seek(start)
+            data = file.read()
+        pos = 0 if start else len(MAGIC)
+        while pos + HEADER.size <= len(data):
+            length, crc = HEADER.unpack_from(data, pos)
+            record = data[pos + HEADER.size:pos + HEADER.size + length]
+            if len(record) < length or zlib.crc32(record) != crc:
+                break # broken tail, e.g. crash while saving: everything before it is fine
+            meta, sents, base = pickle.loads(record)
+            if base is not None:
+                store = base
+            for key, dump in sents:
+                dumps[key] = dump
+            self.records += len(sents)
+            pos += HEADER.size + length
+        self.end = start + pos
+        self.live = store.size if isinstance(store, Snapshot) else len(dumps)
+        return meta, dumps, store
+
+    def pack(self, meta, sents, store=None):
+        record = pickle.dumps((meta, sents, store), pickle.HIGHEST_PROTOCOL)
+        return HEADER.pack(len(record), zlib.crc32(record)) + record
+
+    def write(self, meta, sents, store, swap=None):
+        """
+        Write the whole project as a snapshot: sents is an iterable of (key, dump) for keys 1, 2, ...
+        with tokens as rows of store dump. Swap is the same as for replacefile
+        """
+        parts, end, size = snapshot(meta, sents, store)
+        def write(path):
+            with open(path, 'wb') as file:
+                for part in parts:
+                    file.write(part)
+                self.end = file.tell()
+        replacefile(self.path, write, swap)
+        self.records = self.live = size
+
+    def append(self, meta, sents):
+        """Add records for edited sentences to the end of file"""
+        with open(self.path, 'r+b') as file:
+            file.seek(self.end)
+            file.write(self.pack(meta, sents))
+            self.end = file.tell()
+            if self.end < os.fstat(file.fileno()).st_size: # a broken tail is left after the record
+                try:
+                    file.truncate()
+                except OSError: # the file is mapped on Windows: reading stops at the tail all the same
+                    pass
+            file.flush()
+            os.fsync(file.fileno())
+        self.records += len(sents)
+
+    def needscompaction(self):
+        """Too many overridden records: time to write the project anew"""
+        return self.records - self.live > max(self.live, BATCH)
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+def snapshot(meta, sents, store):
+    """Parts of file with snapshot of sentences, its end and number of sentences: sections are aligned to 8 bytes"""
+    values, columns, size = store
+    pools = list(values.values()) # both in column order
+    columns = [array('I', column) for column in columns.values()]
+    strings = [[] for i in range(STRINGS)]
+    flags = bytearray()
+    rows = array('I')
+    starts = array('Q', [0])
+    for number, (key, (idx, text, translation, checked, comment, tokens)) in enumerate(sents, 1):
+        if key != number:
+            raise ValueError(f'sentence keys must go 1, 2, ...: {key} after {number - 1}')
+        flags.append((text is None) * NOTEXT | (translation is None) * NOTRANSLATION | bool(checked) * CHECKED)
+        for i, value in enumerate((idx, text, translation, comment)):
+            strings[i].append((value or '').encode('utf8'))
+        rows.frombytes(tokens)
+        starts.append(len(rows))
+    if rows != array('I', range(len(rows))): # tokens aren't in sentence order in store
+        columns = [array('I', map(column.__getitem__, rows)) for column in columns]
+    sections = [json.dumps({'meta': meta, 'columns': list(values)}).encode('utf8')]
+    for pool, column in zip(pools, columns):
+        encoded = [value.encode('utf8') for value in pool]
+        sections.extend((array('Q', accumulate(map(len, encoded), initial=0)).tobytes(), b''.join(encoded), column.tobytes()))
+    sections.extend((starts.tobytes(), bytes(flags)))
+    for encoded in strings:
+        sections.extend((array('Q', accumulate(map(len, encoded), initial=0)).tobytes(), b''.join(encoded)))
+    directory = array('Q')
+    pos = len(MAPMAGIC) + SNAPSHOT.size + 16 * len(sections)
+    for section in sections:
+        directory.extend((pos, len(section)))
+        pos += len(section) + -len(section) % 8
+    parts = [MAPMAGIC, SNAPSHOT.pack(pos, len(flags), len(rows), len(pools)), directory.tobytes()]
+    for section in sections:
+        parts.extend((section, bytes(-len(section) % 8)))
+    return parts, pos, len(flags)
+
+class PoolValues(dict):
+    """Values of a pool in snapshot by code, decoded when they are first asked for"""
+    def __init__(self, ends, text):
+        super().__init__()
+        self.ends = ends
+        self.text = text
+
+    def __missing__(self, code):
+        value = self[code] = str(self.text[self.ends[code]:self.ends[code + 1]], 'utf8')
+        return value
+
+class Snapshot:
+    """
+    Sentences of a project file written as a whole, read from mapped file: string pools and codes
+    of every column, token rows and strings of every sentence. Nothing is decoded when opening,
+    a sentence is decoded when it is asked for, a pool value when a sentence has it
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.end, self.size, self.tokens, columns = SNAPSHOT.unpack_from(self.mm, len(MAPMAGIC))
+        directory = struct.unpack_from(f'<{2 * sectioncount(columns)}Q', self.mm, len(MAPMAGIC) + SNAPSHOT.size)
+        view = memoryview(self.mm)
+        sections = [view[start:start + length] for start, length in zip(directory[::2], directory[1::2])]
+        self.views = [view] + sections # all of them go before the file is closed
+        head = json.loads(bytes(sections[0]))
+        self.meta, self.names = head['meta'], head['columns']
+        self.pools = [(self.cast(sections[1 + 3 * i], 'Q'), sections[2 + 3 * i]) for i in range(columns)]
+        self.codes = [self.cast(sections[3 + 3 * i], 'I') for i in range(columns)]
+        rest = sections[1 + 3 * columns:]
+        self.starts, self.flags = self.cast(rest[0], 'Q'), rest[1]
+        self.strings = [(self.cast(rest[2 + 2 * i], 'Q'), rest[3 + 2 * i]) for i in range(STRINGS)]
+        self.decoded = [PoolValues(*pool) for pool in self.pools] # code -> value of every column, as far as they were needed
+
+    def cast(self, section, code):
+        view = section.cast(code)
+        self.views.append(view)
+        return view
+
+    def reopen(self):
+        return Snapshot(self.path)
+
+    def close(self):
+        for view in reversed(self.views):
+            view.release()
+        self.mm.close()
+        self.file.close()
+
+    def count(self):
+        return self.size
+
+    def string(self, field, i):
+        ends, text = self.strings[field]
+        return str(text[ends[i]:ends[i + 1]], 'utf8')
+
+    def sentence(self, key):
+        """Dump of sentence with tokens as tuples of values, same as Sentence.dump otherwise"""
+        if not 0 < key <= self.size:
+            raise KeyError(key)
+        i = key - 1
+        flags, start, end = self.flags[i], self.starts[i], self.starts[i + 1]
+        columns = [map(decoded.__getitem__, codes[start:end]) for decoded, codes in zip(self.decoded, self.codes)]
+        return (self.string(0, i), None if flags & NOTEXT else self.string(1, i), None if flags & NOTRANSLATION else self.string(2, i),
+                bool(flags & CHECKED), self.string(3, i), list(zip(*columns)))
+
+    def sentences(self, keys):
+        """Dumps of sentences with keys: tokens of a run of keys are decoded at once"""
+        keys = sorted(keys)
+        if not keys or keys[-1] - keys[0] + 1 != len(keys):
+            return {key: self.sentence(key) for key in keys}
+        first, last = keys[0] - 1, keys[-1]
+        if first < 0 or last > self.size:
+            raise KeyError(keys[0] if first < 0 else last)
+        start = self.starts[first]
+        tokens = list(zip(*(map(decoded.__getitem__, codes[start:self.starts[last]]) for decoded, codes in zip(self.decoded, self.codes))))
+        dumps = {}
+        for i in range(first, last):
+            flags = self.flags[i]
+            dumps[i + 1] = (self.string(0, i), None if flags & NOTEXT else self.string(1, i), None if flags & NOTRANSLATION else self.string(2, i),
+                            bool(flags & CHECKED), self.string(3, i), tokens[self.starts[i] - start:self.starts[i + 1] - start])
+        return dumps
+
+    def checkedkeys(self):
+        flags = self.flags
+        return [i + 1 for i in range(self.size) if flags[i] & CHECKED]
+
+    def counts(self, names, skip=()):
+        """How many tokens have every combination of values of columns names, sentences with keys in skip left out"""
+        columns = [self.names.index(name) for name in names]
+        runs, start = [], 0 # token rows between skipped sentences
+        for key in sorted(skip):
+            runs.append((start, self.starts[key - 1]))
+            start = self.starts[key]
+        runs.append((start, self.tokens))
+        codes = Counter()
+        for start, end in runs: # codes are counted, values are decoded once for every combination
+            codes.update(zip(*(self.codes[column][start:end] for column in columns)))
+        decoded = [self.decoded[column] for column in columns]
+        return Counter({tuple(pool[code] for pool, code in zip(decoded, combination)): count for combination, count in codes.items()})
+
+    def dump(self):
+        """Everything at once, for reading small projects into memory: sentence dumps with rows and store dump"""
+        values = {name: [str(text[ends[i]:ends[i + 1]], 'utf8') for i in range(len(ends) - 1)] for name, (ends, text) in zip(self.names, self.pools)}
+        store = (values, {name: codes.tobytes() for name, codes in zip(self.names, self.codes)}, self.tokens)
+        dumps = {}
+        for i in range(self.size):
+            flags = self.flags[i]
+            dumps[i + 1] = (self.string(0, i), None if flags & NOTEXT else self.string(1, i), None if flags & NOTRANSLATION else self.string(2, i),
+                            bool(flags & CHECKED), self.string(3, i), array('I', range(self.starts[i], self.starts[i + 1])).tobytes())
+        return dumps, store
@@ -0,0 +1,358 @@
+import re
+from array import array
+from collections import Counter
+from itertools import accumulate, compress, repeat
+
+# sentence fields a query can look at, besides token columns
+METADATA = ('checked', 'comment', 'translation', 'text')
+ALIASES = {'id': 'idx'}
+TRUE = ('yes', 'true', '1')
+FALSE = ('no', 'false', '0')
+LEXER = re.compile(r'\s*(?:(!=|=|~)|([&|!()])|"((?:[^"\\]|\\.)*)"|([^\s&|!()=~"]+))')
+STALE = 1000 # edited sentences the indexes may lag behind, more means rebuilding them
+UNPOSTED = ('idx', 'head') # columns of lazy corpora without postings: nearly every sentence has their values
+
+class QueryError(Exception):
+    """Query that can't be parsed"""
+
+class Cond:
+    """field op value: field is a token column, head.column or sentence metadata"""
+    def __init__(self, field, op, value):
+        self.head = field.startswith('head.')
+        name = field[len('head.'):] if self.head else field
+        self.name = ALIASES.get(name, name)
+        self.op = op
+        self.value = value
+        if op == '~':
+            try:
+                self.pattern = re.compile(value)
+            except re.error as e:
+                raise QueryError(f'Incorrect regular expression {value}: {e}')
+        if self.name == 'checked':
+            if op == '~' or value.lower() not in TRUE + FALSE:
+                raise QueryError(f'checked can only be equal to yes or no, not {value}')
+            self.value = value.lower() in TRUE
+
+    def match(self, value):
+        if self.op == '=':
+            return value == self.value
+        if self.op == '!=':
+            return value != self.value
+        return value is not None and self.pattern.search(value) is not None
+
+class Not:
+    def __init__(self, node):
+        self.node = node
+
+class And:
+    def __init__(self, nodes):
+        self.nodes = nodes
+
+class Or:
+    def __init__(self, nodes):
+        self.nodes = nodes
+
+def parse(query, columns):
+    """
+    Query to a tree of Cond, Not, And, Or. Conditions are field=value,
+    field!=value and field~regex; & binds tighter than |, ! negates,
+    values with spaces or special characters go in double quotes:
+    semslot=Agent & (deprel=obl | deprel=nmod) & checked=no & feats~"Case=(Ins|Dat)"
+    """
+    tokens = []
+    pos = 0
+    query = query.strip()
+    while pos < len(query):
+        found = LEXER.match(query, pos)
+        if found is None or found.end() == pos:
+            raise QueryError(f'Unexpected symbol at {pos + 1}: {query[pos:]}')
+        op, punct, quoted, word = found.groups()
+        if quoted is not None:
+            tokens.append(('value', re.sub(r'\\(.)', r'\1', quoted)))
+        elif word is not None:
+            tokens.append(('value', word))
+        else:
+            tokens.append((op or punct, None))
+        pos = found.end()
+    fields = set(columns) | set(METADATA) | set(ALIASES) | {f'head.{name}' for name in set(columns) | set(ALIASES)}
+
+    def take(kind=None):
+        if not tokens:
+            raise QueryError('Query ended too early')
+        if kind is not None and tokens[0][0] != kind:
+            raise QueryError(f'Expected {kind}, got {tokens[0][1] or tokens[0][0]}')
+        return tokens.pop(0)
+
+    def expr():
+        nodes = [conj()]
+        while tokens and tokens[0][0] == '|':
+            take()
+            nodes.append(conj())
+        return nodes[0] if len(nodes) == 1 else Or(nodes)
+
+    def conj():
+        nodes = [unary()]
+        while tokens and tokens[0][0] == '&':
+            take()
+            nodes.append(unary())
+        return nodes[0] if len(nodes) == 1 else And(nodes)
+
+    def unary():
+        kind = tokens[0][0] if tokens else None
+        if kind == '!':
+            take()
+            return Not(unary())
+        if kind == '(':
+            take()
+            node = expr()
+            take(')')
+            return node
+        field = take('value')[1].lower()
+        if field not in fields:
+            raise QueryError(f'Unknown field: {field}')
+        op = take()[0]
+        if op not in ('=', '!=', '~'):
+            raise QueryError(f'Expected =, != or ~ after {field}')
+        return Cond(field, op, take('value')[1])
+
+    if not tokens:
+        raise QueryError('Query is empty')
+    node = expr()
+    if tokens:
+        raise QueryError(f'Unexpected {tokens[0][1] or tokens[0][0]}')
+    return node
+
+class ValueIndex:
+    """Rows of a column grouped by value code: rows of code c are order[starts[c]:starts[c + 1]]"""
+    def __init__(self, codes, size):
+        counts = Counter(codes)
+        self.starts = array('I', accumulate((counts[code] for code in range(size)), initial=0))
+        self.order = array('I', sorted(range(len(codes)), key=codes.__getitem__))
+
+    def rows(self, code):
+        if code + 1 >= len(self.starts):
+            return ()
+        return self.order[self.starts[code]:self.starts[code + 1]]
+
+class QueryIndex:
+    """
+    Queries over tokens of Conllu: per-column value indexes over the token store,
+    built when a column is first asked for. Sentences edited after that
+    are checked one by one until there are too many of them, then indexes are built anew.
+    Lazy corpora have no common store: postings of every column value are built
+    in one pass over the file, and only sentences they give get checked one by one
+    """
+    def __init__(self, conllu):
+        self.conllu = conllu
+        self.data = None # sentences the indexes are built for
+        self.store = None # store the indexes are built for, None for lazy corpora
+        self.stale = set() # sentences edited since building
+        self.version = 0 # grows with every edit, results of older versions are stale
+
+    def reset(self):
+        self.data = self.conllu.data
+        self.store = self.conllu.store if isinstance(self.data, dict) else None
+        self.stale = set()
+        self.indexes = {} # column -> ValueIndex
+        self.headrows = None # row -> row of its head + 1, 0 for no head
+        self.universe = None # all rows in sentences
+        self.postings = {} # lazy corpus: column -> value code -> sorted keys of sentences with the value
+        if self.store is None:
+            self.build()
+            return
+        self.pools = self.store.pools # values of codes
+        size = self.store.size
+        self.rowkeys = array('I', bytes(4 * size)) # row -> key of its sentence, 0 for deleted tokens
+        self.positions = array('I', bytes(4 * size)) # row -> token position in sentence
+        for key, sent in self.conllu.data.items():
+            rows = sent.rows
+            if rows and rows[-1] < size and rows == array('I', range(rows[0], rows[0] + len(rows))): # one piece, the usual case
+                self.rowkeys[rows[0]:rows[-1] + 1] = array('I', [key]) * len(rows)
+                self.positions[rows[0]:rows[-1] + 1] = array('I', range(len(rows)))
+                continue
+            for position, row in enumerate(rows):
+                if row < size:
+                    self.rowkeys[row] = key
+                    self.positions[row] = position
+
+    def build(self):
+        """Postings of lazy corpus: they hold sentences as they are in the file, edited ones are stale from the start"""
+        data = self.data
+        self.stale = set(data.pinned)
+        self.pools = data.pools
+        postings = self.postings = {name: [] for name in self.pools if name not in UNPOSTED}
+        for key, sent in data.scan(saved=True):
+            self.pools, columns = sent.store.pools, sent.store.columns # all sentences read share pools, every one has a store of its own
+            for name, keys in postings.items():
+                if len(keys) < len(self.pools[name].values): # new values
+                    keys.extend(array('I') for code in range(len(keys), len(self.pools[name].values)))
+                list(map(array.append, map(keys.__getitem__, set(columns[name])), repeat(key)))
+
+    def touch(self, key):
+        """Sentence was edited"""
+        self.version += 1
+        if self.data is not None:
+            self.stale.add(key)
+
+    def find(self, query):
+        """Tokens matching query: sorted list of (sentence key, [token positions]); raises QueryError"""
+        node = parse(query, self.conllu.store.columns)
+        data = self.conllu.data
+        lazy = not isinstance(data, dict)
+        if self.data is not data or not lazy and (self.store is not self.conllu.store or len(self.stale) > max(STALE, len(data) // 20)):
+            self.reset()
+        if lazy: # edited sentences stay pinned, building anew would not make them fewer
+            keys = self.keys(node)
+            pinned = data.pinned
+            source = data.reopen()
+            try:
+                keys = source if keys is None else sorted(keys | self.stale)
+                found = [(key, self.scan(node, pinned[key] if key in pinned else source.parse(key))) for key in keys]
+            finally:
+                source.close()
+            return [(key, sorted(positions)) for key, positions in found if positions]
+        hits = {}
+        stale = self.stale
+        rowkeys, positions = self.rowkeys, self.positions
+        size = len(rowkeys)
+        for row in sorted(self.rows(node)):
+            key = rowkeys[row] if row < size else 0 # rows added after building belong to edited sentences
+            if key and key not in stale:
+                hits.setdefault(key, []).append(positions[row])
+        for key in stale:
+            found = self.scan(node, data[key])
+            if found:
+                hits[key] = found
+        return [(key, sorted(hits[key])) for key in sorted(hits)]
+
+    def keys(self, node):
+        """Keys of lazy corpus sentences that may match node by postings, None if any of them may"""
+        if isinstance(node, And):
+            found = None
+            for keys in map(self.keys, node.nodes):
+                if keys is not None:
+                    found = keys if found is None else found & keys
+            return found
+        if isinstance(node, Or):
+            found = set()
+            for keys in map(self.keys, node.nodes):
+                if keys is None:
+                    return None
+                found |= keys
+            return found
+        if isinstance(node, Not) or node.name not in self.postings:
+            return None
+        # a sentence has a token matching node, or the head of one, only if it has the value somewhere
+        postings = self.postings[node.name]
+        return set().union(*(postings[code] for code in self.codes(node) if code < len(postings)))
+
+    def index(self, name):
+        if name not in self.indexes:
+            self.indexes[name] = ValueIndex(self.store.columns[name], len(self.store.pools[name].values))
+        return self.indexes[name]
+
+    def rows(self, node):
+        """Set of store rows matching node"""
+        if isinstance(node, And):
+            return self.conj(node.nodes)
+        if isinstance(node, Or):
+            return set().union(*map(self.rows, node.nodes))
+        if isinstance(node, Not):
+            return self.getuniverse() - self.rows(node.node)
+        if node.name in METADATA:
+            found = set()
+            for sent in self.conllu.data.values():
+                if node.match(getattr(sent, node.name)):
+                    found.update(sent.rows)
+            return found
+        index = self.index(node.name)
+        found = set()
+        for code in self.codes(node):
+            found.update(index.rows(code))
+        if not node.head:
+            return found
+        # tokens whose head is one of found
+        heads = {row + 1 for row in found}
+        return set(compress(range(len(self.getheadrows())), map(heads.__contains__, self.headrows)))
+
+    def conj(self, nodes):
+        """
+        Rows matching all nodes: the smallest set is made from indexes,
+        plain conditions on columns and metadata only filter it, not to build big sets for nothing
+        """
+        filters = [node for node in nodes if isinstance(node, Cond) and not node.head]
+        others = [node for node in nodes if node not in filters]
+        if not others:
+            columns = [node for node in filters if node.name not in METADATA] or filters
+            first = min(columns, key=self.estimate)
+            filters.remove(first)
+            others.append(first)
+        found = self.rows(others[0])
+        for node in others[1:]:
+            if not found:
+                return found
+            found &= self.rows(node)
+        for node in sorted(filters, key=lambda node: node.name in METADATA):
+            if not found:
+                break
+            found = list(found)
+            if node.name in METADATA:
+                keys = {key for key, sent in self.conllu.data.items() if node.match(getattr(sent, node.name))}
+                rowkeys = self.rowkeys
+                found = set(compress(found, [row < len(rowkeys) and rowkeys[row] in keys for row in found]))
+            else:
+                codes, column = self.codes(node), self.store.columns[node.name]
+                found = set(compress(found, map(codes.__contains__, map(column.__getitem__, found))))
+        return found
+
+    def codes(self, node):
+        """Codes of column values matching condition"""
+        return {code for code, value in enumerate(self.pools[node.name].values) if node.match(value)}
+
+    def estimate(self, node):
+        """How many rows a condition gives"""
+        if node.name in METADATA:
+            return len(self.rowkeys)
+        index = self.index(node.name)
+        return sum(len(index.rows(code)) for code in self.codes(node))
+
+    def getuniverse(self):
+        if self.universe is None:
+            self.universe = set(compress(range(len(self.rowkeys)), self.rowkeys))
+        return self.universe
+
+    def getheadrows(self):
+        if self.headrows is None:
+            self.headrows = array('I', bytes(4 * len(self.rowkeys)))
+            idx, head = self.store.columns['idx'], self.store.columns['head']
+            idxvalues, headvalues = self.store.pools['idx'].values, self.store.pools['head'].values
+            size = len(self.rowkeys)
+            for sent in self.conllu.data.values():
+                rows = [row for row in sent.rows if row < size]
+                byidx = {idxvalues[idx[row]]: row + 1 for row in rows}
+                for row in rows:
+                    self.headrows[row] = byidx.get(headvalues[head[row]], 0)
+        return self.headrows
+
+    def scan(self, node, sent):
+        """Token positions of a single sentence matching node"""
+        store, rows = sent.store, sent.rows
+        if isinstance(node, And):
+            found = self.scan(node.nodes[0], sent)
+            for other in node.nodes[1:]:
+                if not found:
+                    break
+                found &= self.scan(other, sent)
+            return found
+        if isinstance(node, Or):
+            return set().union(*(self.scan(other, sent) for other in node.nodes))
+        if isinstance(node, Not):
+            return set(range(len(rows))) - self.scan(node.node, sent)
+        if node.name in METADATA:
+            return set(range(len(rows))) if node.match(getattr(sent, node.name)) else set()
+        values = [store.get(node.name, row) for row in rows]
+        if not node.head:
+            return {position for position, value in enumerate(values) if node.match(value)}
+        byidx = {store.get('idx', row): position for position, row in enumerate(rows)}
+        heads = [byidx.get(store.get('head', row)) for row in rows]
+        return {position for position, head in enumerate(heads) if head is not None and node.match(values[head])}
@@ -1,14 +1,198 @@
+import io
+import os
+import mmap
 import pickle
+import threading
+from array import array
+from collections import OrderedDict, Counter
+from itertools import repeat, chain
+from concurrent.futures import ProcessPoolExecutor
+from inside.project import ProjectLog, Snapshot
+from inside.database import ProjectDatabase, SUFFIX
+from inside.search import SearchIndex
+from inside.query import QueryIndex
+from inside.suggestions import Suggestions, FIELDS as SUGGESTIONFIELDS
+from inside.progress import CheckedIndex
+from inside.history import History
+from inside.timing import timed
+
+CACHESIZE = 2000 # how many parsed sentences a lazy corpus keeps in memory
+CHUNKSIZE = 100000 # token lines are put to store in chunks of that size
+LAZYTOKENS = 500000 # projects with more tokens in snapshot are read lazily
+EXPORTCHUNK = 2000 # sentences formatted and written at once when exporting
+COUNTCHUNK = 2000 # sentences of a lazy .conllu split at once when counting values
+
+# token columns in file order
+COLUMNS = ('idx', 'form', 'lemma', 'upos', 'xpos', 'feats', 'head', 'deprel', 'deps', 'misc', 'semslot', 'semclass')
+SUGGESTIONCOLUMNS = tuple(COLUMNS.index(name) for name in SUGGESTIONFIELDS) # places of suggestion fields in token values
+RECOUNT = 10000 # changes in a step that make suggestions get counted anew instead of updated
+SEARCHED = frozenset(('tokens', 'text', 'form', 'lemma')) # edits of these fields change full-text index
+
+class StringPool(dict):
+    """Categorical codes for values of one column: value -> code, values[code] -> value"""
+    def __init__(self):
+        super().__init__()
+        self.values = []
+
+    def __missing__(self, value):
+        code = self[value] = len(self.values)
+        self.values.append(value)
+        return code
+
+class TokenStore:
+    """
+    Columnar storage for tokens: every column is an array of codes,
+    a row of codes is a token
+    """
+    def __init__(self, pools=None):
+        # pools may be shared between stores, then codes are the same too
+        self.pools = pools if pools is not None else {name: StringPool() for name in COLUMNS}
+        self.columns = {name: array('I') for name in COLUMNS}
+        self.size = 0
+
+    def extend(self, lines):
+        """Add token lines, returns their rows"""
+        lines = list(map(str.strip, lines))
+        for num in set(map(str.count, lines, repeat('\t'))):
+            if num != 11:
+                raise FailedToken(num + 1)
+        # all values in one flat list, every 12th belongs to the same column
+        values = '\t'.join(lines).split('\t') if lines else []
+        for i, name in enumerate(COLUMNS):
+            self.columns[name].extend(map(self.pools[name].__getitem__, values[i::12]))
+        start = self.size
+        self.size += len(lines)
+        return range(start, self.size)
+
+    def extendvalues(self, tokens):
+        """Add tokens given as lists of 12 values, returns their rows"""
+        for name, values in zip(COLUMNS, zip(*tokens)):
+            self.columns[name].extend(map(self.pools[name].__getitem__, values))
+        start = self.size
+        self.size += len(tokens)
+        return range(start, self.size)
+
+    def append(self, values):
+        """Add token from 12 values, returns its row"""
+        for name, value in zip(COLUMNS, values):
+            self.columns[name].append(self.pools[name][value])
+        self.size += 1
+        return self.size - 1
+
+    def get(self, name, row):
+        return self.pools[name].values[self.columns[name][row]]
+
+    def set(self, name, row, value):
+        self.columns[name][row] = self.pools[name][value]
+
+    def lines(self, rows):
+        """Token lines without line ends"""
+        if isinstance(rows, range) and rows.step == 1: # rows one after another: columns are sliced, not indexed
+            columns = [map(self.pools[name].values.__getitem__, self.columns[name][rows.start:rows.stop]) for name in COLUMNS]
+            return list(map('\t'.join, zip(*columns)))
+        columns = [map(self.pools[name].values.__getitem__, map(self.columns[name].__getitem__, rows)) for name in COLUMNS]
+        return list(map('\t'.join, zip(*columns)))
+
+    def dump(self):
+        """Pools and columns as plain values, for saving"""
+        return {name: list(pool.values) for name, pool in self.pools.items()}, {name: column.tobytes() for name, column in self.columns.items()}, self.size
+
+    @classmethod
+    def fromdump(cls, dump):
+        values, columns, size = dump
+        store = cls()
+        for name in COLUMNS:
+            store.pools[name].update(zip(values[name], range(len(values[name]))))
+            store.pools[name].values = values[name]
+            store.columns[name].frombytes(columns[name])
+        store.size = size
+        return store
+
+    def row(self, row):
+        """All 12 values of a token"""
+        return [self.pools[name].values[self.columns[name][row]] for name in COLUMNS]
 
 class Sentence:
-    """Storage for sentence"""
-    def __init__(self, idx):
+    """Storage for sentence: tokens are rows of a TokenStore"""
+    __slots__ = ('idx', 'text', 'translation', 'checked', 'comment', 'store', 'rows')
+
+    def __init__(self, idx, store=None):
         self.idx = idx
         self.text = None 
         self.translation = None 
         self.checked = False 
         self.comment = ''
-        self.tokens = []
+        self.store = store if store is not None else TokenStore()
+        self.rows = array('I') # token rows in store, in sentence order
+
+    @property
+    def tokens(self):
+        return TokenList(self)
+
+    @tokens.setter
+    def tokens(self, tokens):
+        self.rows = array('I', [self.adopt(token) for token in tokens])
+
+    def dump(self, inline=True):
+        """Sentence as plain values, for saving: tokens are lines or rows of the saved store"""
+        tokens = self.store.lines(self.rows) if inline else self.rows.tobytes()
+        return (self.idx, self.text, self.translation, self.checked, self.comment, tokens)
+
+    def adopt(self, token):
+        """Row of token in our store: tokens from other stores get copied here"""
+        if token.store is not self.store:
+            token.row = self.store.append(token.store.row(token.row))
+            token.store = self.store
+        return token.row
+
+    def __setstate__(self, state):
+        if isinstance(state, dict): # projects saved before columnar storage
+            self.idx, self.text, self.translation = state['idx'], state['text'], state['translation']
+            self.checked, self.comment = state['checked'], state['comment']
+            # no store yet, rows hold token values until Conllu.pack
+            self.store = None
+            self.rows = [token.row for token in state['tokens']]
+            return
+        for name, value in state[1].items():
+            setattr(self, name, value)
+
+class TokenList:
+    """List-like view of sentence tokens"""
+    __slots__ = ('sent',)
+
+    def __init__(self, sent):
+        self.sent = sent
+
+    def __len__(self):
+        return len(self.sent.rows)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [Token.view(self.sent.store, row) for row in self.sent.rows[i]]
+        return Token.view(self.sent.store, self.sent.rows[i])
+
+    def __setitem__(self, i, token):
+        self.sent.rows[i] = self.sent.adopt(token)
+
+    def __delitem__(self, i):
+        del self.sent.rows[i]
+
+    def __iter__(self):
+        store = self.sent.store
+        for row in self.sent.rows:
+            yield Token.view(store, row)
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+    def insert(self, i, token):
+        self.sent.rows.insert(i, self.sent.adopt(token))
+
+    def append(self, token):
+        self.sent.rows.append(self.sent.adopt(token))
 
 class FailedToken(Exception):
     """Exception if token line doesn't contain 12 positions"""
@@ -18,81 +202,807 @@ class FailedToken(Exception):
         return f'Token length is {self.num} instead of 12'
     
 class Token:
-    """Storage for token"""
+    """Token: a row of TokenStore, standalone tokens get a store of their own"""
+    __slots__ = ('store', 'row')
+
     def __init__(self, line):
-        tok = line.strip().split('\t')
-        if len(tok) != 12:
-            raise FailedToken(len(tok))
-        self.idx, self.form, self.lemma, self.upos, self.xpos, self.feats, self.head, self.deprel, self.deps, self.misc, self.semslot, self.semclass = tok 
+        self.store = TokenStore()
+        self.row = self.store.extend([line])[0]
+
+    @classmethod
+    def view(cls, store, row):
+        token = cls.__new__(cls)
+        token.store = store
+        token.row = row
+        return token
     
     def __str__(self):
-        return '\t'.join([self.idx, self.form, self.lemma, self.upos, self.xpos, self.feats, self.head, self.deprel, self.deps, self.misc, self.semslot, self.semclass]) + '\n'
+        return '\t'.join(self.store.row(self.row)) + '\n'
+
+    def __setstate__(self, state):
+        if isinstance(state, dict): # projects saved before columnar storage
+            self.store = None
+            self.row = [state[name] for name in COLUMNS]
+            return
+        for name, value in state[1].items():
+            setattr(self, name, value)
+
+def column(name):
+    """Token attribute backed by a column of its store"""
+    def get(self):
+        return self.store.pools[name].values[self.store.columns[name][self.row]]
+    def set(self, value):
+        self.store.columns[name][self.row] = self.store.pools[name][value]
+    return property(get, set)
+
+for name in COLUMNS:
+    setattr(Token, name, column(name))
+
+class LazySentences:
+    """
+    Dict-like storage for big files: keeps only byte offsets of sentences
+    and parses a sentence when it is asked for
+    """
+    def __init__(self, path, offsets, cachesize=CACHESIZE):
+        self.path = path
+        self.offsets = offsets # start of each sentence block + end of file
+        self.cachesize = cachesize
+        self.cache = OrderedDict() # parsed sentences, least recently used first
+        self.pinned = {} # edited sentences, these are never thrown away
+        self.pools = {name: StringPool() for name in COLUMNS} # shared by all parsed sentences
+        self.file = open(path, 'rb')
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def parse(self, key):
+        """Parse sentence block from file"""
+        block = self.mm[self.offsets[key - 1]:self.offsets[key]].decode('utf8')
+        lines = io.StringIO(block, newline=None).readlines()
+        sent = Sentence(lines[0].strip(), TokenStore(self.pools))
+        Conllu.fillsentence(sent, lines[1:])
+        return sent
+
+    def reopen(self):
+        """Independent reader of the same file, e.g. for another thread"""
+        return LazySentences(self.path, self.offsets, 0)
+
+    def pin(self, key):
+        """Keep sentence in memory for good: it has been edited"""
+        if key not in self.pinned:
+            self.pinned[key] = self[key]
+            self.cache.pop(key, None)
+
+    def close(self):
+        self.mm.close()
+        self.file.close()
+
+    def checkedkeys(self):
+        """Sentences checked in the source, edited ones aside: a .conllu file has none"""
+        return ()
+
+    def scan(self, saved=False):
+        """
+        (key, sentence) of all sentences in order, edited ones as they are now or, if saved, as they are in the file.
+        The file is read in a separate reader not to flood the cache with sentences needed once
+        """
+        source = self.reopen()
+        try:
+            for key in source:
+                yield key, self.pinned[key] if key in self.pinned and not saved else source.parse(key)
+        finally:
+            source.close()
+
+    def dumps(self, pinned):
+        """
+        Dumps of all sentences for writing the whole project, edited ones are given as pinned dumps:
+        tokens are put together in one store, same as eager data has them. Returns dumps with rows and store dump
+        """
+        store = TokenStore()
+        sents = [(key, dump[:5] + (array('I', store.extend(dump[5])).tobytes(),)) for key in self
+                 for dump in [pinned[key] if key in pinned else self.parse(key).dump()]]
+        return sents, store.dump()
+
+    def counts(self, names):
+        """
+        How many tokens have every combination of values of columns names, edited sentences as they are now.
+        Token lines are split right in the file, no sentence is parsed
+        """
+        columns = [COLUMNS.index(name) for name in names]
+        offsets, pinned = self.offsets, self.pinned
+        counts = Counter()
+        for start in range(1, len(offsets), COUNTCHUNK):
+            keys = range(start, min(start + COUNTCHUNK, len(offsets)))
+            if pinned.keys().isdisjoint(keys):
+                block = self.mm[offsets[keys[0] - 1]:offsets[keys[-1]]]
+            else:
+                block = b''.join(self.mm[offsets[key - 1]:offsets[key]] for key in keys if key not in pinned)
+            lines = [line.strip() for line in io.StringIO(block.decode('utf8'), newline=None) if line[:1].isdigit()]
+            values = '\t'.join(lines).split('\t') if lines else []
+            if len(values) != 12 * len(lines): # broken lines are left out, same as parsing refuses them
+                values = '\t'.join(line for line in lines if line.count('\t') == 11).split('\t')
+            counts.update(zip(*(values[column::12] for column in columns)))
+        return counts + self.pinnedcounts(names)
+
+    def pinnedcounts(self, names):
+        """Same as counts for edited sentences only"""
+        return Counter(tuple(sent.store.get(name, row) for name in names) for sent in self.pinned.values() for row in sent.rows)
+
+    def __getitem__(self, key):
+        if key in self.pinned:
+            return self.pinned[key]
+        sent = self.cache.get(key)
+        if sent is not None:
+            self.cache.move_to_end(key)
+            return sent
+        if key not in self:
+            raise KeyError(key)
+        sent = self.parse(key)
+        self.cache[key] = sent
+        if len(self.cache) > self.cachesize:
+            self.cache.popitem(last=False)
+        return sent
+
+    def __contains__(self, key):
+        return isinstance(key, int) and 0 < key < len(self.offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __iter__(self):
+        return iter(range(1, len(self.offsets)))
+
+    def keys(self):
+        return iter(self)
+
+    def values(self):
+        for key in self:
+            yield self[key]
+
+    def items(self):
+        for key in self:
+            yield key, self[key]
+
+class ProjectSentences(LazySentences):
+    """
+    Lazy sentences of a project file: source is a SQLite database or a mapped snapshot,
+    it gives a sentence dump by key when the sentence is asked for
+    """
+    def __init__(self, path, source, cachesize=CACHESIZE):
+        self.path = path
+        self.source = source
+        self.size = source.count() # keys are 1..size
+        self.cachesize = cachesize
+        self.cache = OrderedDict()
+        self.pinned = {}
+        self.pools = {name: StringPool() for name in COLUMNS}
+        self.lock = threading.Lock() # sources are read under it, swap closes and opens them under it
+        self.readers = [self] # open readers of the file, reopened ones are shared with this one
+
+    def restore(self, dump):
+        """Sentence from dump: tokens are lines or lists of values"""
+        idx, text, translation, checked, comment, tokens = dump
+        sent = Sentence(idx, TokenStore(self.pools))
+        sent.text, sent.translation, sent.checked, sent.comment = text, translation, checked, comment
+        sent.rows.extend(sent.store.extend(tokens) if tokens and isinstance(tokens[0], str) else sent.store.extendvalues(tokens))
+        return sent
+
+    def parse(self, key):
+        with self.lock:
+            dump = self.source.sentence(key)
+        return self.restore(dump)
+
+    def reopen(self):
+        reader = ProjectSentences(self.path, self.source.reopen(), 0)
+        with self.lock:
+            reader.lock, reader.readers = self.lock, self.readers
+            self.readers.append(reader)
+        return reader
+
+    def swap(self, replace):
+        """
+        Let replace put a new project file in place of this one: sources of all readers
+        are closed first, so nothing maps the file being replaced, and are opened on the new file after it
+        """
+        with self.lock:
+            for reader in self.readers:
+                reader.source.close()
+            try:
+                replace()
+            finally:
+                for reader in self.readers:
+                    reader.source = reader.source.reopen()
+
+    def dumps(self, pinned):
+        """Same as LazySentences.dumps, but tokens of a snapshot aren't decoded: its store is taken as it is"""
+        if isinstance(self.source, Snapshot):
+            stored, dump = self.source.dump()
+            store = TokenStore.fromdump(dump)
+        else:
+            stored, store = {}, TokenStore()
+        sents = []
+        for key in self:
+            if key in pinned:
+                dump = pinned[key]
+                sents.append((key, dump[:5] + (array('I', store.extend(dump[5])).tobytes(),)))
+            elif key in stored:
+                sents.append((key, stored[key]))
+            else:
+                dump = self.source.sentence(key)
+                sents.append((key, dump[:5] + (array('I', store.extendvalues(dump[5])).tobytes(),)))
+        return sents, store.dump()
+
+    def counts(self, names):
+        """Same as LazySentences.counts: the source counts saved sentences, edited ones are counted as they are now"""
+        with self.lock:
+            counts = self.source.counts(names, self.pinned.keys())
+        return counts + self.pinnedcounts(names)
+
+    def close(self):
+        with self.lock:
+            self.source.close()
+            if self in self.readers:
+                self.readers.remove(self)
+
+    def checkedkeys(self):
+        with self.lock:
+            return self.source.checkedkeys()
+
+    def __contains__(self, key):
+        return isinstance(key, int) and 0 < key <= self.size
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        return iter(range(1, self.size + 1))
+
+def projectfile(path):
+    """Project file for path: SQLite database for .cobaldb, log of records otherwise"""
+    return ProjectDatabase(path) if path.endswith(SUFFIX) else ProjectLog(path)
+
+def projectsource(path):
+    """Sentences of a project file that isn't read into memory: SQLite database or snapshot"""
+    return ProjectDatabase(path) if ProjectDatabase.isdatabase(path) else Snapshot(path)
 
 class Conllu:
     """Main class for handling conllu data"""
     def __init__(self, translang='en'):
         self.data = {} # sents: text, translation, token list
+        self.store = TokenStore() # tokens of all sentences
         self.ready = False
         self.len = 0
         self.current = 1 # current open sentence
         self.translang = translang
         self.hastranslations = False
+        self.log = None # project file we loaded or saved last
+        self.dirty = {} # edited since last save: sentence key -> names of changed fields
+        self.touched = set() # sentences edited since the corpus was opened
+        self.edits = Counter() # values changed since the corpus was opened, by field name
+        self.search = None # full-text index, built by searchindex
+        self.query = QueryIndex(self) # token queries
+        self.suggestions = None # semantic annotation by lemma, upos and deprel, made by suggestionindex
+        self.progress = None # checked marks of sentences, made by progressindex
+        self.prepared = {} # sentence key -> what the editor worked out ahead for it, dropped when the sentence is edited
+        self.history = History() # undo and redo of edits
     
-    def read(self, path):
-        """Reading file"""
+    @staticmethod
+    def readcomment(sent, line):
+        """Text and translation lines, returns True if there is a translation with ' = ' in it"""
+        # sentence text
+        if line.startswith('# text = ') and not sent.text:
+            sent.text = line.strip()[len('# text = '):]
+        # sentence translation in text?
+        elif line.startswith('# text'):
+            trans = line.strip().split(' = ')
+            sent.translation = trans
+            if len(trans) == 2:
+                sent.translation = trans[1]
+            elif len(trans) > 2:
+                sent.translation = ' = '.join(trans[1:])
+                return True
+        return False
+
+    @staticmethod
+    def fillsentence(sent, lines):
+        """Fill sentence with lines of its block, returns True if there is a translation with ' = ' in it"""
+        hastranslations = False
+        tokens = []
+        for line in lines:
+            if line[0].isdigit():
+                tokens.append(line)
+            elif Conllu.readcomment(sent, line):
+                hastranslations = True
+        sent.rows.extend(sent.store.extend(tokens))
+        return hastranslations
+
+    @timed('Conllu.read')
+    def read(self, path, lazy=False):
+        """Reading file: lazy mode only indexes sentences, they are parsed when needed"""
+        if lazy:
+            return self.readlazy(path)
         key = 0 # sentence number
+        sent = None
+        first = 0 # row of the first token of current sentence
+        pending = [] # token lines not yet in store, they go there in big chunks
         with open(path, 'r', encoding='utf8') as file:
-            for line in file:
-                if line.startswith('# sent_id = '):
-                    idx = line.strip() # sentence id in conllu
-                    self.len += 1
-                    key += 1
-                    self.data[key] = Sentence(idx)
-                # sentence text
-                if line.startswith('# text = ') and not self.data[key].text:
-                    self.data[key].text = line.strip()[len('# text = '):]
-                # sentence translation in text?
-                elif line.startswith('# text'):
-                    trans = line.strip().split(' = ')
-                    if len(trans) == 2:
-                        trans = trans[1]
-                    elif len(trans) > 2:
+            try:
+                for line in file:
+                    if line[0].isdigit():
+                        pending.append(line)
+                    elif line.startswith('# sent_id = '):
+                        if sent is not None:
+                            sent.rows = array('I', range(first, self.store.size + len(pending)))
+                        if len(pending) >= CHUNKSIZE:
+                            self.store.extend(pending)
+                            pending = []
+                        first = self.store.size + len(pending)
+                        idx = line.strip() # sentence id in conllu
+                        self.len += 1
+                        key += 1
+                        sent = self.data[key] = Sentence(idx, self.store)
+                    elif sent is not None and self.readcomment(sent, line):
                         self.hastranslations = True
-                        trans = ' = '.join(trans[1])
-                    self.data[key].translation = trans
-                if line[0].isdigit():
-                    try:
-                        self.data[key].tokens.append(Token(line))
-                    except FailedToken:
-                        return 'BAD'
+                if sent is not None:
+                    sent.rows = array('I', range(first, self.store.size + len(pending)))
+                self.store.extend(pending)
+            except FailedToken:
+                return 'BAD'
         if len(self.data) != 0:
             self.ready = True
         else:
             return 'EMPTY'
+
+    @staticmethod
+    def sentenceoffsets(mm):
+        """Byte offsets of sentence blocks in mapped file, and its end"""
+        offsets = array('Q')
+        if mm[:len(b'# sent_id = ')] == b'# sent_id = ':
+            offsets.append(0)
+        pos = mm.find(b'\n# sent_id = ')
+        while pos >= 0:
+            offsets.append(pos + 1)
+            pos = mm.find(b'\n# sent_id = ', pos + 1)
+        offsets.append(len(mm))
+        return offsets
+
+    def readlazy(self, path):
+        """One pass over the file collecting byte offsets of sentences"""
+        with open(path, 'rb') as file:
+            if not os.fstat(file.fileno()).st_size:
+                return 'EMPTY'
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                find = mm.find
+                offsets = self.sentenceoffsets(mm)
+                # translations with ' = ' inside, same thing parseline looks for
+                pos = find(b'\n# text')
+                while pos >= 0:
+                    end = find(b'\n', pos + 1)
+                    line = mm[pos + 1:end if end > 0 else len(mm)]
+                    if not line.startswith(b'# text = ') and line.count(b' = ') > 1:
+                        self.hastranslations = True
+                        break
+                    pos = find(b'\n# text', end) if end > 0 else -1
+        if len(offsets) < 2:
+            return 'EMPTY'
+        data = LazySentences(path, offsets)
+        try:
+            data[1] # broken first sentence means broken file
+        except FailedToken:
+            data.close()
+            return 'BAD'
+        self.data = data
+        self.len = len(data)
+        self.ready = True
+
+    def touch(self, key, fields=('tokens',)):
+        """
+        Mark sentence as edited: fields are names of what changed, a name for every changed value,
+        'tokens' if tokens were added or deleted. Nothing changed, nothing to do
+        """
+        if not fields:
+            return
+        self.dirty.setdefault(key, set()).update(fields)
+        self.touched.add(key)
+        self.edits.update(fields)
+        self.prepared.pop(key, None)
+        if isinstance(self.data, LazySentences):
+            self.data.pin(key)
+        if self.search is not None and not SEARCHED.isdisjoint(fields):
+            self.search.update(key, self.data[key])
+        self.query.touch(key)
+        if self.progress is not None:
+            self.progress.update(key, self.data[key].checked)
+
+    def undo(self):
+        """Undo last step of history: returns the step, None if there was nothing to undo"""
+        step = self.history.undo()
+        if step is not None:
+            self.apply(step.changes[::-1], backward=True)
+        return step
+
+    def redo(self):
+        """Redo last undone step: returns the step, None if there was nothing to redo"""
+        step = self.history.redo()
+        if step is not None:
+            self.apply(step.changes)
+        return step
+
+    def settokens(self, key, label, edit):
+        """
+        Add or delete tokens of sentence as a step of history: edit changes a copy of the sentence,
+        e.g. renumbers it, and its errors go up with nothing changed. The change goes through apply,
+        same as undo and redo, so suggestions count it the same way. Returns the change
+        """
+        sent = self.data[key]
+        copy = Sentence(sent.idx, sent.store)
+        copy.rows = array('I', sent.rows)
+        edit(copy)
+        change = (key, None, 'tokens', list(map(sent.store.row, sent.rows)), list(map(copy.store.row, copy.rows)))
+        self.history.record(label, [change])
+        self.apply([change])
+        return change
+
+    def apply(self, changes, backward=False):
+        """
+        Set new values of a list of history changes, old ones going backward:
+        sentences get touched with names of what changed
+        """
+        if self.suggestions is not None and len(changes) > RECOUNT:
+            self.suggestions = None # counted anew when it is needed, that's quicker
+        lazy = isinstance(self.data, LazySentences)
+        touched = {}
+        key = None
+        for change in changes:
+            if change[0] != key: # changes come sentence by sentence
+                key = change[0]
+                if key not in touched:
+                    touched[key] = set()
+                    if lazy: # a step may have more sentences than the cache holds
+                        self.data.pin(key)
+                sent = self.data[key]
+                store, fields = sent.store, touched[key]
+            key, position, name, old, new = change
+            value, replaced = (old, new) if backward else (new, old)
+            if name == 'tokens':
+                if self.suggestions is not None:
+                    for values, count in chain(zip(replaced, repeat(-1)), zip(value, repeat(1))):
+                        self.suggestions.add(tuple(values[i] for i in SUGGESTIONCOLUMNS), count)
+                sent.rows = array('I', store.extendvalues(value))
+            elif position is None:
+                setattr(sent, name, value)
+            elif self.suggestions is not None and name in SUGGESTIONFIELDS:
+                token = sent.tokens[position]
+                before = Suggestions.values(token)
+                setattr(token, name, value)
+                self.suggestions.update(before, Suggestions.values(token))
+            else: # same as setting the Token attribute
+                store.columns[name][sent.rows[position]] = store.pools[name][value]
+            fields.add(name)
+        for key, fields in touched.items():
+            self.touch(key, fields)
+
+    def untranslated(self):
+        """(key, text) of sentences that have text but no translation"""
+        sents = self.data.scan() if isinstance(self.data, LazySentences) else self.data.items()
+        return [(key, sent.text) for key, sent in sents if sent.text and not sent.translation]
+
+    def valuecounts(self, names):
+        """How many tokens have every value of columns names: name -> Counter of values"""
+        counts = {name: Counter() for name in names}
+        if isinstance(self.data, LazySentences): # one pass over the file for all columns
+            for values, count in self.data.counts(names).items():
+                for name, value in zip(names, values):
+                    counts[name][value] += count
+            return counts
+        stores = {} # sentences mostly share one store: codes are counted for each store at once
+        for sent in self.data.values():
+            stores.setdefault(id(sent.store), (sent.store, []))[1].append(sent.rows)
+        for store, rows in stores.values():
+            for name in names:
+                values = store.pools[name].values
+                column = store.columns[name]
+                if sum(map(len, rows)) < store.size: # some rows are left from deleted tokens
+                    column = map(column.__getitem__, chain.from_iterable(rows))
+                for code, count in Counter(column).items():
+                    counts[name][values[code]] += count
+        return counts
+
+    def searchindex(self):
+        """Full-text index of sentences: built once, then kept up to date by touch"""
+        if self.search is None:
+            self.search = SearchIndex.build(self.data)
+        return self.search
     
-    def write_conllu(self, path):
+    def checkedkeys(self):
+        """Keys of sentences marked as checked"""
+        bitmap = self.progressindex().bitmap
+        return [key for key in range(1, len(bitmap)) if bitmap[key]]
+
+    def progressindex(self):
+        """Index of checked sentences: built once, then kept up to date by touch"""
+        if self.progress is None:
+            self.progress = CheckedIndex.build(self.data)
+        return self.progress
+
+    def suggestionindex(self):
+        """Annotation suggestions: counted once or loaded with the project, then kept up to date by savesent"""
+        if self.suggestions is None:
+            self.suggestions = Suggestions.build(self)
+        return self.suggestions
+
+    @timed('Conllu.write_conllu')
+    def write_conllu(self, path, keys=None, workers=1):
+        """
+        Export sentences with keys (all by default) to CONLL-U. Tokens of many sentences
+        are formatted at once and written in big pieces; with several workers
+        pieces are formatted in worker processes, None means a process for every processor
+        """
+        keys = list(self.data.keys()) if keys is None else sorted(keys)
+        chunks = [keys[start:start + EXPORTCHUNK] for start in range(0, len(keys), EXPORTCHUNK)]
+        meta = (self.translang, self.hastranslations)
+        lazy = isinstance(self.data, LazySentences)
+        store = TokenStore() if lazy else self.store # lazy sentences only need one for reading comments
+        if isinstance(self.data, ProjectSentences): # sentences that weren't edited are formatted from project file
+            pinned = self.data.pinned
+            tasks = [(formatproject, self.data.path, [None if key in pinned else key for key in chunk], meta) for chunk in chunks]
+        elif lazy: # sentences that weren't edited are formatted from their lines in file
+            pinned, offsets = self.data.pinned, self.data.offsets
+            tasks = [(formatfile, self.data.path, [None if key in pinned else (offsets[key - 1], offsets[key]) for key in chunk], meta)
+                     for chunk in chunks]
+        else:
+            tasks = [(formatstored, [(comments(self.data[key], *meta), self.data[key].rows) for key in chunk]) for chunk in chunks]
         with open(path, 'w', encoding='utf8') as file:
-            print('# global.columns = ID FORM LEMMA UPOS XPOS FEATS HEAD DEPREL DEPS MISC SEMSLOT SEMCLASS', file=file)
-            for key, sent in self.data.items():
-                print(sent.idx, file=file)
-                if sent.text:
-                    print(f"# text = {sent.text}", file=file)
-                if sent.translation and self.hastranslations:
-                    print(f'# text_{self.translang} = {sent.translation}', file=file)
-                for token in sent.tokens:
-                    file.write(str(token))
-                print(file=file)
+            file.write('# global.columns = ID FORM LEMMA UPOS XPOS FEATS HEAD DEPREL DEPS MISC SEMSLOT SEMCLASS\n')
+            if len(tasks) > 1 and workers != 1:
+                with ProcessPoolExecutor(max_workers=workers, initializer=setexportstore, initargs=(store,)) as pool:
+                    self.writechunks(file, chunks, pool.map(runexport, tasks))
+            else:
+                setexportstore(store)
+                try:
+                    self.writechunks(file, chunks, map(runexport, tasks))
+                finally:
+                    setexportstore(None)
 
+    def writechunks(self, file, chunks, results):
+        """Write formatted chunks of sentences: texts are None for edited sentences of lazy data, they are formatted here"""
+        meta = (self.translang, self.hastranslations)
+        for chunk, texts in zip(chunks, results):
+            if None in texts:
+                texts = [formatsent(self.data[key], *meta) if text is None else text for key, text in zip(chunk, texts)]
+            file.write(''.join(texts))
+
+    @timed('Conllu.save')
     def save(self, path):
-        if path:
-            pickle.dump((self.data, self.hastranslations, self.translang), open(path, 'wb'))
+        """Save project: if it is the file we loaded or saved before, only edited sentences are written"""
+        if not path:
+            return
+        job, keys = self.savejob(path)
+        try:
+            job()
+        except Exception:
+            self.savefailed(keys)
+            raise
+
+    def savejob(self, path):
+        """
+        Snapshot of everything that has to be saved: returns a function that
+        does the writing and may run in another thread, and the saved sentence keys
+        """
+        meta = {'hastranslations': self.hastranslations, 'translang': self.translang}
+        keys, self.dirty = self.dirty, {}
+        if self.log is not None and self.log.path == path and self.log.exists() and not self.log.needscompaction():
+            log, sents = self.log, [(key, self.data[key].dump()) for key in sorted(keys)]
+            def job():
+                if sents:
+                    log.append(meta, sents)
+        elif isinstance(self.data, dict):
+            self.pack()
+            self.log = log = projectfile(path)
+            sents, store = [(key, sent.dump(inline=False)) for key, sent in self.data.items()], self.store.dump()
+            def job():
+                log.write(meta, sents, store)
+        else: # lazy data has no common store, the source gets parsed again in a separate reader
+            self.log = log = projectfile(path)
+            pinned, source = {key: sent.dump() for key, sent in self.data.pinned.items()}, self.data.reopen()
+            # writing over the file the sentences come from: its readers let go of it while it is replaced
+            samefile = isinstance(self.data, ProjectSentences) and os.path.abspath(self.data.path) == os.path.abspath(path)
+            swap = self.data.swap if samefile else None
+            def job():
+                try:
+                    sents, store = source.dumps(pinned)
+                finally:
+                    source.close()
+                log.write(meta, sents, store, swap)
+        # files next to the project are saved for its state after writing
+        savesents, saveafter = job, [self.history.savejob(path)]
+        if self.suggestions is not None:
+            saveafter.append(self.suggestions.savejob(path))
+        def job():
+            savesents()
+            for save in saveafter:
+                save()
+        return job, keys
+
+    def savefailed(self, keys):
+        """Saving job went wrong: sentences are still unsaved, project file must be written anew"""
+        for key, fields in keys.items():
+            self.dirty.setdefault(key, set()).update(fields)
+        self.log = None
 
+    def close(self):
+        """Let go of the file lazy data reads sentences from: nothing is read after that"""
+        if not isinstance(self.data, dict):
+            self.data.close()
+
+    @timed('Conllu.load')
     def load(self, path):
-        self.data, self.hastranslations, self.translang = pickle.load(open(path, 'rb'))
+        self.close() # sentences loaded before go, their file with them
+        # indexes of sentences loaded before are no good now
+        self.search, self.progress, self.query = None, None, QueryIndex(self)
+        self.prepared = {}
+        self.history = History.load(path)
+        self.touched, self.edits = set(), Counter()
+        self.dirty = {} # edits of sentences loaded before went with them
+        if ProjectDatabase.isdatabase(path): # sentences stay in the database until they are needed
+            self.log = ProjectDatabase(path)
+            meta = self.log.meta()
+            self.hastranslations, self.translang = meta.get('hastranslations', False), meta.get('translang', 'en')
+            self.data = ProjectSentences(path, self.log)
+            self.store = TokenStore()
+            self.suggestions = Suggestions.load(path)
+        elif ProjectLog.isproject(path):
+            self.log = ProjectLog(path)
+            meta, dumps, store = self.log.read()
+            self.hastranslations, self.translang = meta.get('hastranslations', False), meta.get('translang', 'en')
+            if isinstance(store, Snapshot) and store.tokens > LAZYTOKENS: # sentences are decoded when they are needed
+                self.data = ProjectSentences(path, store)
+                self.store = TokenStore()
+                for key, dump in dumps.items(): # saved after the snapshot
+                    self.data.pinned[key] = self.data.restore(dump)
+            else:
+                if isinstance(store, Snapshot):
+                    snapshot = store
+                    stored, store = snapshot.dump()
+                    snapshot.close()
+                    stored.update(dumps)
+                    dumps = stored
+                self.restore(dumps, store)
+            self.suggestions = Suggestions.load(path)
+        else: # old projects are pickled as a whole
+            self.log = None # the next save writes a project file of the new kind
+            self.data, self.hastranslations, self.translang = pickle.load(open(path, 'rb'))
+            if self.data:
+                self.store = next(iter(self.data.values())).store or TokenStore()
+            self.pack()
+            self.suggestions = None
         if len(self.data) > 0:
             self.ready = True
             self.len = len(self.data)
 
+    def restore(self, dumps, store=None):
+        """Create sentences from their dumps"""
+        self.data = {}
+        self.store = TokenStore.fromdump(store) if store is not None else TokenStore()
+        pending = [] # token lines go to store in big chunks
+        for key in sorted(dumps):
+            idx, text, translation, checked, comment, tokens = dumps[key]
+            sent = self.data[key] = Sentence(idx, self.store)
+            sent.text, sent.translation, sent.checked, sent.comment = text, translation, checked, comment
+            if isinstance(tokens, bytes): # rows of saved store
+                sent.rows.frombytes(tokens)
+                continue
+            first = self.store.size + len(pending)
+            sent.rows = array('I', range(first, first + len(tokens)))
+            pending.extend(tokens)
+            if len(pending) >= CHUNKSIZE:
+                self.store.extend(pending)
+                pending = []
+        self.store.extend(pending)
+
+    def pack(self):
+        """Move all tokens into one store, dropping rows of deleted tokens"""
+        if all(sent.store is self.store for sent in self.data.values()) and sum(len(sent.rows) for sent in self.data.values()) == self.store.size:
+            return # nothing to do
+        store = TokenStore()
+        for sent in self.data.values():
+            old = sent.store
+            if old is None: # legacy sentence with bare values
+                sent.rows = array('I', store.extendvalues(sent.rows))
+                sent.store = store
+                continue
+            for name in COLUMNS:
+                column, values, pool = store.columns[name], old.pools[name].values, store.pools[name]
+                column.extend([pool[values[old.columns[name][row]]] for row in sent.rows])
+            start = store.size
+            store.size += len(sent.rows)
+            sent.store = store
+            sent.rows = array('I', range(start, store.size))
+        self.store = store
+
     def __len__(self):
         return self.len
-    
\ No newline at end of file
+    
+
+EXPORTSTORE = None # token store export workers format from
+
+def comments(sent, translang, hastranslations):
+    """Comment lines of sentence in CONLL-U"""
+    lines = [sent.idx, '\n']
+    if sent.text:
+        lines.append(f'# text = {sent.text}\n')
+    if sent.translation and hastranslations:
+        lines.append(f'# text_{translang} = {sent.translation}\n')
+    return ''.join(lines)
+
+def formatrows(store, sents):
+    """
+    CONLL-U texts of sentences given as (comment lines, token rows) with tokens in store:
+    tokens of all sentences are formatted at once, column by column
+    """
+    rows = array('I')
+    for text, sentrows in sents:
+        rows.extend(sentrows)
+    if rows and rows == array('I', range(rows[0], rows[0] + len(rows))): # the usual case after reading a file
+        rows = range(rows[0], rows[0] + len(rows))
+    lines = store.lines(rows)
+    texts = []
+    start = 0
+    for text, sentrows in sents:
+        end = start + len(sentrows)
+        texts.append(text + '\n'.join(lines[start:end] + ['']) + '\n')
+        start = end
+    return texts
+
+def formatsent(sent, translang, hastranslations):
+    return formatrows(sent.store, [(comments(sent, translang, hastranslations), sent.rows)])[0]
+
+def setexportstore(store):
+    global EXPORTSTORE
+    EXPORTSTORE = store
+
+def formatstored(sents):
+    """Texts of sentences with tokens in the store export was started with"""
+    return formatrows(EXPORTSTORE, sents)
+
+def formatfile(path, blocks, meta):
+    """
+    Texts of sentences given as byte offsets of their blocks in file, token lines are taken as they are;
+    None instead of offsets gives None: the sentence was edited and is formatted from memory
+    """
+    texts = []
+    with open(path, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for block in blocks:
+                if block is None:
+                    texts.append(None)
+                    continue
+                lines = io.StringIO(mm[block[0]:block[1]].decode('utf8'), newline=None).readlines()
+                sent = Sentence(lines[0].strip(), EXPORTSTORE)
+                tokens = []
+                for line in lines[1:]:
+                    if line[0].isdigit():
+                        tokens.append(line.strip())
+                    else:
+                        Conllu.readcomment(sent, line)
+                texts.append(comments(sent, *meta) + '\n'.join(tokens + ['']) + '\n')
+    return texts
+
+def formatproject(path, keys, meta):
+    """Texts of sentences of a project file with keys; None instead of key gives None, same as formatfile"""
+    source = projectsource(path)
+    try:
+        dumps = source.sentences(key for key in keys if key is not None)
+    finally:
+        source.close()
+    texts = []
+    for key in keys:
+        if key is None:
+            texts.append(None)
+            continue
+        idx, text, translation, checked, comment, tokens = dumps[key]
+        sent = Sentence(idx, EXPORTSTORE)
+        sent.text, sent.translation = text, translation
+        texts.append(comments(sent, *meta) + '\n'.join(list(map('\t'.join, tokens)) + ['']) + '\n')
+    return texts
+
+def runexport(task):
+    return task[0](*task[1:])
@@ -0,0 +1,141 @@
+import re
+from array import array
+from inside.reader import COLUMNS
+
+WORDID = re.compile(r'(\d+)$')
+EMPTYID = re.compile(r'(\d+)\.(\d+)$')
+RANGEID = re.compile(r'(\d+)-(\d+)$')
+
+class RenumberError(Exception):
+    """Token ID that can't be inserted or deleted"""
+
+def parseid(idx):
+    """Place of token ID in sentence order: word n, empty node n.m after it, range n-k before word n"""
+    found = WORDID.match(idx)
+    if found:
+        return int(found[1]), 0, 0
+    found = EMPTYID.match(idx)
+    if found:
+        return int(found[1]), 1, int(found[2])
+    found = RANGEID.match(idx)
+    if found:
+        return int(found[1]) - 1, 2, 0
+    return None
+
+def plan(idxs, inserted=(), deleted=()):
+    """
+    New order and IDs of sentence tokens after deleting tokens with IDs in deleted
+    and inserting new tokens at IDs in inserted, all IDs in old numbering:
+    a new word n comes before old word n (or a range starting with it),
+    a new empty node n.m before old n.m. Words and empty nodes are numbered by their place,
+    ranges keep the words they had.
+    Returns list of (old position or None for new token, new ID) and map old ID -> new ID, None for deleted
+    """
+    deleted = set(deleted)
+    missing = deleted - set(idxs)
+    if missing:
+        raise RenumberError(f'No such index: {", ".join(sorted(missing))}')
+    pending = [] # (place, kind) of new tokens
+    for idx in inserted:
+        place = parseid(idx)
+        if place is None or place[1] == 2:
+            raise RenumberError(f'Incorrect index: {idx}')
+        # a new word goes after empty nodes of the word before it and before a range starting with it
+        pending.append(((place[0] - 1, 2, -1), 0) if place[1] == 0 else (place, 1))
+    pending.sort()
+    order = [] # (old position or None, kind: 0 word, 1 empty node, 2 range, None for IDs we can't read)
+    for position, idx in enumerate(idxs):
+        place = parseid(idx)
+        if place is not None:
+            while pending and pending[0][0] <= place:
+                order.append((None, pending.pop(0)[1]))
+        if idx not in deleted:
+            order.append((position, place and place[1]))
+    order.extend((None, kind) for place, kind in pending)
+    # number words and empty nodes by their place
+    result, mapping = [], dict.fromkeys(deleted)
+    words = {} # old word number -> new one
+    word = empty = 0
+    for position, kind in order:
+        if kind is None: # ID we can't read stays as it is
+            newidx = idxs[position]
+        elif kind == 1:
+            empty += 1
+            newidx = f'{word}.{empty}'
+        elif kind == 2:
+            newidx = None # when its words are numbered
+        else:
+            word += 1
+            empty = 0
+            newidx = str(word)
+            if position is not None:
+                words[int(idxs[position])] = word
+        result.append((position, newidx))
+        if position is not None and newidx is not None:
+            mapping[idxs[position]] = newidx
+    # ranges span words they had that are still there and come right before the first of them:
+    # empty nodes and new words may have got between a range and its first word
+    ranges, rest = {}, [] # new ID of first word -> (position, new ID) of range; everything else
+    for position, newidx in result:
+        if newidx is not None: # new tokens always have IDs
+            rest.append((position, newidx))
+            continue
+        first, last = map(int, idxs[position].split('-'))
+        kept = [words[number] for number in range(first, last + 1) if number in words]
+        if len(kept) > 1:
+            newidx = mapping[idxs[position]] = f'{kept[0]}-{kept[-1]}'
+            ranges[str(kept[0])] = (position, newidx)
+        else:
+            mapping[idxs[position]] = None
+    result = []
+    for position, newidx in rest:
+        if newidx in ranges:
+            result.append(ranges.pop(newidx))
+        result.append((position, newidx))
+    return result, mapping
+
+def renumber(sent, inserted=(), deleted=(), form='#NULL'):
+    """
+    Insert empty tokens (with form) at IDs of inserted and delete tokens with IDs of deleted
+    in a Sentence, then rewrite ID, HEAD and every DEPS head of all tokens in one pass.
+    Heads that were deleted become _ in HEAD and are dropped from DEPS. Returns map old ID -> new ID
+    """
+    store, rows = sent.store, sent.rows
+    order, mapping = plan([store.get('idx', row) for row in rows], inserted, deleted)
+    blank = dict.fromkeys(COLUMNS, '_')
+    blank['form'] = form
+    newrows = array('I')
+    for position, newidx in order:
+        if position is None:
+            newrows.append(store.append([newidx if name == 'idx' else blank[name] for name in COLUMNS]))
+        else:
+            newrows.append(rows[position])
+    heads, deps = {}, {} # old value -> new one: every distinct value is parsed once
+    idx, headcolumn, depscolumn = store.columns['idx'], store.columns['head'], store.columns['deps']
+    for (position, newidx), row in zip(order, newrows):
+        if position is not None:
+            idx[row] = store.pools['idx'][newidx]
+        head = store.get('head', row)
+        if head not in heads:
+            heads[head] = mapping[head] or '_' if head in mapping else head
+        headcolumn[row] = store.pools['head'][heads[head]]
+        value = store.get('deps', row)
+        if value not in deps:
+            deps[value] = renumberdeps(value, mapping)
+        depscolumn[row] = store.pools['deps'][deps[value]]
+    sent.rows = newrows
+    return mapping
+
+def renumberdeps(deps, mapping):
+    """DEPS with heads renumbered, parsed entry by entry: head:relation|head:relation"""
+    if deps == '_':
+        return deps
+    parts = []
+    for part in deps.split('|'):
+        head, sep, relation = part.partition(':')
+        if head in mapping:
+            if mapping[head] is None:
+                continue
+            head = mapping[head]
+        parts.append(head + sep + relation)
+    return '|'.join(parts) or '_'
@@ -0,0 +1,105 @@
+import re
+from collections import Counter
+from inside.validation import SEMSLOTSET, SEMCLASSET, DEPRELSET, knownfeats
+from inside.timing import timed
+
+# columns a replacement can rewrite: ids, forms and the tree stay as they are
+EDITABLE = ('lemma', 'upos', 'xpos', 'feats', 'deprel', 'misc', 'semslot', 'semclass')
+# new values these refuse are not written, same as savesent refuses them
+REQUIRED = {'semslot': SEMSLOTSET.__contains__, 'semclass': SEMCLASSET.__contains__}
+# new values these refuse are written, but the preview tells about them: savesent asks for consent
+KNOWN = {'deprel': lambda value: value == '_' or value in DEPRELSET, 'feats': knownfeats}
+
+class ReplaceError(Exception):
+    """Replacement that can't be made"""
+
+class Replacement:
+    """
+    Rewrite of column in all tokens matching a token query, worked out without writing anything:
+    this is the dry run, apply writes it. Every old value becomes value or, with pattern,
+    gets its parts matching pattern replaced with value (backreferences work). New values
+    are worked out and checked once for every distinct old value; tokens whose new value
+    fails the inventory check stay as they are
+    """
+    def __init__(self, conllu, query, column, value, pattern=None):
+        if column not in EDITABLE:
+            raise ReplaceError(f'{column} can\'t be replaced, only {", ".join(EDITABLE)}')
+        if not value and not pattern:
+            raise ReplaceError('Empty value: unannotated fields have _')
+        self.source = (query, column, pattern, value) # as the annotator gave them
+        try:
+            pattern = re.compile(pattern) if pattern else None
+        except re.error as e:
+            raise ReplaceError(f'Incorrect regular expression {pattern}: {e}')
+        self.query, self.column, self.value, self.pattern = query, column, value, pattern
+        self.index, self.version = conllu.query, conllu.query.version # results are good for this state of the corpus
+        self.changes = [] # (sentence key, token position, column, old value, new value), what history takes
+        self.counts = Counter() # (old value, new value) -> tokens
+        self.refused = Counter() # new value -> tokens left as they were, it isn't in the inventory
+        self.unknown = Counter() # new value -> tokens, written though validation warns about it
+        self.matched = 0 # tokens matching query, some of them may need no change
+        self.find(conllu)
+
+    def newvalue(self, old):
+        if self.pattern is None:
+            return self.value
+        try:
+            return self.pattern.sub(self.value, old) or '_'
+        except (re.error, IndexError) as e: # bad backreference in value
+            raise ReplaceError(f'Incorrect replacement {self.value}: {e}')
+
+    @timed('Replacement.find')
+    def find(self, conllu):
+        hits = conllu.query.find(self.query) # QueryError goes up
+        column, changes = self.column, self.changes
+        required, known = REQUIRED.get(column), KNOWN.get(column)
+        newvalues = {} # old value -> (new value, passes the check)
+        data = conllu.data
+        for key, positions in hits:
+            sent = data[key]
+            rows, codes, values = sent.rows, sent.store.columns[column], sent.store.pools[column].values
+            self.matched += len(positions)
+            for position in positions:
+                old = values[codes[rows[position]]]
+                if old not in newvalues:
+                    new = self.newvalue(old)
+                    newvalues[old] = (new, required is None or required(new))
+                new, correct = newvalues[old]
+                if not correct:
+                    self.refused[new] += 1
+                elif new != old:
+                    changes.append((key, position, column, old, new))
+        self.counts.update((old, new) for key, position, name, old, new in changes)
+        if known is not None:
+            for (old, new), count in self.counts.items():
+                if not known(new):
+                    self.unknown[new] += count
+
+    def stale(self, conllu):
+        """The corpus was edited after the dry run or it isn't the same corpus"""
+        return conllu.query is not self.index or conllu.query.version != self.version
+
+    def sentences(self):
+        return len({change[0] for change in self.changes})
+
+    def summary(self):
+        """Lines of preview: what changes how many times, what is refused"""
+        lines = [f'{len(self.changes)} tokens in {self.sentences()} sentences will change, {self.matched} tokens match the query']
+        lines.extend(f'{old} → {new}: {count}' for (old, new), count in self.counts.most_common(10))
+        if len(self.counts) > 10:
+            lines.append(f'... {len(self.counts) - 10} more')
+        for new, count in self.refused.most_common(5):
+            lines.append(f'Refused, {new} is not a correct {self.column}: {count} tokens')
+        for new, count in self.unknown.most_common(5):
+            lines.append(f'Unknown {self.column} {new}: {count} tokens')
+        return lines
+
+    @timed('Replacement.apply')
+    def apply(self, conllu):
+        """Write the changes as one step of history: raises ReplaceError if the corpus was edited since the dry run"""
+        if self.stale(conllu):
+            raise ReplaceError('The corpus was edited after the preview, make it again')
+        if not self.changes:
+            return
+        conllu.history.record(f'Replace {self.column} in {len(self.changes)} tokens', self.changes)
+        conllu.apply(self.changes)
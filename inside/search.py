@@ -0,0 +1,173 @@
+import re
+from array import array
+from collections import OrderedDict
+from bisect import bisect_left, bisect_right, insort
+from itertools import accumulate, repeat
+
+WORD = re.compile(r'\w+')
+HAYSTACKS = 20000 # lowercased sentences kept for checking hits of later searches
+
+class Vocabulary(dict):
+    """Word ids: word -> id, words[id] -> word, same as StringPool of reader"""
+    def __init__(self):
+        super().__init__()
+        self.words = []
+        self.postings = [] # word id -> sorted keys of sentences with the word
+
+    def __missing__(self, word):
+        wordid = self[word] = len(self.words)
+        self.words.append(word)
+        self.postings.append(array('I'))
+        return wordid
+
+class SearchIndex:
+    """
+    Inverted index over sentence text, token forms and lemmas:
+    every lowercased word points to sorted keys of sentences that have it.
+    Substrings are looked up in the vocabulary, not in sentences
+    """
+    def __init__(self, data):
+        self.data = data # Conllu.data
+        self.ids = Vocabulary()
+        self.vocab = '' # words joined with \0: substring search runs here
+        self.starts = array('I') # word id -> start of word in vocab
+        self.sentwords = {} # sentence key -> ids of its words
+        self.last = 0 # biggest key indexed, bigger ones go to the end of postings
+        self.haystacks = OrderedDict() # sentence key -> lowercased text, forms and lemmas, least recently used first
+        self.valuewords = {} # column -> (pool, word ids of every pool value), values are split once
+
+    @classmethod
+    def build(cls, data):
+        """Index all sentences of Conllu.data"""
+        index = cls(data)
+        for key, sent in data.scan() if hasattr(data, 'pinned') else data.items():
+            index.add(key, sent)
+        return index
+
+    @staticmethod
+    def haystack(sent):
+        values, columns = sent.store.pools, sent.store.columns
+        forms = ' '.join(map(values['form'].values.__getitem__, map(columns['form'].__getitem__, sent.rows)))
+        lemmas = ' '.join(map(values['lemma'].values.__getitem__, map(columns['lemma'].__getitem__, sent.rows)))
+        return f'{sent.text or ""}\n{forms}\n{lemmas}'.lower()
+
+    def columnwords(self, sent, name):
+        """Word ids of column values in sentence"""
+        pool = sent.store.pools[name]
+        cached, table = self.valuewords.get(name, (None, None))
+        if cached is not pool: # another store, e.g. after packing
+            table = []
+            self.valuewords[name] = (pool, table)
+        if len(table) < len(pool.values):
+            table.extend(frozenset(map(self.ids.__getitem__, WORD.findall(value.lower()))) for value in pool.values[len(table):])
+        return set().union(*map(table.__getitem__, set(map(sent.store.columns[name].__getitem__, sent.rows))))
+
+    def add(self, key, sent):
+        """Index sentence; keys come in ascending order when building, so postings mostly stay sorted by appending"""
+        words = self.columnwords(sent, 'form') | self.columnwords(sent, 'lemma')
+        words.update(map(self.ids.__getitem__, WORD.findall((sent.text or '').lower())))
+        words = self.sentwords[key] = array('I', words)
+        postings = self.ids.postings
+        if key > self.last:
+            self.last = key
+            list(map(array.append, map(postings.__getitem__, words), repeat(key)))
+        else:
+            for wordid in words:
+                insort(postings[wordid], key)
+
+    def remove(self, key):
+        for wordid in self.sentwords.pop(key, ()):
+            keys = self.ids.postings[wordid]
+            i = bisect_left(keys, key)
+            if i < len(keys) and keys[i] == key:
+                del keys[i]
+        self.haystacks.pop(key, None)
+
+    def update(self, key, sent):
+        """Sentence was edited"""
+        self.remove(key)
+        self.add(key, sent)
+
+    def containing(self, part):
+        """Keys of sentences with a word containing part"""
+        words = self.ids.words
+        if len(self.starts) < len(words): # new words since last time
+            new = words[len(self.starts):]
+            self.starts.extend(accumulate(map(len, new), lambda start, size: start + size + 1, initial=len(self.vocab)))
+            self.starts.pop() # start of the word to come
+            self.vocab += ''.join(map('{}\0'.format, new))
+        found = set()
+        pos = self.vocab.find(part)
+        while pos >= 0:
+            wordid = bisect_right(self.starts, pos) - 1
+            found.update(self.ids.postings[wordid])
+            # the rest of this word can't give anything new
+            pos = self.vocab.find(part, self.vocab.index('\0', pos))
+        return found
+
+    def candidates(self, words, whole):
+        """Keys of sentences having all words (or words containing them), None if there are no words to look for"""
+        found = None
+        for word in sorted(set(words), key=len, reverse=True): # long words are rare, they narrow the search quickly
+            if whole:
+                wordid = self.ids.get(word)
+                keys = set(self.ids.postings[wordid]) if wordid is not None else set()
+            else:
+                keys = self.containing(word)
+            found = keys if found is None else found & keys
+            if not found:
+                break
+        return found
+
+    def matching(self, keys, match):
+        """
+        Sorted keys of sentences whose haystack passes match. Sentences of lazy data
+        are read in a separate reader, same as LazySentences.scan does, and only when their haystack isn't kept
+        """
+        haystacks, pinned, source = self.haystacks, getattr(self.data, 'pinned', None), None
+        found = []
+        try:
+            for key in sorted(keys):
+                haystack = haystacks.get(key)
+                if haystack is not None:
+                    haystacks.move_to_end(key)
+                else:
+                    if pinned is None:
+                        sent = self.data[key]
+                    elif key in pinned:
+                        sent = pinned[key]
+                    else:
+                        if source is None:
+                            source = self.data.reopen()
+                        sent = source.parse(key)
+                    haystack = haystacks[key] = self.haystack(sent)
+                    if len(haystacks) > HAYSTACKS:
+                        haystacks.popitem(last=False)
+                if match(haystack):
+                    found.append(key)
+        finally:
+            if source is not None:
+                source.close()
+        return found
+
+    def find(self, query, mode='substring'):
+        """
+        Sorted keys of sentences matching query, case is ignored.
+        Modes: substring, word (whole words), regex; a bad regex raises re.error
+        """
+        if mode == 'regex':
+            pattern = re.compile(query, re.IGNORECASE)
+            return self.matching(self.sentwords, pattern.search)
+        query = query.lower()
+        if not query.strip():
+            return []
+        words = WORD.findall(query)
+        found = self.candidates(words, mode == 'word')
+        if found is None: # only punctuation: nothing to look up, check every sentence
+            found = self.sentwords.keys()
+        elif len(words) == 1 and words[0] == (query if mode == 'substring' else query.strip()):
+            return sorted(found) # a single word found in vocabulary is a hit as it is
+        if mode == 'word':
+            pattern = re.compile(r'(?<!\w)' + re.escape(query.strip()) + r'(?!\w)')
+            return self.matching(found, pattern.search)
+        return self.matching(found, query.__contains__)
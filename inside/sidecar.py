@@ -0,0 +1,54 @@
+import os
+import pickle
+from inside.files import replacefile
+
+def filestamp(path):
+    """State of project file: a file next to it is good only for the state it was saved for"""
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+class Sidecar:
+    """
+    State kept in a file next to the project, path + suffix: the stamp of project file goes first,
+    then the pickled state. Subclasses give suffix and snapshot, and set changed when their state changes
+    """
+    suffix = None
+
+    def __init__(self):
+        self.stamp = None # project file state the file was last saved for
+        self.changed = True # since the file was saved
+
+    def snapshot(self):
+        """Function giving the pickled state as it is now: it may be called in another thread"""
+        raise NotImplementedError
+
+    def savejob(self, path):
+        """
+        Snapshot of the state for saving next to project file at path: returns a function
+        to call after the project file is written, it may run in another thread
+        """
+        dump, changed = self.snapshot(), self.changed
+        self.changed = False
+        def job():
+            stamp = filestamp(path)
+            if stamp == self.stamp and not changed:
+                return # the file has it already
+            def write(tmp):
+                with open(tmp, 'wb') as file:
+                    pickle.dump(stamp, file)
+                    file.write(dump())
+            replacefile(path + self.suffix, write)
+            self.stamp = stamp
+        return job
+
+    @classmethod
+    def read(cls, path):
+        """(stamp, state) saved next to project file at path, None if there is none for this state of the file"""
+        try:
+            stamp = filestamp(path)
+            with open(path + cls.suffix, 'rb') as file:
+                if pickle.load(file) != stamp:
+                    return None
+                return stamp, pickle.load(file)
+        except Exception: # missing or broken: same as none
+            return None
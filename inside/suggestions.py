@@ -0,0 +1,101 @@
+import pickle
+from collections import Counter
+from itertools import chain
+from inside.sidecar import Sidecar
+
+EMPTY = ('', '_') # values nobody has annotated yet
+KEY = ('lemma', 'upos', 'deprel') # what a suggestion is looked up by
+FIELDS = KEY + ('semslot', 'semclass')
+SUFFIX = '.suggestions' # file next to the project
+
+class Suggestions(Sidecar):
+    """
+    Semantic annotation seen before for the same lemma, UPOS and DEPREL:
+    counts of (semslot, semclass) of annotated tokens by (lemma, upos, deprel).
+    The most common annotation of a key is memoized, so a lookup is a dict access
+    """
+    suffix = SUFFIX
+
+    def __init__(self, table=None):
+        super().__init__()
+        self.table = table if table is not None else {} # key -> Counter of (semslot, semclass)
+        self.best = {} # key -> most common annotation or None, forgotten when counts of key change
+        self.dump = None # pickled table, kept while nothing changes
+
+    @staticmethod
+    def values(token):
+        """Values of FIELDS of a Token"""
+        return tuple(getattr(token, name) for name in FIELDS)
+
+    @classmethod
+    def build(cls, conllu):
+        """Count annotations of all tokens of Conllu, a lazy corpus counts them in one pass over its file"""
+        suggestions = cls()
+        data = conllu.data
+        if hasattr(data, 'counts'): # lazy corpus
+            for values, count in data.counts(FIELDS).items():
+                suggestions.add(values, count)
+            return suggestions
+        stores = {} # codes are counted for each store at once, same as Conllu.valuecounts
+        for sent in data.values():
+            stores.setdefault(id(sent.store), (sent.store, []))[1].append(sent.rows)
+        for store, rows in stores.values():
+            columns = [store.columns[name] for name in FIELDS]
+            if sum(map(len, rows)) < store.size: # some rows are left from deleted tokens
+                rows = list(chain.from_iterable(rows))
+                columns = [map(column.__getitem__, rows) for column in columns]
+            pools = [store.pools[name].values for name in FIELDS]
+            for codes, count in Counter(zip(*columns)).items():
+                suggestions.add(tuple(map(list.__getitem__, pools, codes)), count)
+        return suggestions
+
+    def add(self, values, count=1):
+        """Count annotation of a token with these values of FIELDS, negative count takes it away"""
+        lemma, upos, deprel, semslot, semclass = values
+        if semslot in EMPTY or semclass in EMPTY:
+            return
+        key = (lemma, upos, deprel)
+        counts = self.table.get(key)
+        if counts is None:
+            counts = self.table[key] = Counter()
+        counts[(semslot, semclass)] += count
+        if counts[(semslot, semclass)] <= 0:
+            del counts[(semslot, semclass)]
+            if not counts:
+                del self.table[key]
+        self.best.pop(key, None)
+        self.dump = None
+        self.changed = True
+
+    def update(self, old, new):
+        """A token was saved: old and new values of FIELDS"""
+        if old != new:
+            self.add(old, -1)
+            self.add(new)
+
+    def suggest(self, lemma, upos, deprel):
+        """Most common (semslot, semclass) for the key, None if it was never annotated"""
+        key = (lemma, upos, deprel)
+        try:
+            return self.best[key]
+        except KeyError:
+            counts = self.table.get(key)
+            best = self.best[key] = counts.most_common(1)[0][0] if counts else None
+            return best
+
+    def snapshot(self):
+        if self.dump is None:
+            self.dump = pickle.dumps(self.table, pickle.HIGHEST_PROTOCOL)
+        dump = self.dump
+        return lambda: dump
+
+    @classmethod
+    def load(cls, path):
+        """Table saved next to project file at path, None if there is none for this state of the file"""
+        saved = cls.read(path)
+        if saved is None: # the table gets counted anew
+            return None
+        stamp, table = saved
+        suggestions = cls(table)
+        suggestions.stamp, suggestions.changed = stamp, False
+        return suggestions
@@ -0,0 +1,106 @@
+import os
+import json
+import time
+import threading
+import tracemalloc
+from bisect import bisect_left
+from collections import deque
+from functools import wraps
+
+BOUNDS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000) # ms, upper bounds of histogram buckets, the last bucket has none
+SAMPLES = 1000 # latest calls kept for percentiles
+
+class Stat:
+    """Calls of one function: histogram of latencies and latest calls as (ms, sentence length, memory delta)"""
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.worst = 0.0
+        self.buckets = [0] * (len(BOUNDS) + 1)
+        self.samples = deque(maxlen=SAMPLES)
+
+    def add(self, ms, size, memory):
+        self.count += 1
+        self.total += ms
+        self.worst = max(self.worst, ms)
+        self.buckets[bisect_left(BOUNDS, ms)] += 1
+        self.samples.append((ms, size, memory))
+
+    def summary(self):
+        times = sorted(ms for ms, size, memory in self.samples)
+        sizes = [size for ms, size, memory in self.samples if size is not None]
+        memory = [memory for ms, size, memory in self.samples if memory is not None]
+        percentile = lambda part: times[min(len(times) - 1, int(part * len(times)))] if times else 0.0
+        return {'calls': self.count, 'mean_ms': self.total / self.count if self.count else 0.0,
+                'p50_ms': percentile(0.5), 'p95_ms': percentile(0.95), 'max_ms': self.worst,
+                'mean_tokens': sum(sizes) / len(sizes) if sizes else None,
+                'mean_memory_kb': sum(memory) / len(memory) / 1024 if memory else None,
+                'histogram': {f'<={bound}' if bound else f'>{BOUNDS[-1]}': count for bound, count in zip(BOUNDS + (None,), self.buckets)}}
+
+class Timings:
+    """
+    Opt-in latency records of hot paths. Functions are wrapped with timed once, at import;
+    while recording is off a wrapper only checks a flag. Memory deltas come from tracemalloc,
+    which slows everything down, so they are recorded only if asked for
+    """
+    def __init__(self):
+        self.enabled = False
+        self.memory = False
+        self.stats = {} # name -> Stat
+        self.lock = threading.Lock() # some paths run in worker threads
+
+    def enable(self, enabled=True, memory=False):
+        self.enabled = enabled
+        memory = enabled and memory
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        elif not memory and self.memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.memory = memory
+
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+
+    def record(self, name, ms, size=None, memory=None):
+        with self.lock:
+            stat = self.stats.get(name)
+            if stat is None:
+                stat = self.stats[name] = Stat()
+            stat.add(ms, size, memory)
+
+    def timed(self, name, size=None):
+        """Decorator: record latency of calls as name; size(*args) gives sentence length, called after the call"""
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                before = tracemalloc.get_traced_memory()[0] if self.memory else None
+                start = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    ms = (time.perf_counter() - start) * 1000
+                    memory = tracemalloc.get_traced_memory()[0] - before if before is not None and tracemalloc.is_tracing() else None
+                    try:
+                        length = size(*args, **kwargs) if size is not None else None
+                    except Exception: # e.g. sentence is gone: latency still counts
+                        length = None
+                    self.record(name, ms, length, memory)
+            return wrapper
+        return decorator
+
+    def report(self):
+        with self.lock: # other threads keep adding samples
+            return {name: stat.summary() for name, stat in sorted(self.stats.items())}
+
+    def dump(self, path):
+        with open(path, 'w', encoding='utf8') as file:
+            json.dump({'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'memory': self.memory, 'timings': self.report()}, file, indent=1)
+
+TIMINGS = Timings()
+timed = TIMINGS.timed
+
+if os.environ.get('COBALD_TIMING'): # recording from the start, e.g. to catch slow opening: 1, or memory to track it too
+    TIMINGS.enable(True, os.environ['COBALD_TIMING'] == 'memory')
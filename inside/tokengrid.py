@@ -0,0 +1,156 @@
+from PyQt5.QtWidgets import QTableView, QStyledItemDelegate, QHeaderView
+from PyQt5 import QtGui, QtCore
+from inside.utils import CustomQLineEdit, TokenRow
+from inside.suggestions import EMPTY
+
+COLUMNS = ('idx', 'form') + TokenRow.FIELDS
+HEADERS = ('ID', 'FORM', 'LEMMA', 'UPOS', 'XPOS', 'FEATS', 'HEAD', 'DEPREL', 'DEPS', 'SEMSLOT', 'SEMCLASS')
+WRONG = QtGui.QColor(245, 66, 87)
+SUGGESTED = QtGui.QColor(222, 236, 250)
+
+class TokenModel(QtCore.QAbstractTableModel):
+    """
+    Table model over tokens of a sentence: edits are kept aside
+    until savesent checks them and writes them to tokens
+    """
+    def __init__(self, checks):
+        super().__init__()
+        self.tokens = []
+        self.edits = {} # (row, column name) -> edited text
+        self.flashed = set() # cells highlighted for a while
+        self.checks = checks # column name -> function telling if value is correct
+        self.suggested = {} # row -> suggested (semslot, semclass)
+
+    def setsentence(self, tokens, suggested=None):
+        self.beginResetModel()
+        self.tokens = tokens
+        self.edits = {}
+        self.suggested = suggested or {}
+        self.flashed = set()
+        self.endResetModel()
+
+    def setedits(self, edits):
+        """Replace edits not saved yet, e.g. when sentence reset is undone"""
+        self.beginResetModel()
+        self.edits = dict(edits)
+        self.endResetModel()
+
+    def value(self, row, name):
+        edit = self.edits.get((row, name))
+        return edit if edit is not None else getattr(self.tokens[row], name)
+
+    def values(self, row):
+        """Field texts by column name, same as TokenRow.values"""
+        return {name: self.value(row, name) for name in TokenRow.FIELDS}
+
+    def suggestion(self, row, name):
+        """Suggested value of an empty cell, None if there is none"""
+        if name in ('semslot', 'semclass') and row in self.suggested and self.value(row, name) in EMPTY:
+            return self.suggested[row][name == 'semclass']
+        return None
+
+    def accept(self):
+        """Put suggestions into empty cells, returns how many cells were filled"""
+        filled = 0
+        for row in self.suggested:
+            for name in ('semslot', 'semclass'):
+                value = self.suggestion(row, name)
+                if value is not None:
+                    self.setData(self.index(row, COLUMNS.index(name)), value)
+                    filled += 1
+        return filled
+
+    def flash(self, row, name):
+        """Mark incorrect cell for a while"""
+        self.flashed.add((row, name))
+        index = self.index(row, COLUMNS.index(name))
+        self.dataChanged.emit(index, index)
+        def unflash():
+            self.flashed.discard((row, name))
+            if row < len(self.tokens):
+                self.dataChanged.emit(index, index)
+        QtCore.QTimer.singleShot(2000, unflash)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.tokens)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(COLUMNS)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row, name = index.row(), COLUMNS[index.column()]
+        if role in (QtCore.Qt.DisplayRole, QtCore.Qt.EditRole):
+            return self.value(row, name)
+        if role == QtCore.Qt.BackgroundRole:
+            check = self.checks.get(name)
+            if (row, name) in self.flashed or (check is not None and not check(self.value(row, name))):
+                return WRONG
+            if self.suggestion(row, name) is not None:
+                return SUGGESTED
+        if role == QtCore.Qt.ToolTipRole:
+            suggestion = self.suggestion(row, name)
+            if suggestion is not None:
+                return f'Suggested: {suggestion}'
+        return None
+
+    def setData(self, index, value, role=QtCore.Qt.EditRole):
+        if role != QtCore.Qt.EditRole or not index.isValid():
+            return False
+        self.edits[(index.row(), COLUMNS[index.column()])] = value
+        self.dataChanged.emit(index, index)
+        return True
+
+    def flags(self, index):
+        flags = QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable
+        if COLUMNS[index.column()] not in ('idx', 'form'): # index and form can't be edited
+            flags |= QtCore.Qt.ItemIsEditable
+        return flags
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if role == QtCore.Qt.DisplayRole and orientation == QtCore.Qt.Horizontal:
+            return HEADERS[section]
+        return None
+
+class TokenDelegate(QStyledItemDelegate):
+    """Editors for token cells, with the same completers as token rows"""
+    def __init__(self, completers, parent=None):
+        super().__init__(parent)
+        self.completers = completers
+
+    def createEditor(self, parent, option, index):
+        editor = CustomQLineEdit(parent)
+        completer = self.completers.get(COLUMNS[index.column()])
+        if completer is not None:
+            editor.setCompleter(completer)
+        return editor
+
+class TokenGrid(QTableView):
+    """Token editor for very long sentences: only visible rows get painted"""
+    def __init__(self, checks, completers, actions):
+        super().__init__()
+        self.tokenmodel = TokenModel(checks)
+        self.setModel(self.tokenmodel)
+        self.setItemDelegate(TokenDelegate(completers, self))
+        self.verticalHeader().hide()
+        self.verticalHeader().setSectionResizeMode(QHeaderView.Fixed) # same height for all rows, no measuring
+        self.horizontalHeader().setStretchLastSection(True)
+        self.setEditTriggers(QTableView.AllEditTriggers)
+        # add context menu to add\remove tokens
+        self.setContextMenuPolicy(QtCore.Qt.ActionsContextMenu)
+        for action in actions:
+            self.addAction(action)
+
+    def setsentence(self, tokens, textwidth, morph, suggested=None):
+        self.tokenmodel.setsentence(tokens, suggested)
+        for name in ('idx', 'form', 'lemma'):
+            self.setColumnWidth(COLUMNS.index(name), textwidth if name != 'idx' else 55)
+        for name, width in TokenRow.WIDTHS.items():
+            self.setColumnWidth(COLUMNS.index(name), width)
+        self.setColumnHidden(COLUMNS.index('feats'), not morph)
+        self.scrollToTop()
+
+    def flash(self, row, name):
+        self.tokenmodel.flash(row, name)
+        self.scrollTo(self.tokenmodel.index(row, COLUMNS.index(name)))
@@ -0,0 +1,170 @@
+import os
+import time
+import pickle
+import random
+import threading
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from googletrans import Translator
+from inside.files import replacefile
+from inside.timing import timed
+
+WORKERS = 4 # requests at the same time
+RATE = 5 # requests a second at most
+RETRIES = 3 # more tries after a failed request
+BACKOFF = 1 # seconds before the first retry, doubles with every next one
+CACHESIZE = 100000 # translations kept on disk, least recently used go first
+
+class GoogleBackend:
+    """Google Translate through googletrans, needs network"""
+    def __init__(self):
+        self.local = threading.local() # a translator for every thread, they keep a connection each
+
+    def translate(self, text, src, dest):
+        if not hasattr(self.local, 'translator'):
+            self.local.translator = Translator()
+        return self.local.translator.translate(text, src=src, dest=dest).text
+
+class OfflineBackend:
+    """Stand-in backend for working without network: marks text with languages, may be slow or fail on purpose"""
+    def __init__(self, delay=0.0, failures=0.0):
+        self.delay = delay # seconds a request takes
+        self.failures = failures # part of requests that fail
+
+    def translate(self, text, src, dest):
+        time.sleep(self.delay)
+        if random.random() < self.failures:
+            raise ConnectionError('Offline backend failed on purpose')
+        return f'[{src}>{dest}] {text}'
+
+BACKENDS = {'google': GoogleBackend, 'offline': OfflineBackend}
+
+class TranslationCache:
+    """
+    Translations already made: (normalized text, src, dest) -> translation, least recently used first.
+    Kept in a file between sessions, shared by worker threads
+    """
+    def __init__(self, path, size=CACHESIZE):
+        self.path = path
+        self.size = size
+        self.lock = threading.Lock()
+        self.changed = False # something to write
+        self.items = OrderedDict()
+        if os.path.exists(path):
+            try:
+                with open(path, 'rb') as file:
+                    self.items = pickle.load(file)
+            except Exception: # broken cache is no reason not to start
+                self.items = OrderedDict()
+
+    @staticmethod
+    def key(text, src, dest):
+        return ' '.join(unicodedata.normalize('NFC', text).split()), src, dest
+
+    def get(self, text, src, dest):
+        key = self.key(text, src, dest)
+        with self.lock:
+            result = self.items.get(key)
+            if result is not None:
+                self.items.move_to_end(key)
+                self.changed = True
+            return result
+
+    def put(self, text, src, dest, result):
+        with self.lock:
+            self.items[self.key(text, src, dest)] = result
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+            self.changed = True
+
+    def save(self):
+        """Write cache file"""
+        with self.lock:
+            if not self.changed:
+                return
+            data = pickle.dumps(self.items, pickle.HIGHEST_PROTOCOL)
+            self.changed = False
+        def write(path):
+            with open(path, 'wb') as file:
+                file.write(data)
+        replacefile(self.path, write)
+
+class RateLimiter:
+    """Lets calls through not more often than rate a second, for all threads together"""
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self.lock = threading.Lock()
+        self.next = 0.0 # time the next call may go
+
+    def wait(self, cancelled):
+        """Wait for our turn, returns False if cancelled meanwhile"""
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next)
+            self.next = start + self.interval
+        return not cancelled.wait(start - now)
+
+class BatchTranslation:
+    """
+    Translation of many sentences in worker threads. Every translation is given
+    to onresult(key, text) as soon as it comes, so cancelling keeps what is done;
+    onprogress(done, failed, total) is called after every sentence.
+    Callbacks are called from worker threads. Translations found in cache cost no request
+    """
+    def __init__(self, backend, sents, src, dest, onresult, onprogress, cache=None, workers=WORKERS, rate=RATE, retries=RETRIES):
+        self.backend = backend
+        self.cache = cache
+        self.sents = sents # [(key, text), ...]
+        self.src, self.dest = src, dest
+        self.onresult, self.onprogress = onresult, onprogress
+        self.retries = retries
+        self.limiter = RateLimiter(rate)
+        self.cancelled = threading.Event()
+        self.lock = threading.Lock()
+        self.done = self.failed = 0
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def start(self):
+        for key, text in self.sents:
+            self.executor.submit(self.translateone, key, text)
+        self.executor.shutdown(wait=False)
+
+    def cancel(self):
+        """Stop sending requests, sentences not translated yet stay as they are"""
+        self.cancelled.set()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def finished(self):
+        return self.done + self.failed == len(self.sents)
+
+    @timed('BatchTranslation.translateone')
+    def translateone(self, key, text):
+        result = self.cache.get(text, self.src, self.dest) if self.cache is not None else None
+        if result is not None:
+            self.onresult(key, result)
+            with self.lock:
+                self.done += 1
+                self.onprogress(self.done, self.failed, len(self.sents))
+            return
+        for attempt in range(self.retries + 1):
+            if not self.limiter.wait(self.cancelled):
+                return
+            try:
+                result = self.backend.translate(text, self.src, self.dest)
+            except Exception:
+                if attempt == self.retries or self.cancelled.wait(BACKOFF * 2 ** attempt):
+                    break
+                continue
+            if self.cache is not None:
+                self.cache.put(text, self.src, self.dest, result)
+            self.onresult(key, result)
+            with self.lock:
+                self.done += 1
+                self.onprogress(self.done, self.failed, len(self.sents))
+            return
+        if self.cancelled.is_set():
+            return
+        with self.lock:
+            self.failed += 1
+            self.onprogress(self.done, self.failed, len(self.sents))
@@ -1,5 +1,8 @@
-from PyQt5.QtWidgets import QDialog, QDialogButtonBox, QVBoxLayout, QLabel, QUndoCommand, QLineEdit, QWidget, QPushButton, QHBoxLayout, QGridLayout
+from PyQt5.QtWidgets import QDialog, QDialogButtonBox, QVBoxLayout, QLabel, QUndoCommand, QLineEdit, QWidget, QPushButton, QHBoxLayout, QGridLayout, QComboBox, QCompleter, QRadioButton, QSpinBox, QCheckBox, QTableWidget, QTableWidgetItem, QHeaderView, QFileDialog
 from PyQt5 import QtGui, QtCore
+from inside.suggestions import EMPTY
+
+SUGGESTED = 'background-color: rgb(222, 236, 250)' # field with a suggestion for it
 
 class RestoreWarning(QDialog):
     """Window for warning about resetting annotation"""
@@ -65,12 +68,97 @@ class StoreCommand(QUndoCommand):
     def redo(self):
         self.field.setText(self.text)
 
+class ResetCommand(QUndoCommand):
+    """For undo/redo of sentence reset: (setter, text before, text after) of every field it changes"""
+    def __init__(self, changes):
+        QUndoCommand.__init__(self, 'Reset sentence')
+        self.changes = changes
+
+    def undo(self):
+        for setter, before, after in self.changes:
+            setter(before)
+
+    def redo(self):
+        for setter, before, after in self.changes:
+            setter(after)
+
 class CustomQLineEdit(QLineEdit):
     """Stores initial text for undo/redo"""
     def __init__(self, parent):
         super().__init__(parent)
         self.init_text = self.text()
 
+class RankedCompleter(QCompleter):
+    """Completer showing what Completion finds for the typed text, in its order"""
+    def __init__(self, completion):
+        super().__init__()
+        self.completion = completion
+        self.setModel(QtCore.QStringListModel(self))
+        self.setModelSorting(QCompleter.UnsortedModel)
+        self.setCaseSensitivity(QtCore.Qt.CaseInsensitive)
+        self.setMaxVisibleItems(10)
+
+    def splitPath(self, path):
+        # called for every change of text: the model gets ranked values and none of them is filtered out
+        self.model().setStringList(self.completion.complete(path))
+        return ['']
+
+class TokenRow(QWidget):
+    """A row of token fields: created once and reused for any token"""
+    FIELDS = ('lemma', 'upos', 'xpos', 'feats', 'head', 'deprel', 'deps', 'semslot', 'semclass')
+    WIDTHS = {'upos': 75, 'xpos': 150, 'head': 55, 'deprel': 150} # lemma width is set by user
+
+    def __init__(self, completers, actions, onedit):
+        super().__init__()
+        self.layout = QHBoxLayout(self)
+        self.layout.setContentsMargins(0, 0, 0, 0)
+        # index and form can't be edited
+        self.info = QLabel()
+        # add context menu to add\remove tokens
+        self.info.setContextMenuPolicy(QtCore.Qt.ActionsContextMenu)
+        for action in actions:
+            self.info.addAction(action)
+        self.layout.addWidget(self.info)
+        self.fields = {}
+        for name in self.FIELDS:
+            field = CustomQLineEdit('')
+            if name in self.WIDTHS:
+                field.setFixedWidth(self.WIDTHS[name])
+            if name in completers:
+                field.setCompleter(completers[name])
+            field.editingFinished.connect(onedit)
+            self.layout.addWidget(field)
+            self.fields[name] = field
+
+    def bind(self, token, textwidth, morph):
+        """Show token in this row"""
+        self.info.setText(f"{token.idx}\t{token.form}")
+        self.info.setFixedWidth(textwidth)
+        self.fields['lemma'].setFixedWidth(textwidth)
+        self.fields['feats'].setVisible(morph)
+        for name, field in self.fields.items():
+            text = getattr(token, name)
+            field.setText(text)
+            field.init_text = text
+        self.fields['feats'].setCursorPosition(0)
+
+    def suggest(self, annotation):
+        """Show suggested (semslot, semclass) in empty fields, None hides it"""
+        for name, value in zip(('semslot', 'semclass'), annotation or (None, None)):
+            field = self.fields[name]
+            if value is not None and field.text() in EMPTY:
+                field.setPlaceholderText(value)
+                field.setToolTip(f'Suggested: {value}')
+                field.setStyleSheet(SUGGESTED)
+            elif field.toolTip():
+                field.setPlaceholderText('')
+                field.setToolTip('')
+                field.setStyleSheet('')
+
+    def values(self):
+        """Field texts by column name"""
+        return {name: field.text() for name, field in self.fields.items()}
+
 class AddRemoveTokenWindow(QWidget):
     '''A Window for getting the token index from user'''
     choice = QtCore.pyqtSignal(str)
@@ -122,9 +210,64 @@ class SetFieldWidth(QWidget):
         self.choice.emit(self.liner.text())
         self.close()
 
+class SetAutosave(QWidget):
+    '''A Window for getting the autosave interval from user'''
+    choice = QtCore.pyqtSignal(str)
+
+    def __init__(self, initial):
+        super().__init__()
+        self.setWindowTitle('Enter autosave interval')
+        self.setWindowIcon(QtGui.QIcon('inside/design/main.png'))
+        self.label = QLabel()
+        self.label.setText('Autosave every N minutes, 0 turns it off')
+        self.liner = QLineEdit(self)
+        self.liner.setText(str(initial))
+        self.button = QPushButton("&Default")
+        self.button.setText('OK')
+        self.button.clicked.connect(self.ok)
+        self.button.setDefault(True)
+        self.button.setAutoDefault(True)
+        self.layout = QGridLayout()
+        self.layout.addWidget(self.label, 1, 1)
+        self.layout.addWidget(self.liner, 2, 1)
+        self.layout.addWidget(self.button, 2, 2)
+        self.setLayout(self.layout)
+
+    def ok(self):
+        self.choice.emit(self.liner.text())
+        self.close()
+
+class SetUndoLimit(QWidget):
+    '''A Window for getting the memory limit of undo history from user'''
+    choice = QtCore.pyqtSignal(str)
+
+    def __init__(self, initial):
+        super().__init__()
+        self.setWindowTitle('Enter undo history size')
+        self.setWindowIcon(QtGui.QIcon('inside/design/main.png'))
+        self.label = QLabel()
+        self.label.setText('Memory for undo history, MB: oldest steps are forgotten first')
+        self.liner = QLineEdit(self)
+        self.liner.setText(str(initial))
+        self.button = QPushButton("&Default")
+        self.button.setText('OK')
+        self.button.clicked.connect(self.ok)
+        self.button.setDefault(True)
+        self.button.setAutoDefault(True)
+        self.layout = QGridLayout()
+        self.layout.addWidget(self.label, 1, 1)
+        self.layout.addWidget(self.liner, 2, 1)
+        self.layout.addWidget(self.button, 2, 2)
+        self.setLayout(self.layout)
+
+    def ok(self):
+        self.choice.emit(self.liner.text())
+        self.close()
+
 class SearchWindow(QWidget):
     '''A Window for getting the search text from user'''
-    choice = QtCore.pyqtSignal(str)
+    choice = QtCore.pyqtSignal(str, str) # text, search mode
+    MODES = {'Substring': 'substring', 'Whole word': 'word', 'Regex': 'regex'}
 
     def __init__(self):
         super().__init__()
@@ -139,14 +282,82 @@ class SearchWindow(QWidget):
         self.button.setDefault(True)
         self.button.setAutoDefault(True)
         self.button.clicked.connect(self.ok)
+        self.mode = QComboBox()
+        self.mode.addItems(self.MODES)
+        self.hits = QLabel('') # found sentences
         self.layout = QGridLayout()
         self.layout.addWidget(self.label, 1, 1)
+        self.layout.addWidget(self.mode, 1, 2)
         self.layout.addWidget(self.liner, 2, 1)
         self.layout.addWidget(self.button, 2, 2)
+        self.layout.addWidget(self.hits, 3, 1)
         self.setLayout(self.layout)
 
     def ok(self):
-        self.choice.emit(self.liner.text())
+        self.choice.emit(self.liner.text(), self.MODES[self.mode.currentText()])
+
+class QueryWindow(QWidget):
+    '''A Window for getting a token query from user and stepping through the results'''
+    choice = QtCore.pyqtSignal(str, int) # query, step: 1 for next result, -1 for previous
+
+    def __init__(self):
+        super().__init__()
+        self.setWindowTitle('Query tokens')
+        self.setWindowFlags(QtCore.Qt.WindowStaysOnTopHint)
+        self.setWindowIcon(QtGui.QIcon('inside/design/main.png'))
+        self.label = QLabel('Query, e.g. semslot=Agent & deprel=obl, lemma~^ab & checked=no, head.upos=VERB')
+        self.liner = QLineEdit(self)
+        self.prevbutton = QPushButton('Previous')
+        self.prevbutton.clicked.connect(lambda: self.choice.emit(self.liner.text(), -1))
+        self.button = QPushButton('Next')
+        self.button.setDefault(True)
+        self.button.setAutoDefault(True)
+        self.button.clicked.connect(lambda: self.choice.emit(self.liner.text(), 1))
+        self.hits = QLabel('') # found sentences and tokens
+        self.layout = QGridLayout()
+        self.layout.addWidget(self.label, 1, 1, 1, 3)
+        self.layout.addWidget(self.liner, 2, 1)
+        self.layout.addWidget(self.prevbutton, 2, 2)
+        self.layout.addWidget(self.button, 2, 3)
+        self.layout.addWidget(self.hits, 3, 1, 1, 3)
+        self.setLayout(self.layout)
+
+class ReplaceWindow(QWidget):
+    '''A Window for rewriting a column in all tokens matching a query: preview first, then replace'''
+    choice = QtCore.pyqtSignal(str, str, str, str, bool) # query, column, pattern, value, apply: False for preview
+
+    def __init__(self, columns):
+        super().__init__()
+        self.setWindowTitle('Replace in corpus')
+        self.setWindowIcon(QtGui.QIcon('inside/design/main.png'))
+        self.label = QLabel('Tokens, e.g. semclass=X & lemma=Y & deprel=obj')
+        self.query = QLineEdit(self)
+        self.column = QComboBox()
+        self.column.addItems(columns)
+        self.pattern = QLineEdit(self)
+        self.pattern.setPlaceholderText('Regex, empty replaces whole value')
+        self.value = QLineEdit(self)
+        self.value.setPlaceholderText('New value')
+        self.previewbutton = QPushButton('Preview')
+        self.previewbutton.setDefault(True)
+        self.previewbutton.setAutoDefault(True)
+        self.previewbutton.clicked.connect(lambda: self.emitchoice(False))
+        self.button = QPushButton('Replace')
+        self.button.clicked.connect(lambda: self.emitchoice(True))
+        self.preview = QLabel('') # what will change
+        self.layout = QGridLayout()
+        self.layout.addWidget(self.label, 1, 1, 1, 4)
+        self.layout.addWidget(self.query, 2, 1, 1, 4)
+        self.layout.addWidget(self.column, 3, 1)
+        self.layout.addWidget(self.pattern, 3, 2)
+        self.layout.addWidget(self.value, 3, 3)
+        self.layout.addWidget(self.previewbutton, 3, 4)
+        self.layout.addWidget(self.preview, 4, 1, 1, 3)
+        self.layout.addWidget(self.button, 4, 4)
+        self.setLayout(self.layout)
+
+    def emitchoice(self, apply):
+        self.choice.emit(self.query.text(), self.column.currentText(), self.pattern.text(), self.value.text(), apply)
 
 class SearchStopDialogue(QDialog):
     """Window for asking what to do when file end reached"""
@@ -163,4 +374,130 @@ class SearchStopDialogue(QDialog):
         message = QLabel(f"File ended. Start search from the beginning?")
         self.layout.addWidget(message)
         self.layout.addWidget(self.buttonBox)
-        self.setLayout(self.layout)
\ No newline at end of file
+        self.setLayout(self.layout)
+
+class ExportWindow(QDialog):
+    """Window for choosing sentences to export"""
+    def __init__(self, length, current, query=None):
+        super().__init__()
+        self.setWindowTitle('Export CONLL-U')
+        self.setWindowIcon(QtGui.QIcon('inside/design/main.png'))
+        self.all = QRadioButton('All sentences')
+        self.all.setChecked(True)
+        self.range = QRadioButton('Sentences from')
+        self.first = QSpinBox()
+        self.last = QSpinBox()
+        for spin, value in ((self.first, current), (self.last, length)):
+            spin.setRange(1, length)
+            spin.setValue(value)
+        self.checked = QRadioButton('Checked sentences')
+        self.query = QRadioButton(f'Sentences found by query {query}' if query else 'Sentences found by token query')
+        self.query.setEnabled(bool(query))
+        self.workers = QCheckBox('Use all processors')
+        self.buttonBox = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        self.buttonBox.accepted.connect(self.accept)
+        self.buttonBox.rejected.connect(self.reject)
+        self.layout = QGridLayout()
+        self.layout.addWidget(self.all, 1, 1)
+        self.layout.addWidget(self.range, 2, 1)
+        self.layout.addWidget(self.first, 2, 2)
+        self.layout.addWidget(QLabel('to'), 2, 3)
+        self.layout.addWidget(self.last, 2, 4)
+        self.layout.addWidget(self.checked, 3, 1)
+        self.layout.addWidget(self.query, 4, 1, 1, 4)
+        self.layout.addWidget(self.workers, 5, 1)
+        self.layout.addWidget(self.buttonBox, 6, 1, 1, 4)
+        self.setLayout(self.layout)
+
+    def selection(self):
+        """What to export: all, range, checked or query"""
+        for name in ('range', 'checked', 'query'):
+            if getattr(self, name).isChecked():
+                return name
+        return 'all'
+
+class ProgressWindow(QWidget):
+    """Checked sentences by ranges: a range is chosen with double click"""
+    choice = QtCore.pyqtSignal(int) # first sentence of range
+
+    def __init__(self, progress):
+        super().__init__()
+        self.setWindowTitle('Annotation progress')
+        self.setWindowIcon(QtGui.QIcon('inside/design/main.png'))
+        self.label = QLabel(f'Checked {progress.checked} of {progress.size} sentences ({progress.percent():.1f}%)')
+        ranges = progress.ranges()
+        self.table = QTableWidget(len(ranges), 3)
+        self.table.setHorizontalHeaderLabels(['Sentences', 'Checked', '%'])
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.table.verticalHeader().hide()
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        for row, (first, last, checked) in enumerate(ranges):
+            for column, text in enumerate((f'{first}-{last}', str(checked), f'{100 * checked / (last - first + 1):.0f}')):
+                self.table.setItem(row, column, QTableWidgetItem(text))
+        self.firsts = [first for first, last, checked in ranges]
+        self.table.cellDoubleClicked.connect(lambda row, column: self.choice.emit(self.firsts[row]))
+        self.layout = QVBoxLayout()
+        self.layout.addWidget(self.label)
+        self.layout.addWidget(self.table)
+        self.setLayout(self.layout)
+
+class TimingWindow(QWidget):
+    """Latency report of hot paths: recording is switched on here, the report can be saved as JSON"""
+    HEADERS = ('Function', 'Calls', 'Mean, ms', 'p50, ms', 'p95, ms', 'Max, ms', 'Tokens', 'Memory, KB')
+
+    def __init__(self, timings):
+        super().__init__()
+        self.timings = timings
+        self.setWindowTitle('Timings')
+        self.setWindowIcon(QtGui.QIcon('inside/design/main.png'))
+        self.record = QCheckBox('Record timings')
+        self.record.setChecked(timings.enabled)
+        self.memory = QCheckBox('Track memory (slower)')
+        self.memory.setChecked(timings.memory)
+        self.record.toggled.connect(self.switch)
+        self.memory.toggled.connect(self.switch)
+        self.table = QTableWidget(0, len(self.HEADERS))
+        self.table.setHorizontalHeaderLabels(self.HEADERS)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.table.verticalHeader().hide()
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.reset = QPushButton('Reset')
+        self.reset.clicked.connect(self.clear)
+        self.save = QPushButton('Save report')
+        self.save.clicked.connect(self.dump)
+        self.timer = QtCore.QTimer(self) # report follows new calls while the window is open
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(1000)
+        self.layout = QGridLayout()
+        self.layout.addWidget(self.record, 1, 1)
+        self.layout.addWidget(self.memory, 1, 2)
+        self.layout.addWidget(self.table, 2, 1, 1, 4)
+        self.layout.addWidget(self.reset, 3, 3)
+        self.layout.addWidget(self.save, 3, 4)
+        self.setLayout(self.layout)
+        self.resize(700, 300)
+        self.refresh()
+
+    def switch(self):
+        self.timings.enable(self.record.isChecked(), self.memory.isChecked())
+
+    def clear(self):
+        self.timings.reset()
+        self.refresh()
+
+    def refresh(self):
+        report = self.timings.report()
+        self.table.setRowCount(len(report))
+        for row, (name, summary) in enumerate(report.items()):
+            values = (name, summary['calls'], summary['mean_ms'], summary['p50_ms'], summary['p95_ms'], summary['max_ms'],
+                      summary['mean_tokens'], summary['mean_memory_kb'])
+            histogram = ', '.join(f'{bucket} ms: {count}' for bucket, count in summary['histogram'].items() if count)
+            for column, value in enumerate(values):
+                item = QTableWidgetItem('' if value is None else f'{value:.1f}' if isinstance(value, float) else str(value))
+                item.setToolTip(histogram)
+                self.table.setItem(row, column, item)
+
+    def dump(self):
+        path = QFileDialog.getSaveFileName(self, 'Save timing report', 'timings.json', 'JSON files (*.json)')[0]
+        if path:
+            self.timings.dump(path)
@@ -0,0 +1,229 @@
+"""
+Checks of annotation, the same the editor makes when leaving a sentence,
+for whole files without GUI, plus checks of dependency graphs. Run from the repository root:
+
+    python -m inside.validation corpus.conllu [-o report.json] [-j workers] [--no-feats]
+
+Exit code is 1 if there are errors, so it can be a gate before merging
+"""
+import os
+import re
+import sys
+import json
+import mmap
+import pickle
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from inside.reader import COLUMNS, Conllu, FailedToken
+from inside.project import ProjectLog
+from inside.database import ProjectDatabase, SUFFIX
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CHUNK = 5000 # sentences a worker process gets at once
+FEAT = re.compile(r"(?i)([a-z\[\]]+)=")
+
+def loadlist(name):
+    with open(os.path.join(HERE, name), 'rb') as file:
+        return pickle.load(file)
+
+# Things for checking and auto-completion of fields
+SEMSLOTS = loadlist('semslots.bin')
+SEMCLASS = loadlist('semclasses.bin')
+DEPRELS = loadlist('deprel.bin')
+FEATS = loadlist('feats.bin')
+POSLIST = loadlist('upos.bin')
+XPOSLIST = loadlist('xpos.bin')
+SEMSLOTSET, SEMCLASSET, DEPRELSET, FEATSET = set(SEMSLOTS), set(SEMCLASS), set(DEPRELS), set(FEATS)
+FEATSKNOWN = {} # feats value -> all its features are known
+DEPSHEADS = {} # deps value -> heads in it
+
+def sentenceheads(idxs):
+    """Values a head may have in sentence with these token indexes"""
+    heads = {0.0}
+    for idx in idxs:
+        if '-' not in idx:
+            try:
+                heads.add(float(idx))
+            except ValueError:
+                pass
+    return heads
+
+def checktoken(values, heads, morph=True):
+    """
+    Problems of a token as (field, level, message): values are field texts by column name,
+    heads come from sentenceheads. Errors can't be saved, warnings need the annotator's consent
+    """
+    problems = []
+    semclass, semslot, deprel, head, feats = values['semclass'], values['semslot'], values['deprel'], values['head'], values['feats']
+    if semclass not in SEMCLASSET:
+        problems.append(('semclass', 'error', f'Incorrect semantic class: {semclass}'))
+    if semslot not in SEMSLOTSET:
+        problems.append(('semslot', 'error', f'Incorrect semantic slot: {semslot}'))
+    if deprel not in DEPRELSET and deprel != '_':
+        problems.append(('deprel', 'warning', f'Unknown dependency relation: {deprel}'))
+    if not head.isdigit() and head != '_':
+        problems.append(('head', 'error', f'Incorrect head: {head}'))
+    elif head != '_' and float(head) not in heads:
+        problems.append(('head', 'warning', f'Head out of sentence boundaries: {head}'))
+    if morph and not knownfeats(feats):
+        problems.append(('feats', 'warning', f'Unknown grammatical features: {feats}'))
+    return problems
+
+def knownfeats(feats):
+    """All features of FEATS value are in our list; every distinct value is parsed once"""
+    known = FEATSKNOWN.get(feats)
+    if known is None:
+        known = FEATSKNOWN[feats] = not set(FEAT.findall(feats)) - FEATSET
+    return known
+
+def depsheads(deps):
+    """Heads in DEPS value; every distinct value is parsed once"""
+    heads = DEPSHEADS.get(deps)
+    if heads is None:
+        heads = DEPSHEADS[deps] = frozenset(part.split(':', 1)[0] for part in deps.split('|'))
+    return heads
+
+def checkgraph(idxs, heads, deps):
+    """
+    Problems of dependency graph as (token position, field, level, message):
+    cycles of heads, several roots, enhanced heads that are not in sentence.
+    Columns are given as sequences of values, everything is done in one pass over them
+    """
+    problems = []
+    words = {idx: position for position, idx in enumerate(idxs) if idx.isdigit()} # words, not multiword tokens or empty nodes
+    roots = [position for position in words.values() if heads[position] == '0']
+    parents = {position: words[heads[position]] for position in words.values() if heads[position] in words} # position -> position of head
+    for position in roots[1:]:
+        problems.append((position, 'head', 'warning', f'Several roots: {idxs[roots[0]]} and {idxs[position]}'))
+    walks = {} # position -> start of the walk up the tree that passed it
+    for start in parents:
+        position = start
+        while position in parents and position not in walks:
+            walks[position] = start
+            position = parents[position]
+        if walks.get(position) == start and position in parents: # came back to this walk: a cycle
+            cycle = [position]
+            while parents[cycle[-1]] != position:
+                cycle.append(parents[cycle[-1]])
+            problems.append((min(cycle), 'head', 'warning', f'Cycle of heads: {" -> ".join(idxs[i] for i in cycle)}'))
+    known = set(idxs) | {'0', '_'}
+    if not set().union(*map(depsheads, set(deps))) <= known: # the usual case is that all heads are there
+        for position, value in enumerate(deps):
+            if value != '_':
+                for part in value.split('|'):
+                    head = part.split(':', 1)[0]
+                    if head not in known:
+                        problems.append((position, 'deps', 'warning', f'Enhanced head {head} is not in sentence: {value}'))
+    return problems
+
+def isclean(columns, heads, morph=True):
+    """Quick check of a whole sentence by columns (column name -> values): True if checktoken has nothing to say"""
+    if not SEMCLASSET.issuperset(columns['semclass']) or not SEMSLOTSET.issuperset(columns['semslot']):
+        return False
+    if not DEPRELSET.issuperset(set(columns['deprel']) - {'_'}):
+        return False
+    for head in set(columns['head']) - {'_'}:
+        if not head.isdigit() or float(head) not in heads:
+            return False
+    return not morph or all(map(knownfeats, set(columns['feats'])))
+
+def checksentences(sents, morph=True):
+    """
+    Problems of sentences given as (key, sentence id, token lines or lists of values):
+    returns numbers of sentences and tokens and list of problems as dicts
+    """
+    problems = []
+    tokencount = 0
+    for key, sentid, tokens in sents:
+        tokencount += len(tokens)
+        tokens = [token.rstrip('\r\n').split('\t') if isinstance(token, str) else token for token in tokens]
+        rows = []
+        for position, values in enumerate(tokens, 1):
+            if len(values) != len(COLUMNS):
+                problems.append({'sentence': key, 'sent_id': sentid, 'token': position, 'id': values[0], 'field': 'line',
+                                 'value': '\t'.join(values), 'level': 'error', 'message': str(FailedToken(len(values)))})
+                continue
+            rows.append((position, values))
+        if not rows:
+            continue
+        columns = dict(zip(COLUMNS, zip(*(values for position, values in rows))))
+        heads = sentenceheads(columns['idx'])
+        if not isclean(columns, heads, morph): # in the usual case there is no need to look at every token
+            for position, values in rows:
+                values = dict(zip(COLUMNS, values))
+                for field, level, message in checktoken(values, heads, morph):
+                    problems.append({'sentence': key, 'sent_id': sentid, 'token': position, 'id': values['idx'], 'field': field,
+                                     'value': values[field], 'level': level, 'message': message})
+        for i, field, level, message in checkgraph(columns['idx'], columns['head'], columns['deps']):
+            position, values = rows[i]
+            problems.append({'sentence': key, 'sent_id': sentid, 'token': position, 'id': values[0], 'field': field,
+                             'value': values[COLUMNS.index(field)], 'level': level, 'message': message})
+    return len(sents), tokencount, problems
+
+def checkblocks(path, offsets, firstkey, morph=True):
+    """Problems of sentences between offsets of a .conllu file: runs in worker process"""
+    sents = []
+    with open(path, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for key in range(len(offsets) - 1):
+                lines = mm[offsets[key]:offsets[key + 1]].decode('utf8').splitlines()
+                sents.append((firstkey + key, lines[0][len('# sent_id = '):].strip(), [line for line in lines[1:] if line[:1].isdigit()]))
+    return checksentences(sents, morph)
+
+def validate(path, workers=None, morph=True):
+    """Check a .conllu, .cobald or .cobaldb file in worker processes, returns report as dict"""
+    tasks = []
+    if path.endswith('.conllu'):
+        with open(path, 'rb') as file:
+            if os.fstat(file.fileno()).st_size:
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    offsets = Conllu.sentenceoffsets(mm)
+            else:
+                offsets = []
+        for start in range(0, len(offsets) - 1, CHUNK):
+            tasks.append((checkblocks, path, offsets[start:start + CHUNK + 1].tolist(), start + 1, morph))
+    else:
+        data = Conllu()
+        data.load(path)
+        batch = []
+        for key, sent in data.data.items():
+            batch.append((key, sent.idx[len('# sent_id = '):], [sent.store.row(row) for row in sent.rows]))
+            if len(batch) == CHUNK:
+                tasks.append((checksentences, batch, morph))
+                batch = []
+        if batch:
+            tasks.append((checksentences, batch, morph))
+    if len(tasks) > 1 and workers != 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(run, tasks))
+    else:
+        results = list(map(run, tasks))
+    problems = [problem for result in results for problem in result[2]]
+    return {'file': path, 'sentences': sum(result[0] for result in results), 'tokens': sum(result[1] for result in results),
+            'errors': sum(problem['level'] == 'error' for problem in problems),
+            'warnings': sum(problem['level'] == 'warning' for problem in problems), 'problems': problems}
+
+def run(task):
+    return task[0](*task[1:])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check CoBaLD annotation of a .conllu or .cobald file')
+    parser.add_argument('path')
+    parser.add_argument('-o', '--output', help='write JSON report here instead of standard output')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='worker processes, all processors by default')
+    parser.add_argument('--no-feats', action='store_true', help="don't check FEATS, same as editing with morphology hidden")
+    args = parser.parse_args(argv)
+    if not args.path.endswith('.conllu') and not (os.path.exists(args.path) and (args.path.endswith(('.cobald', SUFFIX)) or ProjectLog.isproject(args.path) or ProjectDatabase.isdatabase(args.path))):
+        parser.error('expected a .conllu, .cobald or .cobaldb file')
+    report = validate(args.path, args.jobs, not args.no_feats)
+    if args.output:
+        with open(args.output, 'w', encoding='utf8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=1)
+    else:
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=1)
+        print()
+    print(f"{report['sentences']} sentences, {report['tokens']} tokens: {report['errors']} errors, {report['warnings']} warnings", file=sys.stderr)
+    return 1 if report['errors'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
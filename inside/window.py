@@ -1,38 +1,66 @@
 import os
 import re
+import bisect
 import pickle
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 import PyQt5.QtWidgets as QtWidgets
 import PyQt5.QtGui as QtGui
 import PyQt5.QtCore as QtCore
 from PyQt5.QtCore import pyqtSlot
-from inside.reader import Conllu, Token
-from inside.utils import RestoreWarning, StoreCommand, CustomQLineEdit, CorrectFieldWarning, AddRemoveTokenWindow, DeleteWarning, SetFieldWidth, SearchWindow, SearchStopDialogue
-from googletrans import Translator
-
-# Things for checking and auto-completion of fields
-SEMSLOTS = pickle.load(open('inside/semslots.bin', 'rb'))
-SEMCLASS = pickle.load(open('inside/semclasses.bin', 'rb'))
-DEPRELS = pickle.load(open('inside/deprel.bin', 'rb'))
-FEATS = pickle.load(open('inside/feats.bin', 'rb'))
-POSLIST = pickle.load(open('inside/upos.bin', 'rb'))
-XPOSLIST = pickle.load(open('inside/xpos.bin', 'rb'))
-
-SEMSLOTVARS = QtWidgets.QCompleter(SEMSLOTS)
-SEMCLASSVARS = QtWidgets.QCompleter(SEMCLASS)
-DEPRELCOMPL = QtWidgets.QCompleter(DEPRELS)
-POSCOMPL = QtWidgets.QCompleter(POSLIST)
-XPOSCOMPL = QtWidgets.QCompleter(XPOSLIST)
+from inside.reader import COLUMNS, Conllu, FailedToken
+from inside.query import QueryError
+from inside.tokengrid import TokenGrid
+from inside.utils import RestoreWarning, StoreCommand, ResetCommand, SetUndoLimit, TokenRow, RankedCompleter, CorrectFieldWarning, AddRemoveTokenWindow, DeleteWarning, SetFieldWidth, SetAutosave, SearchWindow, QueryWindow, ReplaceWindow, SearchStopDialogue, ExportWindow, ProgressWindow, TimingWindow
+from inside.translation import BatchTranslation, TranslationCache, BACKENDS
+from inside.validation import SEMSLOTS, SEMCLASS, DEPRELS, POSLIST, XPOSLIST, checktoken, checkgraph, sentenceheads, isclean
+from inside.completion import Completion
+from inside.suggestions import EMPTY, FIELDS as SUGGESTIONFIELDS
+from inside.renumbering import renumber, RenumberError
+from inside.database import SUFFIX as DBSUFFIX
+from inside.timing import TIMINGS, timed
+from inside.history import History
+from inside.replace import Replacement, ReplaceError, EDITABLE as REPLACEABLE
+
+# Things for checking and auto-completion of fields: values ranked by use in current corpus
+COMPLETIONS = {'upos': Completion(POSLIST), 'xpos': Completion(XPOSLIST), 'deprel': Completion(DEPRELS),
+               'semslot': Completion(SEMSLOTS), 'semclass': Completion(SEMCLASS)}
+
+# completers by token field
+COMPLETERS = {name: RankedCompleter(completion) for name, completion in COMPLETIONS.items()}
 
 SEMSLOTS = set(SEMSLOTS)
 SEMCLASS = set(SEMCLASS)
 
+# checks the token grid shows while editing
+CHECKS = {'semslot': lambda value: value in SEMSLOTS, 'semclass': lambda value: value in SEMCLASS, 
+          'head': lambda value: value.isdigit() or value == '_'}
+
 # Can add new languages for translation support
 LANGS = {'Hungarian': 'hu', 'Serbian': 'sr', 'Russian': 'ru', 'English': 'en', 'Turkish': 'tr', 'Czech': 'cs', 'Bulgarian': 'bg', 'Japanese': 'ja', 'Swedish': 'sv', 'German': 'de', 'Spanish': 'es', 'French': 'fr', 'Romanian': 'ro'}
 
+# Files bigger than that are imported lazily: sentences get parsed on demand
+LAZYSIZE = 64 * 1024 * 1024
+# projects are saved as a log of records or, with .cobaldb, in SQLite: opening a project and saving it as .cobaldb migrates it
+PROJECTFILTER = "CoBaLD Files (*.cobald);;CoBaLD Databases (*.cobaldb)"
+
+# Sentences longer than that are shown in a table which creates widgets only for visible cells
+GRIDSIZE = 150
+# sentences prepared while the editor is idle, by offset from shown one: it goes first, then neighbours, two ahead when moving forward
+PREFETCH = {True: (0, 1, -1, 2), False: (0, -1, 1)}
+
+def sentencelength(window, sentkey):
+    """Tokens of sentence, for timing records"""
+    return len(window.data.data[sentkey].rows)
+
 class Window(QtWidgets.QMainWindow):
     """
     Main window class
     """
+    autosaved = QtCore.pyqtSignal(object, object, object) # data, future, saved sentence keys
+    translated = QtCore.pyqtSignal(object, object, object) # data, sentence key, translation
+    translationprogress = QtCore.pyqtSignal(object, int, int, int) # job, done, failed, total
+
     def __init__(self, parent=None):
         super().__init__(parent)
 
@@ -40,13 +68,34 @@ class Window(QtWidgets.QMainWindow):
         self.data = Conllu() # must create an empty conllu instance, will be replaced later
         self.filepath = None # path to open project
         self.sentnumber = 1 # a number for go to button
+        self.shownsent = 1 # sentence currently in interface
+        self.usegrid = False # current sentence is in the table for long sentences
+        self.queryresults = None # (query, query index, its version, results) of last token query
+        self.suggested = {} # token position -> suggested (semslot, semclass) in current sentence
         self.textwidth = 300
-        self.translator = Translator()
+        self.translationbackend = 'google' # name in translation.BACKENDS, 'offline' works without network
+        self.translation = None # running translation job
+        self.translationcache = TranslationCache('inside/translations.bin')
+        self.translationdialog = None # its progress
+        self.autosaveinterval = 5 # minutes, 0 means no autosave
+        self.saver = ThreadPoolExecutor(max_workers=1) # writes project files in background
+        self.saving = None # future of running autosave
+        # before loading the last file: showing its sentence starts preparing the next ones
+        self.prefetchqueue = [] # keys of sentences to prepare, one per timer call so input goes first
+        self.prefetchtimer = QtCore.QTimer(self) # zero interval: fires whenever the event queue is empty
+        self.prefetchtimer.setInterval(0)
+        self.prefetchtimer.timeout.connect(self.prefetchnext)
 
         self.initUI()
         self.onload = True # some костыль
         self.loadsavedsettings()
         self.changefontsize()
+        self.autosaved.connect(self.onautosaved)
+        self.translated.connect(self.ontranslated)
+        self.translationprogress.connect(self.ontranslationprogress)
+        self.autosavetimer = QtCore.QTimer(self)
+        self.autosavetimer.timeout.connect(self.autosave)
+        self.setautosavetimer()
 
     def initUI(self):
         # global settings
@@ -85,6 +134,8 @@ class Window(QtWidgets.QMainWindow):
         self.statusBar = QtWidgets.QStatusBar()
         self.setStatusBar(self.statusBar)
         self.statusBar.setStyleSheet("color: #0a516d; border-top: 1px solid black;")
+        self.progresslabel = QtWidgets.QLabel() # how many sentences are checked
+        self.statusBar.addPermanentWidget(self.progresslabel)
 
         # main layout
         self.grid = QtWidgets.QVBoxLayout()
@@ -118,6 +169,12 @@ class Window(QtWidgets.QMainWindow):
         self.scrollArea.setWidgetResizable(True)
         self.scrollArea.setWidget(self.tokenwidget)
         self.tokens = QtWidgets.QVBoxLayout(self.tokenwidget)
+        self.tokens.addStretch() # no spacing
+        self.tokenrows = [] # pool of token rows, only grows
+        self.rowcount = 0 # rows showing current sentence
+        # table for very long sentences
+        self.tokengrid = TokenGrid(CHECKS, COMPLETERS, (self.addtoken, self.removetoken))
+        self.tokengrid.hide()
 
         # comment window
         self.commentTitle = QtWidgets.QLabel('Comments')
@@ -133,6 +190,7 @@ class Window(QtWidgets.QMainWindow):
         self.grid.addWidget(self.translwid)
         self.grid.addLayout(self.headercolgrid)
         self.grid.addWidget(self.scrollArea)
+        self.grid.addWidget(self.tokengrid)
         self.grid.addWidget(self.commentTitle)
         self.grid.addWidget(self.commentArea)
 
@@ -171,6 +229,7 @@ class Window(QtWidgets.QMainWindow):
         self.headercolgrid.addWidget(self.headersemclass)
         for i in reversed(range(self.headercolgrid.count())): 
                 self.headercolgrid.itemAt(i).widget().setFont(self.monospacefont)
+                self.headercolgrid.itemAt(i).widget().setVisible(not self.usegrid)
 
     def createActions(self):
         """
@@ -224,11 +283,29 @@ class Window(QtWidgets.QMainWindow):
         self.nextAction.triggered.connect(self.nextsent)
         self.nextAction.setIcon(QtGui.QIcon('inside/design/next.png'))
 
-        self.nextuncheckedAction = QtWidgets.QAction('&First unchecked')
-        self.nextuncheckedAction.setText('&First Unchecked')
+        self.nextuncheckedAction = QtWidgets.QAction('&Next unchecked')
+        self.nextuncheckedAction.setText('&Next Unchecked')
+        self.nextuncheckedAction.setShortcut(QtGui.QKeySequence('Ctrl+Shift+Return'))
         self.nextuncheckedAction.triggered.connect(self.nextuncheckedsent)
         self.nextuncheckedAction.setIcon(QtGui.QIcon('inside/design/nextunch.png'))
 
+        self.prevuncheckedAction = QtWidgets.QAction('&Previous unchecked')
+        self.prevuncheckedAction.setText('&Previous Unchecked')
+        self.prevuncheckedAction.setShortcut(QtGui.QKeySequence('Ctrl+Shift+Backspace'))
+        self.prevuncheckedAction.triggered.connect(self.prevuncheckedsent)
+
+        self.progressAction = QtWidgets.QAction('&Annotation progress')
+        self.progressAction.setText('&Annotation progress')
+        self.progressAction.triggered.connect(self.progressinitiate)
+
+        self.sessionAction = QtWidgets.QAction('&Session statistics')
+        self.sessionAction.setText('&Session statistics')
+        self.sessionAction.triggered.connect(self.sessionstats)
+
+        self.timingAction = QtWidgets.QAction('&Timings')
+        self.timingAction.setText('&Timings')
+        self.timingAction.triggered.connect(self.timinginitiate)
+
         self.prevAction = QtWidgets.QAction('&Previous')
         self.prevAction.setText('&Previous')
         self.prevAction.setShortcut(QtGui.QKeySequence('Shift+Backspace'))
@@ -240,11 +317,15 @@ class Window(QtWidgets.QMainWindow):
         self.numberloadAction.triggered.connect(self.gotosent)
         self.numberloadAction.setIcon(QtGui.QIcon('inside/design/goto.png'))
 
-        self.undoAction = self.undoStack.createUndoAction(self, self.tr("&Undo"))
+        self.undoAction = QtWidgets.QAction('&Undo')
+        self.undoAction.setText('&Undo')
         self.undoAction.setShortcut(QtGui.QKeySequence.Undo)
+        self.undoAction.triggered.connect(self.undo)
         self.undoAction.setIcon(QtGui.QIcon('inside/design/undo.png'))
-        self.redoAction = self.undoStack.createRedoAction(self, self.tr("&Redo"))
+        self.redoAction = QtWidgets.QAction('&Redo')
+        self.redoAction.setText('&Redo')
         self.redoAction.setShortcut(QtGui.QKeySequence.Redo)
+        self.redoAction.triggered.connect(self.redo)
         self.redoAction.setIcon(QtGui.QIcon('inside/design/redo.png'))
 
         self.restoreAction = QtWidgets.QAction('&Reset Sentence')
@@ -257,6 +338,15 @@ class Window(QtWidgets.QMainWindow):
         self.translAction.triggered.connect(self.translate)
         self.translAction.setIcon(QtGui.QIcon('inside/design/translate.png'))
 
+        self.translAllAction = QtWidgets.QAction('&Translate all untranslated')
+        self.translAllAction.setText('&Translate all untranslated')
+        self.translAllAction.triggered.connect(self.translateall)
+
+        self.suggestAction = QtWidgets.QAction('&Accept suggestions')
+        self.suggestAction.setText('&Accept suggestions')
+        self.suggestAction.setShortcut(QtGui.QKeySequence('Ctrl+Shift+A'))
+        self.suggestAction.triggered.connect(self.acceptsuggestions)
+
         self.addtoken = QtWidgets.QAction('&Add token at...')
         self.addtoken.setText('&Add token at...')
         self.addtoken.triggered.connect(self.addtokenat)
@@ -270,12 +360,35 @@ class Window(QtWidgets.QMainWindow):
         self.setfieldsize.setText('&Set ID and form field width...')
         self.setfieldsize.triggered.connect(self.fieldwidthsetter)
 
+        self.setautosave = QtWidgets.QAction('&Set autosave interval...')
+        self.setautosave.setText('&Set autosave interval...')
+        self.setautosave.triggered.connect(self.autosavesetter)
+
+        self.setundolimit = QtWidgets.QAction('&Set undo history size...')
+        self.setundolimit.setText('&Set undo history size...')
+        self.setundolimit.triggered.connect(self.undolimitsetter)
+
+        self.replaceAction = QtWidgets.QAction('&Replace in corpus...')
+        self.replaceAction.setText('&Replace in corpus...')
+        self.replaceAction.setShortcut(QtGui.QKeySequence('Ctrl+H'))
+        self.replaceAction.triggered.connect(self.replaceinitiate)
+
+        self.keephistoryAction = QtWidgets.QAction('&Keep undo history between sessions')
+        self.keephistoryAction.setText('&Keep undo history between sessions')
+        self.keephistoryAction.setCheckable(True)
+        self.keephistoryAction.toggled.connect(self.keephistory)
+
         self.searchAction = QtWidgets.QAction('&Search text')
         self.searchAction.setIcon(QtGui.QIcon('inside/design/search.png'))
         self.searchAction.setText('&Search text')
         self.searchAction.setShortcut(QtGui.QKeySequence.Find)
         self.searchAction.triggered.connect(self.searchtextinitiate)
 
+        self.queryAction = QtWidgets.QAction('&Query tokens')
+        self.queryAction.setText('&Query tokens')
+        self.queryAction.setShortcut(QtGui.QKeySequence('Ctrl+Shift+F'))
+        self.queryAction.triggered.connect(self.queryinitiate)
+
         self.biggerfontAction = QtWidgets.QAction('&Set font size ++')
         self.biggerfontAction.setText('&Set font size ++')
         self.biggerfontAction.setShortcut(QtGui.QKeySequence.ZoomIn)
@@ -305,8 +418,20 @@ class Window(QtWidgets.QMainWindow):
         editMenu.addAction(self.undoAction)
         editMenu.addAction(self.redoAction)
         editMenu.addAction(self.setfieldsize)
+        editMenu.addAction(self.setautosave)
+        editMenu.addAction(self.setundolimit)
+        editMenu.addAction(self.keephistoryAction)
+        editMenu.addAction(self.translAllAction)
+        editMenu.addAction(self.suggestAction)
+        editMenu.addAction(self.replaceAction)
         viewMenu = menuBar.addMenu('&View')
         viewMenu.addAction(self.searchAction)
+        viewMenu.addAction(self.queryAction)
+        viewMenu.addAction(self.prevuncheckedAction)
+        viewMenu.addAction(self.nextuncheckedAction)
+        viewMenu.addAction(self.progressAction)
+        viewMenu.addAction(self.sessionAction)
+        viewMenu.addAction(self.timingAction)
         viewMenu.addAction(self.biggerfontAction)
         viewMenu.addAction(self.smallerfontAction)
         viewMenu.addAction(self.resetfontAction)
@@ -361,18 +486,76 @@ class Window(QtWidgets.QMainWindow):
         ViewToolBar.addWidget(self.destlang)
         ViewToolBar.addAction(self.translAction)
 
+    @timed('Window.translate')
     def translate(self):
-        """Get google translations"""
+        """Get translation of current sentence"""
         if self.data.hastranslations: # not to overwrite existing translations in original conllu
             return
-        try:
-            trans = self.translator.translate(self.textwid.toPlainText(), src=self.srclang.currentText(), dest=self.destlang.currentText())
-            self.translwid.setPlainText(trans.text)
-            self.data.data[self.data.current].translation = trans.text
-        except Exception:
-            QtWidgets.QMessageBox.about(self, 'Error', "Google Translate doesn't respond")
+        self.starttranslation([(self.data.current, self.textwid.toPlainText())])
+
+    def translateall(self):
+        """Translate every sentence without translation in background"""
+        if not self.data.ready or self.data.hastranslations:
             return
-        
+        sents = self.data.untranslated()
+        if not sents:
+            self.statusBar.showMessage('All sentences have translations', 3000)
+            return
+        self.starttranslation(sents)
+
+    def starttranslation(self, sents):
+        if self.translation is not None and not self.translation.finished():
+            QtWidgets.QMessageBox.about(self, 'Error', 'Translation is already running')
+            return
+        data = self.data
+        job = BatchTranslation(BACKENDS[self.translationbackend](), sents, self.srclang.currentText(), self.destlang.currentText(),
+                               lambda key, text: self.translated.emit(data, key, text),
+                               lambda done, failed, total: self.translationprogress.emit(job, done, failed, total), self.translationcache)
+        self.translation = job
+        if len(sents) > 1:
+            self.translationdialog = QtWidgets.QProgressDialog('Translating sentences...', 'Cancel', 0, len(sents), self)
+            self.translationdialog.setWindowTitle('CoBaLD Editor')
+            self.translationdialog.canceled.connect(self.canceltranslation)
+            self.translationdialog.show()
+        job.start()
+
+    def canceltranslation(self):
+        """Stop translating, translations that came stay"""
+        if self.translation is None or self.translation.finished() or self.translation.cancelled.is_set():
+            return
+        self.translation.cancel()
+        if self.translationdialog is not None:
+            self.translationdialog.close()
+            self.translationdialog = None
+        self.statusBar.showMessage(f'Translation cancelled, {self.translation.done} sentences translated', 3000)
+        self.translationcache.save()
+
+    def ontranslated(self, data, key, text):
+        """Translation came from worker thread"""
+        if data is not self.data:
+            return # project was closed meanwhile
+        # translations of a job are undone together
+        self.data.history.record('Translation', [(key, None, 'translation', self.data.data[key].translation, text)], self.translation)
+        self.data.data[key].translation = text
+        self.data.touch(key, ('translation',))
+        if key == self.data.current:
+            self.translwid.setPlainText(text)
+
+    def ontranslationprogress(self, job, done, failed, total):
+        if job is not self.translation or job.cancelled.is_set():
+            return
+        if self.translationdialog is not None:
+            self.translationdialog.setValue(done + failed)
+        if done + failed < total:
+            return
+        self.translationcache.save()
+        if self.translationdialog is not None:
+            self.translationdialog.close()
+            self.translationdialog = None
+            self.statusBar.showMessage(f'Translated {done} sentences' + (f', {failed} failed' if failed else ''), 3000)
+        elif failed:
+            QtWidgets.QMessageBox.about(self, 'Error', "Google Translate doesn't respond")
+
     def fontsizeplus(self):
         self.fontsize += 1
         self.changefontsize()
@@ -402,22 +585,121 @@ class Window(QtWidgets.QMainWindow):
         self.searchwin.show()
         self.searchwin.choice.connect(self.searching)
 
-    @pyqtSlot(str)
-    def searching(self, choice):
+    @pyqtSlot(str, str)
+    @timed('Window.searching')
+    def searching(self, choice, mode):
         if not self.data.ready:
             return
-        for key in range(self.data.current + 1, len(self.data)):
-            if choice.lower() in self.data.data[key].text.lower():
-                self.data.current = key 
-                self.loadsenttogui(self.data.current)
-                break 
-        else:
+        attempt = self.savesent(self.data.current) # edits of current sentence must be searchable too
+        if attempt:
+            return
+        if self.data.search is None:
+            self.statusBar.showMessage('Indexing sentences...')
+            QtWidgets.QApplication.processEvents()
+        try:
+            hits = self.data.searchindex().find(choice, mode)
+        except re.error as e:
+            QtWidgets.QMessageBox.about(self, 'Error', f'Incorrect regular expression: {e}')
+            return
+        finally:
+            self.statusBar.clearMessage()
+        if not hits:
+            self.searchwin.hits.setText('Nothing found')
+            return
+        pos = bisect.bisect_right(hits, self.data.current) # first hit after current sentence
+        if pos == len(hits):
             searchquest = SearchStopDialogue()
-            if searchquest.exec():
-                self.data.current = 1
-                self.searching(choice)
-            else:
+            if not searchquest.exec():
                 self.searchwin.close()
+                return
+            pos = 0
+        self.data.current = hits[pos]
+        self.loadsenttogui(self.data.current)
+        self.searchwin.hits.setText(f'Sentence {pos + 1} of {len(hits)} found')
+
+    def queryinitiate(self):
+        self.querywin = QueryWindow()
+        self.querywin.show()
+        self.querywin.choice.connect(self.querying)
+
+    @pyqtSlot(str, int)
+    def querying(self, query, step):
+        """Move to the next or previous sentence with tokens matching query"""
+        if not self.data.ready:
+            return
+        attempt = self.savesent(self.data.current)
+        if attempt:
+            return
+        # results stay good until something gets edited
+        if self.queryresults is None or self.queryresults[:3] != (query, self.data.query, self.data.query.version):
+            self.statusBar.showMessage('Querying...')
+            QtWidgets.QApplication.processEvents()
+            try:
+                self.queryresults = (query, self.data.query, self.data.query.version, self.data.query.find(query))
+            except QueryError as e:
+                QtWidgets.QMessageBox.about(self, 'Error', str(e))
+                return
+            finally:
+                self.statusBar.clearMessage()
+        hits = self.queryresults[3]
+        if not hits:
+            self.querywin.hits.setText('Nothing found')
+            return
+        keys = [key for key, positions in hits]
+        if step > 0:
+            pos = bisect.bisect_right(keys, self.data.current) % len(keys)
+        else:
+            pos = (bisect.bisect_left(keys, self.data.current) - 1) % len(keys)
+        key, positions = hits[pos]
+        self.data.current = key
+        self.loadsenttogui(self.data.current)
+        tokens = self.data.data[key].tokens
+        self.querywin.hits.setText(f'Sentence {pos + 1} of {len(hits)}, {sum(len(found) for key, found in hits)} tokens in all. '
+                                   f'Here: {", ".join(tokens[i].idx for i in positions)}')
+
+    def replaceinitiate(self):
+        self.replacewin = ReplaceWindow(REPLACEABLE)
+        self.replacewin.show()
+        self.replacewin.choice.connect(self.replacing)
+        self.replacement = None # dry run shown in the window
+
+    @pyqtSlot(str, str, str, str, bool)
+    def replacing(self, query, column, pattern, value, apply):
+        """
+        Preview a rewrite of column in tokens matching query or make it: the preview is what gets written
+        if nothing changed since, the whole rewrite is undone in one step
+        """
+        if not self.data.ready:
+            return
+        if self.savesent(self.data.current): # shown sentence must be in the data for both
+            return
+        replacement = self.replacement
+        if replacement is None or replacement.source != (query, column, pattern, value) or replacement.stale(self.data):
+            self.statusBar.showMessage('Finding tokens...')
+            QtWidgets.QApplication.processEvents()
+            try:
+                replacement = self.replacement = Replacement(self.data, query, column, value, pattern)
+            except (QueryError, ReplaceError) as e:
+                QtWidgets.QMessageBox.about(self, 'Error', str(e))
+                return
+            finally:
+                self.statusBar.clearMessage()
+            apply = False # what is written must have been seen
+        if not apply:
+            self.replacewin.preview.setText('\n'.join(replacement.summary()))
+            return
+        try:
+            replacement.apply(self.data)
+        except ReplaceError as e:
+            QtWidgets.QMessageBox.about(self, 'Error', str(e))
+            return
+        self.replacement = None
+        completion = COMPLETIONS.get(column)
+        if completion is not None:
+            for (old, new), count in replacement.counts.items():
+                completion.update(old, new, count)
+        self.loadsenttogui(self.data.current)
+        self.replacewin.preview.setText(f'Replaced {len(replacement.changes)} values in {replacement.sentences()} sentences, undo takes them back')
 
     def addtokenat(self):
         """Get index to add a token at it"""
@@ -438,31 +720,25 @@ class Window(QtWidgets.QMainWindow):
 
     @pyqtSlot(str)
     def receive_index_fordel(self, choice):
-        """Delete token with chosen index"""
-        if not ('.' in choice or choice.isdigit()):
-            # We check what was entered - only 1.1 or 1 types allowed
-            QtWidgets.QMessageBox.about(self, 'Error', f'Incorrect index: {choice}')
-            return
-        # we find the needed token - iterating because idxs don't necessarily coincide with python list indexes
-        # we need i index in order to re-numerate the rest of the tokens later
-        for i, token in enumerate(self.data.data[self.data.current].tokens):
-            if token.idx == choice:
-                # if we try to delete a normal token with no . in index 
-                # then maybe it's not what we want
-                if '.' not in choice and token.form != '#NULL':
-                    msg = DeleteWarning()
-                    if not msg.exec():
-                        return
-                # otherwise delete
-                del self.data.data[self.data.current].tokens[i]
-                # if it's not 1.1 type token, then we have to re-numerate indexes and heads 
-                if choice.isdigit():
-                    # i - 1 states that we don't need to re-numerate anything before our deleted token
-                    # -1 means step direction
-                    self.renumerate(i - 1, -1)
-                break
-        else:
-            QtWidgets.QMessageBox.about(self, 'Error', f'No such index: {choice}')
+        """Delete tokens with chosen indexes, several ones can be separated by commas or spaces"""
+        choices = choice.replace(',', ' ').split()
+        for idx in choices:
+            if not ('.' in idx or idx.isdigit()):
+                # We check what was entered - only 1.1 or 1 types allowed
+                QtWidgets.QMessageBox.about(self, 'Error', f'Incorrect index: {idx}')
+                return
+        sent = self.data.data[self.data.current]
+        # if we try to delete a normal token with no . in index then maybe it's not what we want
+        if any('.' not in token.idx and token.form != '#NULL' for token in sent.tokens if token.idx in choices):
+            msg = DeleteWarning()
+            if not msg.exec():
+                return
+        try:
+            change = self.data.settokens(self.data.current, f'Delete tokens {" ".join(choices)}', lambda sent: renumber(sent, deleted=choices))
+        except RenumberError as e:
+            QtWidgets.QMessageBox.about(self, 'Error', str(e))
+            return
+        self.movecompletions([change])
         self.loadsenttogui(self.data.current)
 
     def fieldwidthsetter(self):
@@ -479,104 +755,160 @@ class Window(QtWidgets.QMainWindow):
         self.createcolumnheaders()
         self.loadsenttogui(self.data.current)
 
+    def autosavesetter(self):
+        self.autosavewindow = SetAutosave(self.autosaveinterval)
+        self.autosavewindow.show()
+        self.autosavewindow.choice.connect(self.autosavechanger)
+
     @pyqtSlot(str)
-    def receive_index_foradd(self, choice):
-        """
-        Add new token at a chosen index
-        """
-        if not ('.' in choice or choice.isdigit()):
-            # We check what was entered - only 1.1 or 1 types allowed
-            QtWidgets.QMessageBox.about(self, 'Error', f'Incorrect index: {choice}')
-            return
-        # create new empty token, we only fill index and form as they can't be corrected
-        # we presume that one would only create a #NULL token
-        # although there is an option to create a token with int-index... oops
-        newtoken = Token('\t'.join('_' * 12))
-        newtoken.idx = choice
-        newtoken.form = '#NULL'
-        choice = float(choice)
-        hyphen = False # a костыль for cases when we try to add a token right before \d-\d type
-        for i, token in enumerate(self.data.data[self.data.current].tokens):
-            if '-' in token.idx: 
-                continue
-            if float(token.idx) > choice:
-                # if we add a \d.\d type token - position should be after \d token
-                if i > 0 and round(choice) != choice:
-                    self.data.data[self.data.current].tokens.insert(i, newtoken)
-                # if we add an int-indexed token - position should be before idx token
-                elif i > 0 and round(choice) == choice:
-                    if '-' in self.data.data[self.data.current].tokens[i - 1].idx:
-                        self.data.data[self.data.current].tokens.insert(i - 2, newtoken)
-                        hyphen = True
-                    else:
-                        self.data.data[self.data.current].tokens.insert(i - 1, newtoken)
-                else:
-                    # probably wouldn't happen, but in case if we want to add a 0.1 token
-                    self.data.data[self.data.current].tokens = [newtoken] + self.data.data[self.data.current].tokens
-                break
-        # if we add an int-indexed token, we have to re-numerate damn everything
-        if round(choice) == choice:
-            if hyphen:
-                self.renumerate(i - 2, 1)
-            else:
-                self.renumerate(i - 1, 1)
-        self.loadsenttogui(self.data.current)
+    def autosavechanger(self, choice):
+        if not choice.isdigit():
+            QtWidgets.QMessageBox.about(self, 'Error', f'Can\'t set interval: {choice}')
+            return
+        self.autosaveinterval = int(choice)
+        self.setautosavetimer()
 
-    def renumerate(self, i, step):
-        """
-        Re-numerate method: re-numerates indexes and calls a method to re-numerate heads
-        """
-        # we choose if we deleted or added: the direction should change accordingly in order to re-numerate correctly
-        if step < 0:
-            r = range(i + 1, len(self.data.data[self.data.current].tokens))
+    def undolimitsetter(self):
+        self.undolimitwindow = SetUndoLimit(History.limit // (1024 * 1024))
+        self.undolimitwindow.show()
+        self.undolimitwindow.choice.connect(self.undolimitchanger)
+
+    @pyqtSlot(str)
+    def undolimitchanger(self, choice):
+        if not choice.isdigit() or not int(choice):
+            QtWidgets.QMessageBox.about(self, 'Error', f'Can\'t set history size: {choice}')
+            return
+        History.limit = int(choice) * 1024 * 1024
+        self.data.history.trim()
+
+    def keephistory(self, keep):
+        """History is saved next to project file from now on and read with the project"""
+        History.persist = keep
+
+    def setautosavetimer(self):
+        if self.autosaveinterval:
+            self.autosavetimer.start(self.autosaveinterval * 60000)
         else:
-            r = range(len(self.data.data[self.data.current].tokens) - 1, i, -1)
-        for j in r:
-            # just for shortening reasons
-            token = self.data.data[self.data.current].tokens[j]
-            # if we have a \d.\d token
-            if '.' in token.idx:
-                old = token.idx
-                token.idx = str(float(token.idx) + step)
-                self.renumerateheads(old, token.idx)
-            # if we have a \d-\d token
-            elif '-' in token.idx:
-                left, right = token.idx.split('-')
-                left = int(left) + step
-                right = int(right) + step
-                token.idx = f"{left}-{right}"
-            # if we have a normal int-indexed token
-            else:
-                old = token.idx
-                token.idx = str(int(token.idx) + step)
-                self.renumerateheads(old, token.idx)
+            self.autosavetimer.stop()
 
-    def renumerateheads(self, idx, newidx):
+    def autosave(self):
+        """Snapshot edited data here, write it in background thread"""
+        if not self.data.ready or not self.filepath:
+            return
+        if self.saving is not None and not self.saving.done():
+            return # previous one is still writing
+        data = self.data
+        job, keys = data.savejob(self.filepath)
+        self.saving = self.saver.submit(job)
+        # signal gets delivered in GUI thread
+        self.saving.add_done_callback(lambda future: self.autosaved.emit(data, future, keys))
+
+    def onautosaved(self, data, future, keys):
+        if future.exception() is not None:
+            data.savefailed(keys)
+            self.statusBar.showMessage(f'Autosave failed: {future.exception()}', 5000)
+        elif data is self.data:
+            self.statusBar.showMessage('Project autosaved', 3000)
+
+    def waitsaving(self):
+        """Let running autosave finish before touching project file"""
+        if self.saving is not None:
+            try:
+                self.saving.result()
+            except Exception:
+                pass # onautosaved deals with it
+
+    @pyqtSlot(str)
+    def receive_index_foradd(self, choice):
         """
-        Method to re-numerate heads both in head and deps columns
+        Add new #NULL tokens at chosen indexes, several ones can be separated by commas or spaces:
+        a token added at 3 becomes token 3 and the rest move on, a token added at 3.1 comes right after 3
         """
-        for token in self.data.data[self.data.current].tokens:
-            if token.head == idx:
-                token.head = newidx 
-            if idx in re.findall('(\d+|\d+\.\d+):', token.deps):
-                # a possible break for cases like idx == 1, we may replace 11:
-                # but probably won't happen
-                token.deps = token.deps.replace(f"{idx}:", f"{newidx}:")
+        choices = choice.replace(',', ' ').split()
+        for idx in choices:
+            if not ('.' in idx or idx.isdigit()):
+                # We check what was entered - only 1.1 or 1 types allowed
+                QtWidgets.QMessageBox.about(self, 'Error', f'Incorrect index: {idx}')
+                return
+        try:
+            change = self.data.settokens(self.data.current, f'Add tokens {" ".join(choices)}', lambda sent: renumber(sent, inserted=choices))
+        except RenumberError as e:
+            QtWidgets.QMessageBox.about(self, 'Error', str(e))
+            return
+        self.movecompletions([change])
+        self.loadsenttogui(self.data.current)
 
     def setcheckedsent(self, checked):
         """Mark sent as checked"""
-        if checked and len(self.data) > 0:
-            self.data.data[self.data.current].checked = True 
-        elif len(self.data) > 0:
-            self.data.data[self.data.current].checked = False
+        if len(self.data) > 0 and self.data.data[self.data.current].checked != bool(checked):
+            self.data.history.record('Mark checked' if checked else 'Mark unchecked', [(self.data.current, None, 'checked', not checked, bool(checked))])
+            self.data.data[self.data.current].checked = bool(checked)
+            self.data.touch(self.data.current, ('checked',))
+            self.showprogress()
 
     def restoresent(self):
         """Restore initial markup"""
         if not self.data.ready:
             return   
         warn = RestoreWarning()
-        if warn.exec():
-            self.loadsenttogui(self.data.current)
+        if not warn.exec():
+            return
+        # edits that are not saved yet are thrown away, undo brings them back
+        sent = self.data.data[self.data.current]
+        changes = [(self.commentArea.setPlainText, self.commentArea.toPlainText(), sent.comment)]
+        if self.usegrid:
+            model = self.tokengrid.tokenmodel
+            changes.append((model.setedits, dict(model.edits), {}))
+        else:
+            changes.extend((field.setText, field.text(), field.init_text) for row in self.tokenrows[:self.rowcount]
+                           for field in row.fields.values() if field.text() != field.init_text)
+        self.undoStack.push(ResetCommand(changes))
+
+    def undo(self):
+        """Undo edits of shown sentence that are not saved yet, then steps of project history"""
+        if self.undoStack.canUndo():
+            self.undoStack.undo()
+        else:
+            self.historystep(True)
+
+    def redo(self):
+        if self.undoStack.canRedo():
+            self.undoStack.redo()
+        else:
+            self.historystep(False)
+
+    @staticmethod
+    def movecompletions(changes, backward=False):
+        """Uses of completer values follow changes of history: changed fields and values of added and deleted tokens"""
+        moved = Counter((name, old, new) for key, position, name, old, new in changes if name in COMPLETIONS)
+        for (name, old, new), count in moved.items():
+            COMPLETIONS[name].update(*((new, old) if backward else (old, new)), count)
+        for key, position, name, old, new in changes:
+            if name != 'tokens':
+                continue
+            for tokens, count in ((old, 1 if backward else -1), (new, -1 if backward else 1)):
+                for name, completion in COMPLETIONS.items():
+                    column = COLUMNS.index(name)
+                    for values in tokens:
+                        completion.add(values[column], count)
+
+    def historystep(self, backward):
+        """
+        Undo or redo a step of project history and show the sentence it changed first.
+        Shown sentence is saved before: what was edited in it becomes a step too
+        """
+        if not self.data.ready or self.savesent(self.data.current):
+            return
+        step = self.data.undo() if backward else self.data.redo()
+        if step is None:
+            self.statusBar.showMessage('Nothing to undo' if backward else 'Nothing to redo', 3000)
+            return
+        self.movecompletions(step.changes, backward)
+        self.data.current = step.changes[0][0]
+        self.loadsenttogui(self.data.current)
+        self.showprogress()
+        sentences = len({change[0] for change in step.changes})
+        self.statusBar.showMessage(f'{"Undone" if backward else "Redone"}: {step.label}' + (f' in {sentences} sentences' if sentences > 1 else ''), 3000)
 
     def prevsent(self):
         """Move to previous sentence"""
@@ -601,18 +933,65 @@ class Window(QtWidgets.QMainWindow):
             self.loadsenttogui(self.data.current)
 
     def nextuncheckedsent(self):
-        """Move to the first unchecked sent by searching through data"""
+        """Move to the next unchecked sentence after current one"""
+        self.gounchecked(self.data.progressindex().next)
+
+    def prevuncheckedsent(self):
+        """Move to the previous unchecked sentence before current one"""
+        self.gounchecked(self.data.progressindex().previous)
+
+    def gounchecked(self, find):
         if not self.data.ready:
             return
-        for key, sent in self.data.data.items():
-            if not sent.checked:
-                attempt = self.savesent(self.data.current)
-                if attempt:
-                    return
-                self.data.current = key 
-                break
+        key = find(self.data.current)
+        if key is None:
+            self.statusBar.showMessage('All sentences are checked', 3000)
+            return
+        attempt = self.savesent(self.data.current)
+        if attempt:
+            return
+        self.data.current = key
         self.loadsenttogui(self.data.current)
 
+    def showprogress(self):
+        """Checked sentences in status bar"""
+        if not self.data.ready:
+            self.progresslabel.setText('')
+            return
+        progress = self.data.progressindex()
+        self.progresslabel.setText(f'Checked {progress.checked} of {progress.size} ({progress.percent():.1f}%)')
+
+    def progressinitiate(self):
+        """Window with checked sentences by ranges"""
+        if not self.data.ready:
+            return
+        self.progresswin = ProgressWindow(self.data.progressindex())
+        self.progresswin.choice.connect(self.gotorange)
+        self.progresswin.show()
+
+    def sessionstats(self):
+        """What was edited since the corpus was opened"""
+        edits = self.data.edits
+        lines = [f'Sentences edited: {len(self.data.touched)}', f'Unsaved sentences: {len(self.data.dirty)}', f'Values changed: {sum(edits.values())}']
+        lines.extend(f'    {name}: {count}' for name, count in edits.most_common())
+        QtWidgets.QMessageBox.about(self, 'Session statistics', '\n'.join(lines))
+
+    def timinginitiate(self):
+        """Latency report: recording is off until it is switched on there"""
+        self.timingwin = TimingWindow(TIMINGS)
+        self.timingwin.show()
+
+    @pyqtSlot(int)
+    def gotorange(self, first):
+        """Go to the first unchecked sentence of a range chosen in progress window"""
+        key = self.data.progressindex().next(first - 1)
+        if key is not None and key != self.data.current:
+            attempt = self.savesent(self.data.current)
+            if attempt:
+                return
+            self.data.current = key
+            self.loadsenttogui(self.data.current)
+
     def gotosent(self):
         """Jump to sentence by number"""
         if not self.data.ready:
@@ -644,8 +1023,17 @@ class Window(QtWidgets.QMainWindow):
             return
         self.loadsenttogui(self.data.current)
 
+    @timed('Window.loadsenttogui', sentencelength)
     def loadsenttogui(self, sentkey):
         """Loading sentence to interface"""
+        try:
+            self.data.data[sentkey] # lazy data parses sentence here
+        except FailedToken as e:
+            QtWidgets.QMessageBox.about(self, 'Error', f'Something is wrong with the tokens in sentence {sentkey}: {e}')
+            self.data.current = self.shownsent # stay where we are
+            return
+        forward = sentkey >= self.shownsent
+        self.shownsent = sentkey
         self.gotonumber.setValue(sentkey) # update qspinbox
         if self.data.data[sentkey].checked:
             self.checkedsent.setChecked(True)
@@ -654,169 +1042,198 @@ class Window(QtWidgets.QMainWindow):
         self.numberwid.setText(f'Sentence № {sentkey}')
         self.textwid.setPlainText(self.data.data[sentkey].text)
         self.translwid.setPlainText(self.data.data[sentkey].translation)
-        if self.tokens.count(): # if self.tokens widget is not empty we must clear it
-            self.clearLayout(self.tokens)
-        # filling self.tokens with new token widgets
-        for token in self.data.data[sentkey].tokens:
-            tokenlayout = QtWidgets.QHBoxLayout() # a horisontal layout for a token
-            # morphosyntax widgets
-            tokeninfo = QtWidgets.QLabel(f"{token.idx}\t{token.form}")
-            # add context menu to add\remove tokens
-            tokeninfo.setContextMenuPolicy(QtCore.Qt.ActionsContextMenu)
-            tokeninfo.addAction(self.addtoken)
-            tokeninfo.addAction(self.removetoken)
-            tokeninfo.setFixedWidth(self.textwidth)
-            tokenlemma = CustomQLineEdit(token.lemma)
-            tokenlemma.setFixedWidth(self.textwidth)
-            tokenlemma.editingFinished.connect(self.storeFieldText)
-            tokenpos = CustomQLineEdit(token.upos)
-            tokenpos.setFixedWidth(75)
-            tokenpos.setCompleter(POSCOMPL)
-            tokenpos.editingFinished.connect(self.storeFieldText)
-            tokenxpos = CustomQLineEdit(token.xpos)
-            tokenxpos.setFixedWidth(150)
-            tokenxpos.setCompleter(XPOSCOMPL)
-            tokenpos.editingFinished.connect(self.storeFieldText)
-            tokenfeats = CustomQLineEdit(token.feats)
-            tokenfeats.editingFinished.connect(self.storeFieldText)
-            tokenfeats.setCursorPosition(0)
-            tokenhead = CustomQLineEdit(token.head)
-            tokenhead.setFixedWidth(55)
-            tokenhead.editingFinished.connect(self.storeFieldText)
-            tokendeprel = CustomQLineEdit(token.deprel)
-            tokendeprel.setFixedWidth(150)
-            tokendeprel.setCompleter(DEPRELCOMPL)
-            tokendeprel.editingFinished.connect(self.storeFieldText)
-            tokendeps = CustomQLineEdit(token.deps)
-            # tokendeps.setFixedWidth(200)
-            tokendeps.editingFinished.connect(self.storeFieldText)
-            # add semantics
-            tokensemslot = CustomQLineEdit(token.semslot)
-            tokensemslot.editingFinished.connect(self.storeFieldText)
-            tokensemslot.setCompleter(SEMSLOTVARS)
-            tokensemclass = CustomQLineEdit(token.semclass)
-            tokensemclass.editingFinished.connect(self.storeFieldText)
-            tokensemclass.setCompleter(SEMCLASSVARS)
-
-            # tokenlayout.addWidget(tokenms)
-            tokenlayout.addWidget(tokeninfo)
-            tokenlayout.addWidget(tokenlemma)
-            tokenlayout.addWidget(tokenpos)
-            tokenlayout.addWidget(tokenxpos)
-            if not self.nomorph:
-                tokenlayout.addWidget(tokenfeats)
-            tokenlayout.addWidget(tokenhead)
-            tokenlayout.addWidget(tokendeprel)
-            tokenlayout.addWidget(tokendeps)
-            tokenlayout.addWidget(tokensemslot)
-            tokenlayout.addWidget(tokensemclass)
-            self.tokens.addLayout(tokenlayout)
-        self.tokens.addStretch() # no spacing
-        self.tokens.update()
-        self.grid.update()
+        tokens = self.data.data[sentkey].tokens
+        self.suggested = self.suggest(tokens)
+        self.showgrid(len(tokens) > GRIDSIZE)
+        if self.usegrid:
+            self.tokengrid.setsentence(tokens, self.textwidth, not self.nomorph, self.suggested)
+            tokens = [] # no rows needed
+        self.growrows(len(tokens))
+        for i, (row, token) in enumerate(zip(self.tokenrows, tokens)):
+            row.bind(token, self.textwidth, not self.nomorph)
+            row.suggest(self.suggested.get(i))
+            row.show()
+        self.clearLayout(len(tokens))
+        self.scrollArea.verticalScrollBar().setValue(0)
         self.commentArea.setPlainText(self.data.data[sentkey].comment)
         self.undoStack.clear() # empty undo stack
+        if self.suggested:
+            self.statusBar.showMessage(f'Suggestions for {len(self.suggested)} tokens: Ctrl+Shift+A accepts them', 3000)
+        self.prefetch(sentkey, forward)
+
+    def growrows(self, count):
+        """Rows are created only if sentence is longer than any seen before, hidden until they are bound"""
+        while len(self.tokenrows) < count:
+            row = TokenRow(COMPLETERS, (self.addtoken, self.removetoken), self.storeFieldText)
+            row.hide()
+            self.tokens.insertWidget(len(self.tokenrows), row) # before stretch
+            self.tokenrows.append(row)
+
+    def prefetch(self, sentkey, forward=True):
+        """
+        Prepare shown sentence for saving and its neighbours for showing while the editor is idle. Whatever was queued
+        for the sentence shown before is dropped: after a jump only new neighbours are worth it
+        """
+        self.prefetchqueue = [sentkey + step for step in PREFETCH[forward] if 1 <= sentkey + step <= len(self.data)]
+        if self.prefetchqueue:
+            self.prefetchtimer.start()
+        else:
+            self.prefetchtimer.stop()
+
+    def prefetchnext(self):
+        """
+        One queued sentence: lazy data parses it into its cache, stored values get checked
+        and rows for its tokens are made, so moving there only binds them
+        """
+        if not self.prefetchqueue:
+            self.prefetchtimer.stop()
+            return
+        key = self.prefetchqueue.pop(0)
+        try:
+            sent = self.data.data[key]
+            if key not in self.data.prepared:
+                self.prepare(key)
+        except (KeyError, FailedToken): # loadsenttogui tells about broken sentences when they are shown
+            return
+        if len(sent.rows) <= GRIDSIZE:
+            self.growrows(len(sent.rows))
 
+    def prepare(self, sentkey):
+        """
+        Checks of stored values of sentence: (token heads, clean without morphology, clean with it, graph problems).
+        Kept in Conllu.prepared until the sentence is edited, savesent needs no checks of tokens nobody changed
+        """
+        sent = self.data.data[sentkey]
+        store = sent.store
+        columns = {name: [store.get(name, row) for row in sent.rows] for name in ('idx', 'feats', 'head', 'deprel', 'deps', 'semslot', 'semclass')}
+        heads = sentenceheads(columns['idx'])
+        state = self.data.prepared[sentkey] = (heads, isclean(columns, heads, False), isclean(columns, heads, True),
+                                               checkgraph(columns['idx'], columns['head'], columns['deps']))
+        return state
+
+    def suggest(self, tokens):
+        """Suggested (semslot, semclass) of tokens without semantic annotation by their position"""
+        suggestions = self.data.suggestionindex()
+        suggested = {}
+        for i, token in enumerate(tokens):
+            if token.semslot in EMPTY or token.semclass in EMPTY:
+                annotation = suggestions.suggest(token.lemma, token.upos, token.deprel)
+                if annotation is not None:
+                    suggested[i] = annotation
+        return suggested
+
+    def acceptsuggestions(self):
+        """Fill empty semantic fields of current sentence with suggestions, undone in one step"""
+        if self.usegrid:
+            filled = self.tokengrid.tokenmodel.accept()
+        else:
+            filled = 0
+            self.undoStack.beginMacro('Accept suggestions')
+            for i, annotation in self.suggested.items():
+                row = self.tokenrows[i]
+                for name, value in zip(('semslot', 'semclass'), annotation):
+                    if row.fields[name].text() in EMPTY:
+                        self.undoStack.push(StoreCommand(row.fields[name], value))
+                        filled += 1
+                row.suggest(None)
+            self.undoStack.endMacro()
+        self.statusBar.showMessage(f'{filled} fields filled from suggestions', 3000)
+
+    @timed('Window.savesent', sentencelength)
     def savesent(self, sentkey):
         """Save sentence to Conllu data"""
-        for i in range(self.tokens.count() - 1): # last element is stretcher, thus -1
-            tokenlayout = self.tokens.itemAt(i) # get current token layout, i must coincide with sentence token indexes
-            try:
-                # get all fields
-                # -1 = semclass, -2 = semslot, -3 = deps, -4 = deprel, -5 = tokenhead
-                semclass = tokenlayout.itemAt(tokenlayout.count() - 1).widget().text()
-                semslot = tokenlayout.itemAt(tokenlayout.count() - 2).widget().text()
-                deps = tokenlayout.itemAt(tokenlayout.count() - 3).widget().text()
-                deprel = tokenlayout.itemAt(tokenlayout.count() - 4).widget().text()
-                head = tokenlayout.itemAt(tokenlayout.count() - 5).widget().text()
-                if self.nomorph: # -6 = xpos, -7 = upos, -8 = lemma
-                    xpos = tokenlayout.itemAt(tokenlayout.count() - 6).widget().text()
-                    upos = tokenlayout.itemAt(tokenlayout.count() - 7).widget().text()
-                    lemma = tokenlayout.itemAt(tokenlayout.count() - 8).widget().text()
-                else: # -6 = feats, -7 = xpos, -8 = upos, -9 = lemma
-                    feats = tokenlayout.itemAt(tokenlayout.count() - 6).widget().text()
-                    xpos = tokenlayout.itemAt(tokenlayout.count() - 7).widget().text()
-                    upos = tokenlayout.itemAt(tokenlayout.count() - 8).widget().text()
-                    lemma = tokenlayout.itemAt(tokenlayout.count() - 9).widget().text()
-
-                # check the fields for correctness
-                if semclass not in SEMCLASS:
-                    tokenlayout.itemAt(tokenlayout.count() - 1).widget().setStyleSheet("background-color: rgb(245, 66, 87)")
-                    QtCore.QTimer.singleShot(2000, lambda: tokenlayout.itemAt(tokenlayout.count() - 1).widget().setStyleSheet(""))
-                    QtWidgets.QMessageBox.about(self, 'Error', f'Incorrect semantic class: {semclass}')
-                    return f'!!!{semclass}'
-                if semslot not in SEMSLOTS:
-                    tokenlayout.itemAt(tokenlayout.count() - 2).widget().setStyleSheet("background-color: rgb(245, 66, 87)")
-                    QtCore.QTimer.singleShot(2000, lambda: tokenlayout.itemAt(tokenlayout.count() - 2).widget().setStyleSheet(""))
-                    QtWidgets.QMessageBox.about(self, 'Error', f'Incorrect semantic slot: {semslot}')
-                    return f'!!!{semslot}'
-                # deprel
-                if deprel not in DEPRELS and deprel != '_':
-                    # we allow to save deprels not existing in our list - just in case
-                    msg = CorrectFieldWarning('Dependency relation:', deprel)
+        # indexes don't change while saving: they come from checks of stored values, prepared ahead if possible
+        prepared = self.data.prepared.get(sentkey) or self.prepare(sentkey)
+        heads, clean = prepared[0], prepared[1 if self.nomorph else 2]
+        editable = [name for name in TokenRow.FIELDS if name != 'feats' or not self.nomorph]
+        edited = [] # (position, token, stored values, field texts, names of changed fields) of tokens to write
+        for i in range(self.tokengrid.tokenmodel.rowCount() if self.usegrid else self.rowcount): # i must coincide with sentence token indexes
+            values = self.tokengrid.tokenmodel.values(i) if self.usegrid else self.tokenrows[i].values()
+            token = self.data.data[sentkey].tokens[i]
+            stored = dict(zip(COLUMNS, token.store.row(token.row)))
+            fields = [name for name in editable if values[name] != stored[name]]
+            # check the fields for correctness: unchanged tokens of a clean sentence are known to be right
+            for field, level, message in checktoken(values, heads, not self.nomorph) if fields or not clean else ():
+                # we allow to save deprels and feats not existing in our lists - just in case
+                if field in ('deprel', 'feats'):
+                    msg = CorrectFieldWarning('Dependency relation:' if field == 'deprel' else 'Grammatical info:', values[field])
                     if not msg.exec():
-                        tokenlayout.itemAt(tokenlayout.count() - 4).widget().setStyleSheet("background-color: rgb(245, 66, 87)")
-                        QtCore.QTimer.singleShot(2000, lambda: tokenlayout.itemAt(tokenlayout.count() - 4).widget().setStyleSheet(""))
-                        return f"!!!{deprel}"
-                # head checks
-                if not head.isdigit() and head != '_':
-                    tokenlayout.itemAt(tokenlayout.count() - 5).widget().setStyleSheet("background-color: rgb(245, 66, 87)")
-                    QtCore.QTimer.singleShot(2000, lambda: tokenlayout.itemAt(tokenlayout.count() - 5).widget().setStyleSheet(""))
-                    QtWidgets.QMessageBox.about(self, 'Error', f'Incorrect head: {head}')
-                    return f'!!!{head}'
-                if head != '_' and float(head) not in {float(t.idx) for t in self.data.data[sentkey].tokens if '-' not in t.idx} | {0}:
-                    # tokenlayout.itemAt(tokenlayout.count() - 5).widget().setStyleSheet("background-color: rgb(245, 66, 87)")
-                    # QtCore.QTimer.singleShot(2000, lambda: tokenlayout.itemAt(tokenlayout.count() - 5).widget().setStyleSheet(""))
-                    QtWidgets.QMessageBox.about(self, 'Error', f'Head out of sentence boundaries: {head}')
-                    # return f'!!!{head}'
-                # check feats
-                if not self.nomorph:
-                    featlist = re.findall(r"(?i)([a-z\[\]]+)=", feats)
-                    if set(featlist) - FEATS:
-                        # we allow to save feats not existing in our list - just in case
-                        msg = CorrectFieldWarning('Grammatical info:', feats)
-                        if not msg.exec():
-                            tokenlayout.itemAt(tokenlayout.count() - 6).widget().setStyleSheet("background-color: rgb(245, 66, 87)")
-                            QtCore.QTimer.singleShot(2000, lambda: tokenlayout.itemAt(tokenlayout.count() - 6).widget().setStyleSheet(""))
-                            return f"!!!{feats}"
-                # save to conllu instance
-                self.data.data[sentkey].tokens[i].semclass = semclass
-                self.data.data[sentkey].tokens[i].semslot = semslot
-                self.data.data[sentkey].tokens[i].deps = deps
-                self.data.data[sentkey].tokens[i].deprel = deprel 
-                self.data.data[sentkey].tokens[i].head = head
-                if not self.nomorph:
-                    self.data.data[sentkey].tokens[i].feats = feats 
-                self.data.data[sentkey].tokens[i].upos = upos 
-                self.data.data[sentkey].tokens[i].xpos = xpos 
-                self.data.data[sentkey].tokens[i].lemma = lemma
-            except IndexError: # for testing purposes, normally shouldn't occur
-                print('Self tokens count', self.tokens.count(), 'total tokens', len(self.data.data[sentkey].tokens), i)
-                print(self.data.data[sentkey].text)
-                raise
-        self.data.data[sentkey].comment = self.commentArea.toPlainText()
-
-    def clearLayout(self, layout):
-        """Clear tokens from layout"""
-        if layout is not None:
-            while layout.count():
-                item = layout.takeAt(0)
-                if item is not None:
-                    if type(item) != QtWidgets.QSpacerItem: # don't need really
-                        while item.count():
-                            subitem = item.takeAt(0)
-                            widget = subitem.widget()
-                            if widget is not None:
-                                widget.setParent(None)
-                    layout.removeItem(item)
-                    # del item # may be redundant
+                        self.highlight(i, field)
+                        return f"!!!{values[field]}"
+                elif level == 'error':
+                    self.highlight(i, field)
+                    QtWidgets.QMessageBox.about(self, 'Error', message)
+                    return f'!!!{values[field]}'
+                else:
+                    QtWidgets.QMessageBox.about(self, 'Error', message)
+            if fields:
+                edited.append((i, token, stored, values, fields))
+        # all tokens are checked: save to conllu instance, only values that differ are written
+        changes = [] # for history: (sentence key, token position, field, old value, new value)
+        for i, token, stored, values, fields in edited:
+            if self.data.suggestions is not None:
+                self.data.suggestions.update(tuple(stored[name] for name in SUGGESTIONFIELDS), tuple(values[name] for name in SUGGESTIONFIELDS))
+            for name, completion in COMPLETIONS.items():
+                completion.update(stored[name], values[name])
+            for name in fields:
+                setattr(token, name, values[name])
+                changes.append((sentkey, i, name, stored[name], values[name]))
+        # whole tree is saved now, it can be checked as a whole: such problems don't stop saving
+        sent = self.data.data[sentkey]
+        if changes:
+            tokens = sent.tokens
+            problems = checkgraph([t.idx for t in tokens], [t.head for t in tokens], [t.deps for t in tokens])
+        else:
+            problems = prepared[3]
+        for i, field, level, message in problems:
+            self.highlight(i, field)
+        if problems and changes:
+            QtWidgets.QMessageBox.about(self, 'Error', '\n'.join(message for i, field, level, message in problems))
+        elif problems: # the tree was like this before: no need to stop every time the sentence is left
+            self.statusBar.showMessage('; '.join(message for i, field, level, message in problems), 5000)
+        comment = self.commentArea.toPlainText()
+        if comment != sent.comment:
+            changes.append((sentkey, None, 'comment', sent.comment, comment))
+            sent.comment = comment
+        self.data.history.record(f'Edit sentence {sentkey}', changes)
+        self.data.touch(sentkey, [name for key, position, name, old, new in changes])
+
+    def highlight(self, i, name):
+        """Mark incorrect field of i-th token for a while"""
+        if self.usegrid:
+            self.tokengrid.flash(i, name)
+            return
+        field = self.tokenrows[i].fields[name]
+        field.setStyleSheet("background-color: rgb(245, 66, 87)")
+        QtCore.QTimer.singleShot(2000, lambda: field.setStyleSheet(""))
+
+    def showgrid(self, show):
+        """Switch between token rows and token table"""
+        if show == self.usegrid:
+            return
+        self.usegrid = show
+        self.scrollArea.setVisible(not show)
+        self.tokengrid.setVisible(show)
+        for i in range(self.headercolgrid.count()): # table has headers of its own
+            self.headercolgrid.itemAt(i).widget().setVisible(not show)
+        if show:
+            self.clearLayout()
+
+    @timed('Window.clearLayout')
+    def clearLayout(self, keep=0):
+        """Hide token rows except first keep ones: they stay in pool for next sentences"""
+        for row in self.tokenrows[keep:self.rowcount]:
+            row.hide()
+        self.rowcount = keep
         
     def newProject(self):
         """Create new empty project"""
-        filename = QtWidgets.QFileDialog.getSaveFileName(self, "New file", '', "CoBaLD Files (*.cobald)")
+        filename = QtWidgets.QFileDialog.getSaveFileName(self, "New file", '', PROJECTFILTER)
         if filename:
             filepath = filename[0]
             self.filepath = filepath 
+            self.waitsaving()
+            self.data.close()
             self.data = Conllu()
             self.sentnumber = 1
             filename = os.path.splitext(os.path.basename(filepath))[0]
@@ -827,18 +1244,22 @@ class Window(QtWidgets.QMainWindow):
     def openFile(self):
         """Open file function: gets filename"""
         filename = QtWidgets.QFileDialog.getOpenFileName(None, "QFileDialog.getOpenFileName()",
-                                               "", "CoBaLD Files (*.cobald)")
+                                               "", "CoBaLD Files (*.cobald *.cobaldb)")
         filepath = filename[0]
         if not filepath:
             return
-        if filepath and filepath.endswith('cobald'): # check if we open a cobald project
+        if filepath and filepath.endswith(('.cobald', DBSUFFIX)): # check if we open a cobald project
             self.loadFile(filepath)
         else:
             QtWidgets.QMessageBox.about(self, 'Error', 'File cannot be opened!')
 
     def loadFile(self, filepath):
         """Load project file - used in open and in loadsaved"""
+        self.waitsaving()
+        self.canceltranslation()
         self.data.load(filepath)
+        self.countvalues()
+        self.showprogress()
         self.filepath = filepath
         filename = os.path.splitext(os.path.basename(filepath))[0]
         self.setWindowTitle(f"CoBaLD Editor - {filename}")
@@ -862,14 +1283,19 @@ class Window(QtWidgets.QMainWindow):
         if not filepath:
             return
         if filepath and filepath.endswith('conllu'):
+            self.waitsaving()
+            self.canceltranslation()
+            self.data.close()
             self.data = Conllu()
-            attempt = self.data.read(filepath)
+            attempt = self.data.read(filepath, lazy=os.path.getsize(filepath) > LAZYSIZE)
             if attempt == 'BAD':
                 QtWidgets.QMessageBox.about(self, 'Error', 'Something is wrong with the tokens!')
             elif attempt == 'EMPTY':
                 QtWidgets.QMessageBox.about(self, 'Error', 'File seems to be empty!')
             else:
                 self.statusBar.showMessage('CONLL-U loaded', 3000)
+                self.countvalues()
+                self.showprogress()
                 self.loadsenttogui(self.data.current)
                 if self.data.ready:
                     self.gotonumber.setMinimum(1)
@@ -883,16 +1309,18 @@ class Window(QtWidgets.QMainWindow):
         attempt = self.savesent(self.data.current)
         if attempt:
             return # save currently open sent to Conllu data
+        self.waitsaving()
         self.data.save(self.filepath)
         self.statusBar.showMessage('Project saved', 3000)
 
     def saveNewFile(self):
         """Save to new file - conllu extension only"""
-        filename = QtWidgets.QFileDialog.getSaveFileName(self, "Save file", '', "CoBaLD Files (*.cobald)")
+        filename = QtWidgets.QFileDialog.getSaveFileName(self, "Save file", '', PROJECTFILTER)
         if filename:
             attempt = self.savesent(self.data.current)
             if attempt:
                 return # save currently open sent to Conllu data
+            self.waitsaving()
             self.data.save(filename[0])
             # change current settings to new file
             self.filepath = filename[0]
@@ -904,23 +1332,55 @@ class Window(QtWidgets.QMainWindow):
         if not self.data.ready:
             QtWidgets.QMessageBox.about(self, 'Warning', 'No data to export!')
             return
+        query = self.queryresults[0] if self.queryresults is not None and self.queryresults[1] is self.data.query else None
+        dialog = ExportWindow(len(self.data), self.data.current, query)
+        if not dialog.exec():
+            return
+        selection = dialog.selection()
+        if selection == 'range':
+            keys = range(dialog.first.value(), dialog.last.value() + 1)
+        elif selection == 'checked':
+            keys = self.data.checkedkeys()
+        elif selection == 'query':
+            try:
+                keys = [key for key, positions in self.data.query.find(query)] # there may be edits since searching
+            except QueryError as e:
+                QtWidgets.QMessageBox.about(self, 'Error', str(e))
+                return
+        else:
+            keys = None
+        if keys is not None and not keys:
+            QtWidgets.QMessageBox.about(self, 'Warning', 'No sentences to export!')
+            return
         filename = QtWidgets.QFileDialog.getSaveFileName(self, "Export CONLL-U", '', "CONLL-U files (*.conllu)")
         if filename[0]:
-            self.data.write_conllu(filename[0])
-            self.statusBar.showMessage('CONLL-U exported', 3000)
+            self.data.write_conllu(filename[0], keys, None if dialog.workers.isChecked() else 1)
+            self.statusBar.showMessage(f'CONLL-U exported: {len(self.data) if keys is None else len(keys)} sentences', 3000)
 
     def closeFile(self):
         """Close current file and empty settings"""
+        self.waitsaving()
+        self.canceltranslation()
+        self.data.close()
         self.data = Conllu()
+        self.prefetch(0) # nothing to prepare
+        self.countvalues()
+        self.showprogress()
         self.textwid.setPlainText('Text')
         self.translwid.setPlainText('Translation')
         self.datalength.setText('')
-        self.clearLayout(self.tokens)
-        self.tokens.update()
+        self.clearLayout()
+        self.showgrid(False)
         self.filepath = None 
         self.checkedsent.setChecked(False)
         self.setWindowTitle("CoBaLD Editor")
 
+    def countvalues(self):
+        """Uses of completer values in the corpus, completions are ranked by them"""
+        counts = self.data.valuecounts(tuple(COMPLETIONS))
+        for name, completion in COMPLETIONS.items():
+            completion.setcounts(counts[name])
+
     def loadsavedsettings(self):
         """Load from saved settings"""
         if os.path.exists('inside/settings.bin'):
@@ -929,6 +1389,10 @@ class Window(QtWidgets.QMainWindow):
             self.nomorph = settings['nomorph']
             if not self.nomorph:
                 self.morphcheck.setChecked(True)
+            # history settings first: a kept history is read with the project
+            if settings.get('undolimit'):
+                History.limit = settings['undolimit']
+            self.keephistoryAction.setChecked(bool(settings.get('keephistory')))
             # try to open file
             if settings['lastfile'] and os.path.exists(settings['lastfile']):
                 self.data.current = settings['lastcurrent']
@@ -940,6 +1404,10 @@ class Window(QtWidgets.QMainWindow):
                 self.textwidth = settings['textwidth']
             if settings.get('fontsize'):
                 self.fontsize = settings['fontsize']
+            if settings.get('autosave') is not None:
+                self.autosaveinterval = settings['autosave']
+            if settings.get('translationbackend') in BACKENDS:
+                self.translationbackend = settings['translationbackend']
 
     def storeFieldText(self):
         """For undo/redo purposes"""
@@ -948,11 +1416,17 @@ class Window(QtWidgets.QMainWindow):
 
     def closeEvent(self, e):
         """Close app and save settings"""
+        self.canceltranslation()
+        self.translationcache.save()
+        self.waitsaving()
         self.data.save(self.filepath)
+        self.saver.shutdown()
         self.settings.setValue("size", self.size())
         self.settings.setValue("pos", self.pos())
         settings = {'lastfile': self.filepath, 'lastcurrent': self.data.current, 
                     'nomorph': self.nomorph, 'srclang': self.srclang.currentText(), 
-                    'destlang': self.destlang.currentText(), 'textwidth': self.textwidth, 'fontsize': self.fontsize}
+                    'destlang': self.destlang.currentText(), 'textwidth': self.textwidth, 'fontsize': self.fontsize,
+                    'autosave': self.autosaveinterval, 'translationbackend': self.translationbackend,
+                    'undolimit': History.limit, 'keephistory': History.persist}
         pickle.dump(settings, open('inside/settings.bin', 'wb'))
         e.accept()
\ No newline at end of file
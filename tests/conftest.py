@@ -0,0 +1,27 @@
+import pytest
+from inside.reader import Conllu
+
+CONLLU = '''# sent_id = 1
+# text = the dog runs
+1	the	the	DET	Det	_	2	det	2:det	_	Specifier_Number	CH_REFERENCE_AND_QUANTIFICATION
+2	dog	dog	NOUN	Noun	Case=Nom	3	nsubj	3:nsubj	_	Agent	ANIMAL
+3	runs	run	VERB	Verb	_	0	root	0:root	_	Predicate	BE
+
+# sent_id = 2
+# text = a dog sleeps
+1	a	a	DET	Det	_	2	det	2:det	_	Specifier_Number	CH_REFERENCE_AND_QUANTIFICATION
+2	dog	dog	NOUN	Noun	Case=Nom	3	nsubj	3:nsubj	_	Agent	ANIMAL
+3	sleeps	sleep	VERB	Verb	_	0	root	0:root	_	Predicate	BE
+
+'''
+
+@pytest.fixture
+def project(tmp_path):
+    """Project file of two sentences made from a .conllu"""
+    source = tmp_path / 'corpus.conllu'
+    source.write_text(CONLLU, encoding='utf8')
+    data = Conllu()
+    data.read(str(source))
+    path = str(tmp_path / 'corpus.cobald')
+    data.save(path)
+    return path
@@ -0,0 +1,32 @@
+import pytest
+from inside.reader import Conllu, ProjectSentences, projectsource
+from inside.suggestions import Suggestions
+
+NAMES = ('upos', 'deprel', 'semslot', 'semclass')
+
+def edited(conllu):
+    """Same edit of every corpus: lazy ones pin the sentence first"""
+    if hasattr(conllu.data, 'pin'):
+        conllu.data.pin(2)
+    conllu.data[2].tokens[1].semslot = 'Object'
+    return conllu
+
+@pytest.mark.parametrize('kind', ['conllu', 'snapshot', 'database'])
+def test_lazy_corpora_count_all_tokens(tmp_path, project, kind):
+    """Lazy corpora count saved sentences too, not only edited ones, and give the same as eager ones"""
+    eager = Conllu()
+    eager.load(project)
+    lazy = Conllu()
+    if kind == 'conllu':
+        path = str(tmp_path / 'corpus.conllu')
+        lazy.read(path, lazy=True)
+    else:
+        path = project if kind == 'snapshot' else project + 'db'
+        if kind == 'database':
+            eager.save(path)
+        lazy.data = ProjectSentences(path, projectsource(path))
+    edited(eager), edited(lazy)
+    assert lazy.valuecounts(NAMES) == eager.valuecounts(NAMES)
+    assert lazy.valuecounts(NAMES)['semslot']['Agent'] == 1
+    assert Suggestions.build(lazy).table == Suggestions.build(eager).table
+    lazy.close()
@@ -0,0 +1,21 @@
+import os
+from inside.project import ProjectLog, Snapshot
+from inside.reader import Conllu
+
+def test_append_after_broken_tail(project):
+    """Records appended after a crash go in place of the broken tail, sentences stay mapped meanwhile"""
+    conllu = Conllu()
+    conllu.load(project)
+    dump = conllu.data[1].dump()
+    with open(project, 'ab') as file: # a crash while appending
+        file.write(b'\x10\x00\x00\x00broken')
+    log = ProjectLog(project)
+    meta, dumps, store = log.read()
+    assert isinstance(store, Snapshot) and dumps == {}
+    log.append(meta, [(1, dump[:1] + ('a cat runs',) + dump[2:])])
+    assert os.path.getsize(project) == log.end
+    log.append(meta, [(2, dump)]) # nothing to drop after this one
+    assert os.path.getsize(project) == log.end
+    meta, dumps, again = ProjectLog(project).read()
+    assert dumps[1][1] == 'a cat runs' and dumps[2] == dump
+    store.close(), again.close()
@@ -0,0 +1,33 @@
+import pytest
+from inside.query import QueryIndex
+from inside.reader import Conllu, ProjectSentences, projectsource
+
+QUERIES = ('upos=NOUN', 'lemma~^s & deprel=root', 'head.lemma=dog', '!upos=NOUN', 'checked=no & form=a', 'idx=1 | semslot=Agent')
+
+@pytest.mark.parametrize('kind', ['conllu', 'snapshot', 'database'])
+def test_lazy_queries_read_file_once(tmp_path, project, monkeypatch, kind):
+    """Lazy corpora find the same tokens as eager ones, postings are built for the first query only and follow edits"""
+    builds = []
+    build = QueryIndex.build
+    monkeypatch.setattr(QueryIndex, 'build', lambda self: builds.append(self) or build(self))
+    eager = Conllu()
+    eager.load(project)
+    lazy = Conllu()
+    if kind == 'conllu':
+        lazy.read(str(tmp_path / 'corpus.conllu'), lazy=True)
+    else:
+        path = project if kind == 'snapshot' else project + 'db'
+        if kind == 'database':
+            eager.save(path)
+        lazy.data = ProjectSentences(path, projectsource(path))
+    for query in QUERIES:
+        assert lazy.query.find(query) == eager.query.find(query), query
+    for conllu in (eager, lazy):
+        if hasattr(conllu.data, 'pin'):
+            conllu.data.pin(2)
+        conllu.data[2].tokens[2].lemma = 'walk'
+        conllu.touch(2, ('lemma',))
+        assert conllu.query.find('lemma=walk') == [(2, [2])]
+        assert conllu.query.find('lemma=sleep') == []
+    assert len(builds) == 1
+    lazy.close()
@@ -0,0 +1,163 @@
+import random
+import pytest
+from inside.reader import COLUMNS, Sentence
+from inside.renumbering import plan, renumber, parseid, RenumberError
+
+RUNS = 500 # random sentences every property is checked on
+RELATIONS = ('nsubj', 'obj', 'obl:on', 'conj') # relations with a colon check that only the head gets split off
+
+def token(idx, tag, head='_', deps='_'):
+    """Token values with its own tag in MISC: the tag tells which old token it was after renumbering"""
+    values = dict.fromkeys(COLUMNS, '_')
+    values.update(idx=idx, form=f'w{tag}', head=head, deps=deps, misc=tag)
+    return [values[name] for name in COLUMNS]
+
+def sentence(tokens):
+    sent = Sentence('# sent_id = 1')
+    sent.rows.extend(sent.store.extendvalues(tokens))
+    return sent
+
+def values(sent, name):
+    return [sent.store.get(name, row) for row in sent.rows]
+
+def randomids(rng):
+    """IDs of a sentence: words 1..n, empty nodes after some words (0.1 before the first one), ranges over words"""
+    words = rng.randint(1, 15) # more than 10 words make heads 1 and 11 both possible
+    idxs, word = [], 1
+    while word <= words:
+        if rng.random() < 0.2 and word < words:
+            last = rng.randint(word + 1, min(word + 3, words))
+            idxs.append(f'{word}-{last}')
+            for number in range(word, last + 1):
+                idxs.append(str(number))
+                idxs.extend(f'{number}.{empty}' for empty in range(1, rng.choice((1, 1, 1, 2)) if rng.random() < 0.1 else 1))
+            word = last + 1
+            continue
+        idxs.append(str(word))
+        idxs.extend(f'{word}.{empty}' for empty in range(1, rng.randint(2, 3) if rng.random() < 0.15 else 1))
+        word += 1
+    if rng.random() < 0.1:
+        idxs.insert(0, '0.1')
+    return idxs
+
+def randomsentence(rng):
+    """Sentence with random heads and DEPS pointing to words and empty nodes, and tags of its tokens by ID"""
+    idxs = randomids(rng)
+    nodes = [idx for idx in idxs if '-' not in idx]
+    tokens = []
+    for tag, idx in enumerate(idxs):
+        if '-' in idx:
+            tokens.append(token(idx, f'T{tag}'))
+            continue
+        head = rng.choice(['0', '_'] + [node for node in nodes if '.' not in node and node != idx])
+        deps = '|'.join(f'{rng.choice(["0"] + nodes)}:{rng.choice(RELATIONS)}' for i in range(rng.randint(0, 3))) or '_'
+        tokens.append(token(idx, f'T{tag}', head, deps))
+    return sentence(tokens), idxs
+
+def randomedit(rng, idxs):
+    """IDs to delete and to insert at, all in old numbering"""
+    deleted = rng.sample(idxs, rng.randint(0, len(idxs) // 2)) if rng.random() < 0.7 else []
+    words = sum(1 for idx in idxs if idx.isdigit())
+    inserted = []
+    for i in range(rng.randint(0, 3) if rng.random() < 0.7 else 0):
+        word = rng.randint(1, words + 1) # words + 1 adds a word at the end
+        inserted.append(str(word) if rng.random() < 0.6 else f'{word - 1}.{rng.randint(1, 3)}')
+    return inserted, deleted
+
+def checkcontiguous(ids):
+    """Words are 1..n in order, empty nodes after word n are n.1, n.2 ..., ranges come right before their first word"""
+    word = empty = 0
+    for i, idx in enumerate(ids):
+        place = parseid(idx)
+        assert place is not None, idx
+        if place[1] == 0:
+            word += 1
+            empty = 0
+            assert place[0] == word, ids
+        elif place[1] == 1:
+            empty += 1
+            assert (place[0], place[2]) == (word, empty), ids
+        else:
+            first, last = map(int, idx.split('-'))
+            assert first < last, ids
+            assert ids[i + 1] == str(first), ids # a range is never left without its first word after it
+    return word
+
+@pytest.mark.parametrize('seed', range(RUNS))
+def test_renumber_properties(seed):
+    rng = random.Random(seed)
+    sent, idxs = randomsentence(rng)
+    inserted, deleted = randomedit(rng, idxs)
+    oldtags = dict(zip(idxs, values(sent, 'misc'))) # old ID -> tag
+    before = {tag: (head, deps) for tag, head, deps in zip(values(sent, 'misc'), values(sent, 'head'), values(sent, 'deps'))}
+    mapping = renumber(sent, inserted, deleted)
+    newids, tags = values(sent, 'idx'), values(sent, 'misc')
+    words = checkcontiguous(newids)
+    # tokens that were not deleted are there in the same order, ranges only while they span two words:
+    # a range may move over empty nodes to stay right before its first word
+    kept = [idx for idx in idxs if idx not in deleted and mapping[idx] is not None]
+    assert sorted(tag for tag in tags if tag != '_') == sorted(oldtags[idx] for idx in kept)
+    assert [tag for tag, idx in zip(tags, newids) if tag != '_' and '-' not in idx] == [oldtags[idx] for idx in kept if '-' not in idx]
+    assert tags.count('_') == values(sent, 'form').count('#NULL') == len(inserted)
+    assert words == sum(1 for idx in kept if idx.isdigit()) + sum(1 for idx in inserted if idx.isdigit())
+    newid = dict(zip(tags, newids)) # tag -> new ID
+    assert all(mapping[idx] == newid[oldtags[idx]] for idx in kept)
+    def target(old):
+        """New ID of the token old ID pointed to, None if it was deleted"""
+        return old if old == '0' else None if old in deleted else newid[oldtags[old]]
+    # HEAD and DEPS point to the same tokens they did, heads that were deleted are gone
+    for row, tag in zip(sent.rows, tags):
+        head, deps = before.get(tag, ('_', '_')) # inserted tokens have none
+        assert sent.store.get('head', row) == ('_' if head == '_' else target(head) or '_'), (idxs, inserted, deleted)
+        entries = []
+        for entry in ([] if deps == '_' else deps.split('|')):
+            old, relation = entry.split(':', 1)
+            if target(old) is not None:
+                entries.append(f'{target(old)}:{relation}')
+        assert sent.store.get('deps', row) == ('|'.join(entries) or '_'), (idxs, inserted, deleted)
+
+@pytest.mark.parametrize('seed', range(RUNS))
+def test_single_insertion_takes_its_id(seed):
+    """With nothing deleted, a new word inserted at n is word n, a new empty node at n.m becomes n.m or the next free one"""
+    rng = random.Random(seed)
+    sent, idxs = randomsentence(rng)
+    words = sum(1 for idx in idxs if idx.isdigit())
+    word = rng.randint(1, words + 1)
+    if rng.random() < 0.5:
+        inserted = str(word)
+        expected = inserted
+    else:
+        empties = sum(1 for idx in idxs if idx.startswith(f'{word - 1}.'))
+        inserted = f'{word - 1}.{rng.randint(1, empties + 2)}'
+        expected = f'{word - 1}.{min(int(inserted.split(".")[1]), empties + 1)}'
+    renumber(sent, [inserted])
+    newids, tags = values(sent, 'idx'), values(sent, 'misc')
+    assert newids[tags.index('_')] == expected
+
+def test_deps_heads_sharing_digits():
+    """Head 11 in DEPS is not head 1 with something after it: each entry is renumbered as a whole"""
+    tokens = [token(str(number), f'T{number}', '0', '11:obj|1:nsubj|11.1:conj') for number in range(1, 13)]
+    tokens.insert(11, token('11.1', 'E', '_', '1:obl:on'))
+    sent = sentence(tokens)
+    renumber(sent, deleted=['1'])
+    assert values(sent, 'deps')[0] == '10:obj|10.1:conj'
+    assert values(sent, 'deps')[10] == '_' # its only head was deleted
+    sent = sentence(tokens)
+    renumber(sent, inserted=['1'])
+    assert values(sent, 'deps')[1] == '12:obj|2:nsubj|12.1:conj'
+    assert values(sent, 'deps')[12] == '2:obl:on'
+
+def test_plan_of_ranges():
+    order, mapping = plan(['1-2', '1', '2', '3-4', '3', '4'], deleted=['2', '3'])
+    assert [newidx for position, newidx in order] == ['1', '2']
+    assert mapping == {'1-2': None, '1': '1', '2': None, '3-4': None, '3': None, '4': '2'}
+    order, mapping = plan(['1-2', '1', '2'], inserted=['2'])
+    assert [newidx for position, newidx in order] == ['1-3', '1', '2', '3']
+
+def test_plan_refuses_bad_ids():
+    with pytest.raises(RenumberError):
+        plan(['1', '2'], deleted=['3'])
+    with pytest.raises(RenumberError):
+        plan(['1', '2'], inserted=['1-2'])
+    with pytest.raises(RenumberError):
+        plan(['1', '2'], inserted=['x'])
@@ -0,0 +1,32 @@
+import os
+from collections import Counter
+from inside.history import History
+from inside.suggestions import Suggestions
+
+KEY = ('dog', 'NOUN', 'nsubj')
+
+def test_suggestions_saved_for_state_of_file(project):
+    suggestions = Suggestions({KEY: Counter({('Agent', 'ANIMAL'): 2})})
+    suggestions.savejob(project)()
+    loaded = Suggestions.load(project)
+    assert loaded.table == suggestions.table and not loaded.changed
+    mtime = os.stat(project + Suggestions.suffix).st_mtime_ns
+    loaded.savejob(project)() # nothing changed: the file stays
+    assert os.stat(project + Suggestions.suffix).st_mtime_ns == mtime
+    with open(project, 'a') as file: # project file changed without its table
+        file.write('\n')
+    assert Suggestions.load(project) is None
+
+def test_history_saved_only_when_kept(project, monkeypatch):
+    history = History()
+    history.record('Edit sentence 1', [(1, 0, 'lemma', 'the', 'a')])
+    history.savejob(project)()
+    assert not os.path.exists(project + History.suffix)
+    monkeypatch.setattr(History, 'persist', True)
+    history.savejob(project)()
+    loaded = History.load(project)
+    assert [(step.label, step.changes) for step in loaded.done] == [('Edit sentence 1', [(1, 0, 'lemma', 'the', 'a')])]
+    assert not loaded.changed
+    with open(project + History.suffix, 'wb') as file: # broken file is the same as none
+        file.write(b'broken')
+    assert len(History.load(project)) == 0
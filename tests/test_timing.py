@@ -0,0 +1,18 @@
+from inside.reader import Conllu
+from inside.timing import TIMINGS
+
+def recorded(action):
+    """Timing report of what action calls"""
+    TIMINGS.reset()
+    TIMINGS.enable()
+    try:
+        action()
+    finally:
+        TIMINGS.enable(False)
+    report = TIMINGS.report()
+    TIMINGS.reset()
+    return report
+
+def test_load_is_timed(project):
+    assert recorded(lambda: Conllu().load(project))['Conllu.load']['calls'] == 1
+    assert 'Conllu.load' not in recorded(Conllu().close)
@@ -0,0 +1,92 @@
+import os
+import pickle
+import pytest
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+QtWidgets = pytest.importorskip('PyQt5.QtWidgets')
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture(scope='session')
+def app():
+    """One application for all tests: widgets go when it goes"""
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Working directory of the editor: its settings and caches go to inside/, design comes from the repo"""
+    (tmp_path / 'inside').mkdir()
+    os.symlink(os.path.join(REPO, 'inside', 'design'), tmp_path / 'inside' / 'design')
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(QtWidgets.QMessageBox, 'about', staticmethod(lambda *args: None))
+    return tmp_path
+
+WINDOWS = [] # completers are shared by all windows: a window that is deleted takes them along
+
+@pytest.fixture
+def makewindow(app, workdir):
+    from inside.window import Window
+    def make():
+        window = Window()
+        WINDOWS.append(window)
+        return window
+    yield make
+    for window in WINDOWS:
+        window.prefetchtimer.stop()
+        window.saver.shutdown()
+
+def test_window_opens_last_file(makewindow, project):
+    """Settings of an earlier run name the last file: it is loaded while the window is made"""
+    with open('inside/settings.bin', 'wb') as file:
+        pickle.dump({'nomorph': True, 'lastfile': project, 'lastcurrent': 2}, file)
+    window = makewindow()
+    assert window.filepath == project
+    assert window.data.ready and len(window.data) == 2
+    assert window.data.current == 2
+
+def test_deleting_tokens_keeps_counts(makewindow, project, monkeypatch):
+    """Suggestions and completions count deleted tokens out and get them back on undo, as many times as it goes"""
+    from inside.window import COMPLETIONS, DeleteWarning
+    monkeypatch.setattr(DeleteWarning, 'exec', lambda self: True)
+    window = makewindow()
+    window.loadFile(project)
+    suggestions = window.data.suggestionindex()
+    def counts():
+        return suggestions.table[('dog', 'NOUN', 'nsubj')][('Agent', 'ANIMAL')], COMPLETIONS['semslot'].counts['Agent']
+    assert counts() == (2, 2)
+    window.receive_index_fordel('2')
+    assert [token.form for token in window.data.data[1].tokens] == ['the', 'runs']
+    assert counts() == (1, 1)
+    for i in range(2):
+        window.undo()
+        assert counts() == (2, 2)
+        window.redo()
+        assert counts() == (1, 1)
+    window.undo()
+    window.receive_index_foradd('1')
+    assert [token.form for token in window.data.data[1].tokens] == ['#NULL', 'the', 'dog', 'runs']
+    assert counts() == (2, 2)
+    window.undo()
+    assert counts() == (2, 2) and len(window.data.data[1].tokens) == 3
+
+def test_old_graph_problems_do_not_stop_navigation(makewindow, tmp_path, monkeypatch):
+    """A cycle that was in the file is shown in the status bar when the sentence is left unedited, not in a message box"""
+    from conftest import CONLLU
+    from inside.reader import Conllu
+    source = tmp_path / 'cycle.conllu'
+    source.write_text(CONLLU.replace('3	runs	run	VERB	Verb	_	0	root', '3	runs	run	VERB	Verb	_	2	root'), encoding='utf8')
+    data = Conllu()
+    data.read(str(source))
+    path = str(tmp_path / 'cycle.cobald')
+    data.save(path)
+    messages = []
+    monkeypatch.setattr(QtWidgets.QMessageBox, 'about', staticmethod(lambda parent, title, text: messages.append(text)))
+    window = makewindow()
+    window.loadFile(path)
+    for i in range(2):
+        window.nextsent()
+        assert window.data.current == 2
+        window.prevsent()
+        assert window.data.current == 1
+    assert messages == []
+    assert 'Cycle of heads' in window.statusBar.currentMessage()